@@ -1,26 +1,26 @@
 import time
-from google.genai.types import Part, Content
-import aiohttp
-import os
-import requests
 import json
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Optional, List, Annotated
 from langgraph.channels import LastValue
 from dotenv import load_dotenv
 from io import BytesIO
-from google import genai as gai
-from google.genai import types
 from pprint import pprint
 import asyncio
-
-# --- Environment and API Setup (Unchanged) ---
+from GenAI.storage import storage
+from GenAI.providers import providers, video_poller
+from GenAI.prompt_cache import prompt_cache, prompt_version
+from GenAI.rate_limit import call_provider, estimate_tokens
+from app.progress import progress_hub
+from app import metrics
+from GenAI.checkpoint import checkpointer
+
+# --- Environment and API Setup ---
+# Groq, Gemini and Predis are reached through GenAI.providers (PROVIDER_BACKEND)
 load_dotenv()
 
-GROQ_API = os.getenv("GROQ_API")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-client = gai.Client(api_key=GOOGLE_API_KEY)
+# Reference image downloads started with the workflow, by project_id (see start_image_prefetch)
+_image_prefetch = {}
 
 # --- AgentState Definition (Unchanged) ---
 # Replace your entire AgentState class with this one
@@ -56,6 +56,29 @@ class AgentState(TypedDict):
 
     image_bytes: Optional[BytesIO]
 
+# --- Reference image prefetch ---
+
+def start_image_prefetch(project_id: str, image_ids: List[str]):
+    """
+    Start downloading the product reference images while the prompts are
+    generated, so image_agent does not wait for them after the Groq call.
+    """
+    if project_id and image_ids and project_id not in _image_prefetch:
+        _image_prefetch[project_id] = asyncio.create_task(storage.fetch_product_images(image_ids))
+
+
+async def take_prefetched_images(project_id: str, image_ids: List[str]) -> list:
+    task = _image_prefetch.pop(project_id, None)
+    if task is None:
+        return await storage.fetch_product_images(image_ids or [])
+    return await task
+
+
+def cancel_image_prefetch(project_id: str):
+    task = _image_prefetch.pop(project_id, None)
+    if task is not None:
+        task.cancel()
+
 # --- Agent and Router Functions (Largely Unchanged) ---
 # Note: The core logic of your agents is sound, so we keep them as is.
 
@@ -80,7 +103,76 @@ def manager_router(state: AgentState) -> str:
         print(f"Invalid generationDone value: {gen_status}, defaulting to END")
         return "Done"
 
-def generate_prompt(state: AgentState) -> dict:
+PROMPT_MODEL = "llama-3.1-8b-instant"
+TEXT_MODEL = "gemini-2.5-flash"
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+VIDEO_MODEL = "video"
+
+# Node -> (provider, model, prompt it needs, outputs it returns), for the metrics
+NODE_CALLS = {
+    "prompt_generator": ("groq", PROMPT_MODEL, None, ("text_prompt", "image_prompt", "video_prompt")),
+    "text_model": ("gemini", TEXT_MODEL, "text_prompt", ("text_output",)),
+    "image_model": ("gemini", IMAGE_MODEL, "image_prompt", ("image_bytes",)),
+    "image_upload_agent": ("gridfs", "GeneratedOutputsBucket", "image_prompt", ("image_output",)),
+    "video_model": ("predis", VIDEO_MODEL, "video_prompt", ("video_output",)),
+}
+
+def node_outcome(name: str, state: dict, result, error) -> str:
+    if error is not None:
+        return "failure"
+    _, _, needs, outputs = NODE_CALLS.get(name, ("none", "none", None, ()))
+    if needs and not state.get(needs):
+        return "skipped"
+    # The agents log and swallow their errors, returning None outputs instead
+    if outputs and not any((result or {}).get(key) for key in outputs):
+        return "empty"
+    return "success"
+
+def record_node_metrics(name: str, seconds: float, state: dict, result, error):
+    provider, model = NODE_CALLS.get(name, ("none", "none"))[:2]
+    metrics.observe_node(name, provider, model, seconds, node_outcome(name, state, result, error))
+
+# Callbacks observer(node, seconds, state, result, error) run after every graph node
+node_observers = [record_node_metrics]
+
+def observed(name: str, node):
+    """Wrap a graph node so node_observers see its duration and outcome."""
+    def report(started, state, result, error):
+        seconds = time.perf_counter() - started
+        for observer in node_observers:
+            try:
+                observer(name, seconds, state, result, error)
+            except Exception as e:
+                print(f"Node observer failed: {e}")
+
+    if asyncio.iscoroutinefunction(node):
+        async def run(state):
+            started = time.perf_counter()
+            try:
+                result = await node(state)
+            except Exception as e:
+                report(started, state, None, e)
+                raise
+            report(started, state, result, None)
+            return result
+    else:
+        def run(state):
+            started = time.perf_counter()
+            try:
+                result = node(state)
+            except Exception as e:
+                report(started, state, None, e)
+                raise
+            report(started, state, result, None)
+            return result
+    return run
+
+
+async def publish_prompts(state: AgentState, prompts: dict, cached: bool = False):
+    formats = [f for f in ("text", "image", "video") if prompts.get(f"{f}_prompt")]
+    await progress_hub.publish(state.get("project_id"), "prompt_generator", {"formats": formats, "cached": cached})
+
+async def generate_prompt(state: AgentState) -> dict:
     """
     Helps to recieve the information and generate accurate prompts for text, image and video output based on the user output requirement
     """
@@ -134,25 +226,34 @@ def generate_prompt(state: AgentState) -> dict:
         f"Generate highly effective prompts suitable for generating this kind of content."
     )
 
-    data = {"messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}], "model": "llama-3.1-8b-instant", "temperature": 0.7}
-    headers = {"Authorization": f"Bearer {GROQ_API}", "Content-Type": "application/json"}
+    # Identical inputs reuse earlier prompts; a changed system prompt is a new version
+    version = prompt_version(PROMPT_MODEL, system_prompt)
+    cache_inputs = {"product_name": product_name, "description": description, "discount": discount, "target_audience": target_audience, "output_format": output_format}
+    cached = await prompt_cache.get(version, cache_inputs)
+    if cached is not None:
+        print("Using cached prompts")
+        await publish_prompts(state, cached, cached=True)
+        return {"text_prompt": cached.get("text_prompt"), "image_prompt": cached.get("image_prompt"), "video_prompt": cached.get("video_prompt")}
+
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
     prompts = {"text_prompt": None, "image_prompt": None, "video_prompt": None}
 
     try:
-        response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=data, timeout=45)
-        response.raise_for_status()
-        result = response.json()["choices"][0]["message"]["content"]
+        started = time.perf_counter()
+        result = await call_provider("groq", providers.chat, PROMPT_MODEL, messages, 0.7, tokens=estimate_tokens(system_prompt, user_message, completion=600), model_name=PROMPT_MODEL)
         if result.startswith("```"):
             result = result.strip("```json").strip("```").strip()
         prompts = json.loads(result)
         print("Generated prompts:")
         pprint(prompts)
+        await prompt_cache.put(version, cache_inputs, prompts, time.perf_counter() - started)
     except Exception as e:
         print("Prompt generation failed:", e)
 
+    await publish_prompts(state, prompts)
     return {"text_prompt": prompts.get("text_prompt"), "image_prompt": prompts.get("image_prompt"), "video_prompt": prompts.get("video_prompt")}
 
-def text_agent(state: AgentState) -> dict:
+async def text_agent(state: AgentState) -> dict:
     print("--- Running Text Agent ---")
     if not state.get("text_prompt"):
         return {"text_output": None}
@@ -170,11 +271,11 @@ def text_agent(state: AgentState) -> dict:
         "Only return the marketing text — no headers, quotes, or markdown formatting."
     )
     try:
-        response = client.models.generate_content(model="gemini-2.5-flash", config=types.GenerateContentConfig(system_instruction=system_prompt), contents=text_prompt)
-        generated_text = response.text.strip()
+        response = await call_provider("gemini", providers.generate_text, TEXT_MODEL, system_prompt, text_prompt, tokens=estimate_tokens(system_prompt, text_prompt, completion=400), model_name=TEXT_MODEL)
+        generated_text = response.strip()
         print("✅ Text generation completed.")
-        api_url = f"https://genmark-mzoy.onrender.com/api/project/upload-generated-text/{project_id}"
-        requests.put(api_url, data={"text": generated_text}, timeout=10)
+        await storage.save_text(project_id, generated_text)
+        await progress_hub.publish(project_id, "text_ready")
         return {"text_output": generated_text}
     except Exception as e:
         print(f"❌ Text generation failed: {e}")
@@ -185,29 +286,20 @@ async def image_agent(state: dict) -> dict:
     if not state.get("image_prompt"):
         return {"image_bytes": None}
     prompt, project_id, image_ids = state["image_prompt"], state.get("project_id"), state.get("image_ids")
-    parts = [Part(text=(
+    image_prompt = (
         "You are an expert marketing image generator.\n"
         "Always preserve the product's exact appearance as seen in the uploaded image(s).\n"
         "Only generate the background, context, or marketing setting based on the prompt below:\n\n"
         f"{prompt}"
-    ))]
-    async with aiohttp.ClientSession() as session:
-        for image_id in image_ids:
-            api_url = f"https://genmark-mzoy.onrender.com/api/project/uploaded/image/{image_id}"
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    image_data = await response.read()
-                    content_type = response.headers.get('content-type', 'image/jpeg')
-                    parts.append(Part(inline_data={"mime_type": content_type, "data": image_data}))
-    if len(parts) == 1:
+    )
+    images = await take_prefetched_images(project_id, image_ids)
+    if not images:
         return {"image_bytes": None, "project_id": project_id}
     try:
-        response = client.models.generate_content(model="gemini-2.0-flash-preview-image-generation", contents=Content(parts=parts), config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE']))
-        for part in response.candidates[0].content.parts:
-            if part.inline_data:
-                image_bytes = BytesIO(part.inline_data.data)
-                print("✅ Image generation completed.")
-                return {"image_bytes": image_bytes, "project_id": project_id}
+        image_data = await call_provider("gemini", providers.generate_image, IMAGE_MODEL, image_prompt, images, tokens=estimate_tokens(prompt, completion=1290), model_name=IMAGE_MODEL)
+        if image_data:
+            print("✅ Image generation completed.")
+            return {"image_bytes": BytesIO(image_data), "project_id": project_id}
         return {"image_bytes": None, "project_id": project_id}
     except Exception as e:
         print(f"❌ Image generation failed: {e}")
@@ -215,59 +307,52 @@ async def image_agent(state: dict) -> dict:
 
 async def image_upload_agent(state: dict) -> dict:
     print("--- Running Image Upload Agent ---")
+    if "image_bytes" not in state and state.get("image_prompt"):
+        # Resumed from a checkpoint, which never holds the image bytes: generate again
+        state = {**state, **(await image_agent(state))}
     image_bytes, project_id, product_name = state.get("image_bytes"), state.get("project_id"), state.get("product_name")
     if not image_bytes or not project_id:
         return {"image_output": None}
-    api_url = f"https://genmark-mzoy.onrender.com/api/project/upload-generated-image/{project_id}"
-    async with aiohttp.ClientSession() as session:
-        data = aiohttp.FormData()
-        data.add_field(name="image_output", value=image_bytes.getvalue(), filename=f"{product_name}.jpg", content_type="image/jpeg")
-        async with session.put(api_url, data=data) as res:
-            if res.status == 200:
-                print("✅ Image uploaded to server.")
-                return {"image_output": f"{product_name}.jpg"}
-            else:
-                return {"image_output": None}
-
-def video_agent(state: AgentState) -> dict:
+    try:
+        image_id = await storage.save_image(project_id, f"{product_name}.jpg", image_bytes.getvalue())
+        await progress_hub.publish(project_id, "image_uploaded", {"image_id": image_id})
+        print("✅ Image uploaded to server.")
+        return {"image_output": f"{product_name}.jpg"}
+    except Exception as e:
+        print(f"❌ Image upload failed: {e}")
+        return {"image_output": None}
+
+async def video_agent(state: AgentState) -> dict:
     print("--- Running Video Agent ---")
     if not state.get("video_prompt"):
         return {"video_output": None}
     try:
-        brand_id, api_key = os.getenv("PREDIS_BRAND_ID"), os.getenv("PREDIS_API_KEY")
         prompt, project_id = state["video_prompt"], state.get("project_id")
-        response = requests.post("https://brain.predis.ai/predis_api/v1/create_content/", data={"brand_id": brand_id, "text": prompt, "media_type": "video"}, headers={"Authorization": api_key}, timeout=30)
-        response.raise_for_status()
-        post_id = response.json().get("post_ids", [None])[0]
+        post_id = await call_provider("predis", providers.predis.create_video, prompt, model_name=VIDEO_MODEL)
         if not post_id: return {"video_output": None}
-        for _ in range(15):
-            time.sleep(15)
-            res = requests.get("https://brain.predis.ai/predis_api/v1/get_posts/", params={"brand_id": brand_id, "media_type": "video", "page_n": 1, "items_n": 5}, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}, timeout=20)
-            posts = res.json().get("posts", [])
-            for post in posts:
-                if post["post_id"] == post_id and post["status"] == "completed":
-                    video_url = post.get("generated_media", [{}])[0].get("url")
-                    if video_url:
-                        print("✅ Video generation completed.")
-                        upload_res = requests.put(f"https://genmark-mzoy.onrender.com//api/project/upload-generated-video/{project_id}", data={"video_output": video_url}, timeout=10)
-                        return {"video_output": video_url}
+        # One shared poller watches every outstanding post
+        video_url = await video_poller.wait_for(post_id)
+        if video_url:
+            print("✅ Video generation completed.")
+            await storage.save_video(project_id, video_url)
+            await progress_hub.publish(project_id, "video_ready", {"video_url": video_url})
+            return {"video_output": video_url}
         return {"video_output": None}
     except Exception as e:
         print(f"❌ Video generation failed: {e}")
         return {"video_output": None}
 
-def router_op(state: AgentState) -> dict:
+async def router_op(state: AgentState) -> dict:
     print("--- Running Final Router Operation (Sync Point) ---")
     project_id = state.get("project_id")
     try:
-        api_url = f"https://genmark-mzoy.onrender.com/api/project/update/generated-output/{project_id}"
-        res = requests.put(api_url, data={"project_id": project_id}, timeout=10)
-        if res.status_code == 200:
+        if await storage.link_generated_output(project_id):
             print("✅ Generated Output Linked to project")
+            await progress_hub.publish(project_id, "router")
         else:
-            print(f"❌ Linking failed: {res.status_code}, {res.text}")
+            print(f"❌ Linking failed: no GeneratedOutput for {project_id}")
         return {"generationDone": "Generated"}
-    except requests.RequestException as e:
+    except Exception as e:
         print(f"Linking request failed: {e}")
         return {"generationDone": "Generated"}
 
@@ -276,6 +361,8 @@ def manager_agent(state: AgentState) -> dict:
     return {"generationDone": state.get("generationDone", "NotStarted")}
 
 ## NEW: Intelligent router for parallel generation
+GENERATION_BRANCHES = ["text_model", "image_model", "video_model"]
+
 def generation_router(state: AgentState) -> List[str]:
     """
     Inspects the state and decides which generation agents to run based on
@@ -298,12 +385,11 @@ def generation_router(state: AgentState) -> List[str]:
 
     if not paths_to_run:
         print("⚠️ No generation paths found. Proceeding to final router.")
-        # If no prompts exist, we send it to a non-existent node to join immediately
-        # A cleaner way is to just have all conditional paths eventually lead to the join node.
-        # LangGraph will proceed to the join node ('router') if no paths are taken.
-    
+
     print(f"🚀 Executing {len(paths_to_run)} branches in parallel...\n")
-    return paths_to_run
+    # Every branch is started (agents without a prompt return at once) so the
+    # router can wait for all of them and runs exactly once
+    return GENERATION_BRANCHES
 
 # --- Graph Definition and Compilation (MODIFIED) ---
 
@@ -311,13 +397,13 @@ def generation_router(state: AgentState) -> List[str]:
 graph = StateGraph(AgentState)
 
 # Define all the nodes
-graph.add_node("manager", manager_agent)
-graph.add_node("prompt_generator", generate_prompt)
-graph.add_node("text_model", text_agent)
-graph.add_node("image_model", image_agent) # Note: image_agent is async
-graph.add_node("image_upload_agent", image_upload_agent)
-graph.add_node("video_model", video_agent)
-graph.add_node("router", router_op) # This is our "join" node
+graph.add_node("manager", observed("manager", manager_agent))
+graph.add_node("prompt_generator", observed("prompt_generator", generate_prompt))
+graph.add_node("text_model", observed("text_model", text_agent))
+graph.add_node("image_model", observed("image_model", image_agent)) # Note: image_agent is async
+graph.add_node("image_upload_agent", observed("image_upload_agent", image_upload_agent))
+graph.add_node("video_model", observed("video_model", video_agent))
+graph.add_node("router", observed("router", router_op)) # This is our "join" node
 
 # 1. Entry point is the manager
 graph.set_entry_point("manager")
@@ -344,22 +430,18 @@ graph.add_conditional_edges(
 )
 
 # 4. Define the paths for each parallel branch
-# The text branch is simple: text_model -> join node
-graph.add_edge("text_model", "router")
-
-# The image branch is a sequence: image_model -> image_upload_agent -> join node
+# The image branch is a sequence: image_model -> image_upload_agent
 graph.add_edge("image_model", "image_upload_agent")
-graph.add_edge("image_upload_agent", "router")
 
-# The video branch is simple: video_model -> join node
-graph.add_edge("video_model", "router")
+# The text, image and video branches join in the router once all of them finished
+graph.add_edge(["text_model", "image_upload_agent", "video_model"], "router")
 
 # 5. The 'router' node acts as our synchronization point (the "join").
 # After it runs, it loops back to the manager to update the status.
 graph.add_edge("router", "manager")
 
-# Compile the graph
-app = graph.compile()
+# Compile the graph; checkpoints are kept per project (thread_id = project_id)
+app = graph.compile(checkpointer=checkpointer)
 
 
 # --- Main Execution Logic (Unchanged) ---
@@ -367,10 +449,23 @@ async def run_langgraph_for_project(project_data: dict):
     """
     Run the LangGraph workflow for a project with proper error handling and timeouts
     """
+    project_id = project_data.get("project_id")
+    config = {"configurable": {"thread_id": str(project_id)}}
     try:
-        print(f"Starting workflow for project: {project_data.get('project_id')}")
+        # An interrupted run (timeout, restart) continues from its last checkpoint:
+        # only the nodes that had not finished run again
+        checkpoint = await app.aget_state(config)
+        if checkpoint.next:
+            print(f"Resuming workflow for project: {project_id} at {list(checkpoint.next)}")
+            graph_input = None
+        else:
+            print(f"Starting workflow for project: {project_id}")
+            await checkpointer.adelete_thread(str(project_id))
+            graph_input = project_data
+            if project_data.get("generationDone") in (None, "NotStarted"):
+                start_image_prefetch(project_id, project_data.get("image_ids"))
         result = await asyncio.wait_for(
-            app.ainvoke(project_data),
+            app.ainvoke(graph_input, config),
             timeout=300  # 5 minutes timeout
         )
         print("\n🎉 Workflow completed successfully! 🎉")
@@ -380,4 +475,7 @@ async def run_langgraph_for_project(project_data: dict):
         return {"error": "Workflow timeout"}
     except Exception as e:
         print(f"❌ Workflow failed: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+    finally:
+        # Not consumed when no image prompt was generated
+        cancel_image_prefetch(project_id)
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+LangGraph checkpoints in Mongo, one thread per project (thread_id = project_id).
+
+Checkpoints go to ``GraphCheckpoints`` and the writes of unfinished steps to
+``GraphCheckpointWrites``; both expire after GRAPH_CHECKPOINT_TTL_DAYS.
+Channels in EXCLUDED_CHANNELS (the generated image bytes) are never stored:
+a resumed run regenerates what it needs instead of reading megabytes back.
+
+With AGENT_STORAGE=http (no database in this process) checkpoints are kept
+in memory only.
+"""
+import os
+from datetime import datetime
+from bson import Binary
+from dotenv import load_dotenv
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+load_dotenv()
+
+GRAPH_CHECKPOINT_TTL_DAYS = float(os.getenv("GRAPH_CHECKPOINT_TTL_DAYS", "7"))
+EXCLUDED_CHANNELS = ("image_bytes",)
+
+
+def excludes_task(writes) -> bool:
+    """
+    A task that wrote an excluded channel is not recorded at all, so a resumed
+    run executes it again instead of continuing without its output.
+    """
+    return any(channel in EXCLUDED_CHANNELS for channel, _ in writes)
+
+
+class MongoCheckpointSaver(BaseCheckpointSaver):
+    """Async-only checkpointer (the graph is always run with ``ainvoke``)."""
+
+    def __init__(self, db, ttl_days: float = GRAPH_CHECKPOINT_TTL_DAYS):
+        super().__init__()
+        self.checkpoints = db["GraphCheckpoints"]
+        self.writes = db["GraphCheckpointWrites"]
+        self.ttl_seconds = int(ttl_days * 86400)
+        self._indexed = False
+
+    async def _ensure_indexes(self):
+        if self._indexed:
+            return
+        for collection in (self.checkpoints, self.writes):
+            await collection.create_index([("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)])
+            await collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        self._indexed = True
+
+    def _dump(self, value) -> dict:
+        type_, data = self.serde.dumps_typed(value)
+        return {"type": type_, "data": Binary(data)}
+
+    def _load(self, stored: dict):
+        return self.serde.loads_typed((stored["type"], bytes(stored["data"])))
+
+    async def _tuple(self, doc: dict) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id = doc["thread_id"], doc["checkpoint_ns"], doc["checkpoint_id"]
+        writes = self.writes.find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        pending_writes = [(w["task_id"], w["channel"], self._load(w["value"])) async for w in writes]
+        parent_id = doc.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self._load(doc["checkpoint"]),
+            metadata=self._load(doc["metadata"]),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=pending_writes,
+        )
+
+    async def aget_tuple(self, config):
+        configurable = config["configurable"]
+        query = {"thread_id": configurable["thread_id"], "checkpoint_ns": configurable.get("checkpoint_ns", "")}
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            query["checkpoint_id"] = checkpoint_id
+        doc = await self.checkpoints.find_one(query, sort=[("checkpoint_id", -1)])
+        return await self._tuple(doc) if doc else None
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        query = {}
+        if config:
+            query["thread_id"] = config["configurable"]["thread_id"]
+            if config["configurable"].get("checkpoint_ns") is not None:
+                query["checkpoint_ns"] = config["configurable"]["checkpoint_ns"]
+            if get_checkpoint_id(config):
+                query["checkpoint_id"] = get_checkpoint_id(config)
+        if before and get_checkpoint_id(before):
+            query.setdefault("checkpoint_id", {})
+            if isinstance(query["checkpoint_id"], dict):
+                query["checkpoint_id"]["$lt"] = get_checkpoint_id(before)
+        for key, value in (filter or {}).items():
+            query[f"metadata_fields.{key}"] = value
+        cursor = self.checkpoints.find(query).sort("checkpoint_id", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor:
+            yield await self._tuple(doc)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self._ensure_indexes()
+        configurable = config["configurable"]
+        thread_id, checkpoint_ns = configurable["thread_id"], configurable.get("checkpoint_ns", "")
+        stored = {
+            **checkpoint,
+            "channel_values": {
+                k: v for k, v in checkpoint["channel_values"].items() if k not in EXCLUDED_CHANNELS
+            },
+        }
+        metadata = get_checkpoint_metadata(config, metadata)
+        await self.checkpoints.replace_one(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]},
+            {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+                "parent_checkpoint_id": configurable.get("checkpoint_id"),
+                "checkpoint": self._dump(stored),
+                "metadata": self._dump(metadata),
+                "metadata_fields": {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))},
+                "created_at": datetime.utcnow(),
+            },
+            upsert=True
+        )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self._ensure_indexes()
+        configurable = config["configurable"]
+        key = {
+            "thread_id": configurable["thread_id"],
+            "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+            "checkpoint_id": configurable["checkpoint_id"],
+            "task_id": task_id,
+        }
+        if excludes_task(writes):
+            return
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            document = {**key, "idx": write_idx, "channel": channel, "task_path": task_path,
+                        "value": self._dump(value), "created_at": datetime.utcnow()}
+            if write_idx >= 0:
+                # Regular writes are recorded once, special ones (errors, interrupts) replaced
+                await self.writes.update_one({**key, "idx": write_idx}, {"$setOnInsert": document}, upsert=True)
+            else:
+                await self.writes.replace_one({**key, "idx": write_idx}, document, upsert=True)
+
+    async def adelete_thread(self, thread_id):
+        await self.checkpoints.delete_many({"thread_id": str(thread_id)})
+        await self.writes.delete_many({"thread_id": str(thread_id)})
+
+
+class MemoryCheckpointSaver(InMemorySaver):
+    """In-memory checkpoints with the same channel exclusions."""
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        checkpoint = {
+            **checkpoint,
+            "channel_values": {
+                k: v for k, v in checkpoint["channel_values"].items() if k not in EXCLUDED_CHANNELS
+            },
+        }
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        if not excludes_task(writes):
+            super().put_writes(config, writes, task_id, task_path)
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    if os.getenv("AGENT_STORAGE", "mongo") == "http":
+        return MemoryCheckpointSaver()
+    from app.db import db
+    return MongoCheckpointSaver(db)
+
+
+checkpointer = get_checkpointer()
@@ -0,0 +1,159 @@
+"""
+Predis video generation, shared by every running workflow.
+
+``video_poller.wait_for(post_id)`` returns a future-backed wait: one
+background task polls ``get_posts`` for all outstanding posts at once, pages
+until it has seen them, and backs off while nothing changes. The poller stops
+when nothing is outstanding.
+
+PREDIS_API=local swaps the API for ``LocalPredis``, an in-memory stand-in
+whose posts complete after PREDIS_LOCAL_DELAY seconds. The client in use and
+its poller are built in GenAI.providers.
+"""
+import asyncio
+import os
+import time
+import uuid
+import aiohttp
+from dotenv import load_dotenv
+from GenAI.rate_limit import call_provider
+
+load_dotenv()
+
+PREDIS_API = os.getenv("PREDIS_API", "remote")
+PREDIS_BASE_URL = "https://brain.predis.ai/predis_api/v1"
+PREDIS_POLL_INTERVAL = float(os.getenv("PREDIS_POLL_INTERVAL", "5"))
+PREDIS_POLL_MAX_INTERVAL = float(os.getenv("PREDIS_POLL_MAX_INTERVAL", "60"))
+PREDIS_VIDEO_TIMEOUT = float(os.getenv("PREDIS_VIDEO_TIMEOUT", "225"))
+PREDIS_PAGE_SIZE = 20
+PREDIS_MAX_PAGES = 5
+PREDIS_LOCAL_DELAY = float(os.getenv("PREDIS_LOCAL_DELAY", "2"))
+
+FAILED_STATUSES = ("error", "failed")
+
+
+def video_url_of(post: dict):
+    return (post.get("generated_media") or [{}])[0].get("url")
+
+
+class PredisClient:
+    def __init__(self, brand_id: str = None, api_key: str = None):
+        self.brand_id = brand_id or os.getenv("PREDIS_BRAND_ID")
+        self.api_key = api_key or os.getenv("PREDIS_API_KEY")
+        self.timeout = aiohttp.ClientTimeout(total=30)
+
+    async def create_video(self, prompt: str):
+        """Start a video; returns its post_id (None when Predis gives none)."""
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.post(
+                f"{PREDIS_BASE_URL}/create_content/",
+                data={"brand_id": self.brand_id, "text": prompt, "media_type": "video"},
+                headers={"Authorization": self.api_key}
+            ) as res:
+                res.raise_for_status()
+                return ((await res.json()).get("post_ids") or [None])[0]
+
+    async def get_posts(self, page: int, items: int) -> list:
+        """Video posts of the brand, newest first."""
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.get(
+                f"{PREDIS_BASE_URL}/get_posts/",
+                params={"brand_id": self.brand_id, "media_type": "video", "page_n": page, "items_n": items},
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+            ) as res:
+                res.raise_for_status()
+                return (await res.json()).get("posts", [])
+
+
+class LocalPredis:
+    """In-memory Predis: every post completes ``delay`` seconds after creation."""
+
+    def __init__(self, delay: float = PREDIS_LOCAL_DELAY):
+        self.delay = delay
+        self.posts = []
+        self.calls = {"create_video": 0, "get_posts": 0}
+
+    async def create_video(self, prompt: str):
+        self.calls["create_video"] += 1
+        post_id = uuid.uuid4().hex
+        self.posts.insert(0, {"post_id": post_id, "created": time.monotonic(), "prompt": prompt})
+        return post_id
+
+    async def get_posts(self, page: int, items: int) -> list:
+        self.calls["get_posts"] += 1
+        now = time.monotonic()
+        posts = []
+        for post in self.posts[(page - 1) * items:page * items]:
+            done = now - post["created"] >= self.delay
+            posts.append({
+                "post_id": post["post_id"],
+                "status": "completed" if done else "inProgress",
+                "generated_media": [{"url": f"https://videos.local/{post['post_id']}.mp4"}] if done else [],
+            })
+        return posts
+
+
+class VideoPoller:
+    def __init__(self, api, interval: float = PREDIS_POLL_INTERVAL, max_interval: float = PREDIS_POLL_MAX_INTERVAL,
+                 page_size: int = PREDIS_PAGE_SIZE, max_pages: int = PREDIS_MAX_PAGES):
+        self.api = api
+        self.interval = interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pending = {}
+        self._task = None
+
+    async def wait_for(self, post_id: str, timeout: float = PREDIS_VIDEO_TIMEOUT):
+        """Video URL of ``post_id`` once Predis completes it; None on failure or timeout."""
+        future = self.pending.get(post_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[post_id] = future
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            print(f"Predis post {post_id} not ready after {timeout}s")
+            self._resolve(post_id, None)
+            return None
+
+    def _resolve(self, post_id: str, url):
+        future = self.pending.pop(post_id, None)
+        if future is not None and not future.done():
+            future.set_result(url)
+
+    async def poll_once(self) -> int:
+        """One pass over the newest posts; returns how many pending posts it resolved."""
+        resolved = 0
+        for page in range(1, self.max_pages + 1):
+            posts = await call_provider("predis", self.api.get_posts, page, self.page_size, model_name="video")
+            for post in posts:
+                post_id = post.get("post_id")
+                if post_id not in self.pending:
+                    continue
+                if post.get("status") == "completed" and video_url_of(post):
+                    self._resolve(post_id, video_url_of(post))
+                    resolved += 1
+                elif post.get("status") in FAILED_STATUSES:
+                    self._resolve(post_id, None)
+                    resolved += 1
+            if not self.pending or len(posts) < self.page_size:
+                break
+        return resolved
+
+    async def _run(self):
+        interval = self.interval
+        while self.pending:
+            await asyncio.sleep(interval)
+            try:
+                resolved = await self.poll_once()
+            except Exception as e:
+                print(f"Predis polling failed: {e}")
+                resolved = 0
+            # Poll quickly while videos keep completing, back off while nothing moves
+            interval = self.interval if resolved else min(interval * 1.5, self.max_interval)
+
+    def snapshot(self) -> dict:
+        return {"pending": len(self.pending), "running": self._task is not None and not self._task.done()}
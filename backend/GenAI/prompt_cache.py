@@ -0,0 +1,108 @@
+"""
+Cache of ``generate_prompt`` results.
+
+Entries are keyed by a hash of the model, a prompt version and the inputs the
+prompts depend on (product name, description, discount, audience, output
+format). The version is derived from the system prompt, so editing it misses
+every old entry. Lookups go through an in-memory LRU (PROMPT_CACHE_ENTRIES)
+in front of the ``PromptCache`` collection, whose entries expire after
+PROMPT_CACHE_TTL_HOURS via a TTL index.
+"""
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+import xxhash
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROMPT_CACHE_ENTRIES = int(os.getenv("PROMPT_CACHE_ENTRIES", "1024"))
+PROMPT_CACHE_TTL_HOURS = float(os.getenv("PROMPT_CACHE_TTL_HOURS", "168"))
+# Agents running apart from the API (AGENT_STORAGE=http) keep the memory tier only
+PROMPT_CACHE_MONGO = os.getenv("PROMPT_CACHE_MONGO", "0" if os.getenv("AGENT_STORAGE") == "http" else "1") == "1"
+
+
+def prompt_version(model: str, system_prompt: str) -> str:
+    return f"{model}:{xxhash.xxh3_64_hexdigest(system_prompt.encode())}"
+
+
+class PromptCache:
+    def __init__(self, max_entries: int = PROMPT_CACHE_ENTRIES, ttl_hours: float = PROMPT_CACHE_TTL_HOURS,
+                 use_mongo: bool = PROMPT_CACHE_MONGO):
+        self.max_entries = max_entries
+        self.ttl_seconds = int(ttl_hours * 3600)
+        self.use_mongo = use_mongo
+        self._entries = OrderedDict()   # key -> (prompts, latency seconds)
+        self._collection = None
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "stores": 0, "seconds_saved": 0.0}
+
+    @staticmethod
+    def make_key(version: str, inputs: dict) -> str:
+        return xxhash.xxh3_128_hexdigest(json.dumps([version, inputs], sort_keys=True, default=str).encode())
+
+    async def collection(self):
+        if self._collection is None:
+            from app.db import db
+            collection = db["PromptCache"]
+            await collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+            self._collection = collection
+        return self._collection
+
+    def _remember(self, key: str, prompts: dict, latency: float):
+        self._entries[key] = (prompts, latency)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, version: str, inputs: dict):
+        """Cached prompts for ``inputs`` under ``version``, or None."""
+        key = self.make_key(version, inputs)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            self.stats["seconds_saved"] += entry[1]
+            return entry[0]
+        if self.use_mongo:
+            try:
+                doc = await (await self.collection()).find_one({"_id": key})
+            except Exception as e:
+                print("Prompt cache lookup failed:", e)
+                doc = None
+            if doc is not None:
+                self._remember(key, doc["prompts"], doc.get("latency", 0.0))
+                self.stats["mongo_hits"] += 1
+                self.stats["seconds_saved"] += doc.get("latency", 0.0)
+                return doc["prompts"]
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, version: str, inputs: dict, prompts: dict, latency: float):
+        """Store prompts that took ``latency`` seconds to generate."""
+        key = self.make_key(version, inputs)
+        self._remember(key, prompts, latency)
+        self.stats["stores"] += 1
+        if self.use_mongo:
+            try:
+                await (await self.collection()).replace_one(
+                    {"_id": key},
+                    {"version": version, "prompts": prompts, "latency": latency, "created_at": datetime.utcnow()},
+                    upsert=True
+                )
+            except Exception as e:
+                print("Prompt cache store failed:", e)
+
+    def snapshot(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["mongo_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "seconds_saved": round(self.stats["seconds_saved"], 3),
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+prompt_cache = PromptCache()
@@ -0,0 +1,193 @@
+"""
+Backends behind the AI calls of the workflow, chosen with PROVIDER_BACKEND:
+
+- ``real`` (default): Groq, Gemini and Predis.
+- ``cassette``: replays responses recorded in PROVIDER_CASSETTE (JSON lines).
+  With PROVIDER_CASSETTE_MODE=record the real providers are called and their
+  responses appended to the file. PROVIDER_CASSETTE_LATENCY=1 replays the
+  recorded response times as well. Videos come from ``LocalPredis``.
+- ``fake``: synthetic prompts, text, images and videos after a configurable
+  delay per call, PROVIDER_FAKE_LATENCY="chat=0.3,text=0.8,image=2,video=3"
+  (seconds).
+
+Every backend offers ``chat``, ``generate_text``, ``generate_image`` and a
+Predis client as ``predis``. ``video_poller`` watches that client.
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import re
+import time
+import requests
+import xxhash
+from dotenv import load_dotenv
+from GenAI.predis import LocalPredis, PredisClient, VideoPoller, PREDIS_API
+
+load_dotenv()
+
+PROVIDER_BACKEND = os.getenv("PROVIDER_BACKEND", "real")
+PROVIDER_CASSETTE = os.getenv("PROVIDER_CASSETTE", "provider_cassette.jsonl")
+PROVIDER_CASSETTE_MODE = os.getenv("PROVIDER_CASSETTE_MODE", "replay")
+PROVIDER_CASSETTE_LATENCY = os.getenv("PROVIDER_CASSETTE_LATENCY", "0") == "1"
+PROVIDER_FAKE_LATENCY = os.getenv("PROVIDER_FAKE_LATENCY", "chat=0.3,text=0.8,image=2,video=3")
+
+
+class RealProviders:
+    def __init__(self):
+        from google import genai
+        self.client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.groq_api_key = os.getenv("GROQ_API")
+        self.predis = LocalPredis() if PREDIS_API == "local" else PredisClient()
+
+    def chat(self, model: str, messages: list, temperature: float) -> str:
+        """Groq chat completion; returns the message content."""
+        response = requests.post(
+            "https://api.groq.com/openai/v1/chat/completions",
+            headers={"Authorization": f"Bearer {self.groq_api_key}", "Content-Type": "application/json"},
+            json={"messages": messages, "model": model, "temperature": temperature},
+            timeout=45
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def generate_text(self, model: str, system_prompt: str, prompt: str) -> str:
+        from google.genai import types
+        response = self.client.models.generate_content(
+            model=model, config=types.GenerateContentConfig(system_instruction=system_prompt), contents=prompt
+        )
+        return response.text
+
+    def generate_image(self, model: str, prompt: str, images: list):
+        """Image from a prompt and reference ``images`` [(bytes, mime type)]; None when none came back."""
+        from google.genai import types
+        from google.genai.types import Part, Content
+        parts = [Part(text=prompt)] + [Part(inline_data={"mime_type": mime, "data": data}) for data, mime in images]
+        response = self.client.models.generate_content(
+            model=model, contents=Content(parts=parts),
+            config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+        )
+        for part in response.candidates[0].content.parts:
+            if part.inline_data:
+                return part.inline_data.data
+        return None
+
+
+def parse_latencies(spec: str) -> dict:
+    latencies = {"chat": 0.0, "text": 0.0, "image": 0.0, "video": 0.0}
+    for item in filter(None, spec.split(",")):
+        name, _, seconds = item.partition("=")
+        latencies[name.strip()] = float(seconds)
+    return latencies
+
+
+class FakeProviders:
+    """Synthetic responses after a fixed delay per call, no network."""
+
+    def __init__(self, latencies: dict = None):
+        self.latencies = latencies or parse_latencies(PROVIDER_FAKE_LATENCY)
+        self.predis = LocalPredis(delay=self.latencies["video"])
+        self._image = None
+
+    async def chat(self, model: str, messages: list, temperature: float) -> str:
+        await asyncio.sleep(self.latencies["chat"])
+        request = messages[-1]["content"]
+        match = re.search(r"Desired Output Format: (.*)", request)
+        formats = (match.group(1) if match else "").lower()
+        wanted = [f for f in ("text", "image", "video") if f in formats] or ["text", "image"]
+        return json.dumps({
+            f"{f}_prompt": (f"Synthetic {f} prompt for:\n{request[:200]}" if f in wanted else None)
+            for f in ("text", "image", "video")
+        })
+
+    async def generate_text(self, model: str, system_prompt: str, prompt: str) -> str:
+        await asyncio.sleep(self.latencies["text"])
+        return f"Synthetic marketing copy ({len(prompt)} characters of prompt)."
+
+    async def generate_image(self, model: str, prompt: str, images: list):
+        await asyncio.sleep(self.latencies["image"])
+        if self._image is None:
+            from PIL import Image
+            buffer = io.BytesIO()
+            Image.new("RGB", (256, 256), (40, 120, 200)).save(buffer, format="JPEG")
+            self._image = buffer.getvalue()
+        return self._image
+
+
+def _jsonable(value):
+    if isinstance(value, bytes):
+        return {"xxh3": xxhash.xxh3_128_hexdigest(value)}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    return value
+
+
+class CassetteProviders:
+    """Replays (or records) responses keyed by a hash of the request."""
+
+    def __init__(self, path: str = PROVIDER_CASSETTE, mode: str = PROVIDER_CASSETTE_MODE,
+                 replay_latency: bool = PROVIDER_CASSETTE_LATENCY):
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.inner = RealProviders() if mode == "record" else None
+        self.predis = LocalPredis()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    @staticmethod
+    def make_key(method: str, args: tuple) -> str:
+        return xxhash.xxh3_128_hexdigest(json.dumps([method, _jsonable(args)], sort_keys=True).encode())
+
+    async def _call(self, method: str, *args):
+        key = self.make_key(method, args)
+        entry = self.entries.get(key)
+        if entry is None:
+            if self.inner is None:
+                raise KeyError(f"No recorded {method} response in {self.path}")
+            started = time.perf_counter()
+            result = await asyncio.to_thread(getattr(self.inner, method), *args)
+            entry = {
+                "key": key,
+                "method": method,
+                "seconds": time.perf_counter() - started,
+                "bytes": isinstance(result, bytes),
+                "result": base64.b64encode(result).decode() if isinstance(result, bytes) else result,
+            }
+            self.entries[key] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        elif self.replay_latency:
+            await asyncio.sleep(entry["seconds"])
+        return base64.b64decode(entry["result"]) if entry["bytes"] else entry["result"]
+
+    async def chat(self, model: str, messages: list, temperature: float) -> str:
+        return await self._call("chat", model, messages, temperature)
+
+    async def generate_text(self, model: str, system_prompt: str, prompt: str) -> str:
+        return await self._call("generate_text", model, system_prompt, prompt)
+
+    async def generate_image(self, model: str, prompt: str, images: list):
+        return await self._call("generate_image", model, prompt, [list(image) for image in images])
+
+
+def get_providers(backend: str = PROVIDER_BACKEND):
+    if backend == "real":
+        return RealProviders()
+    if backend == "fake":
+        return FakeProviders()
+    if backend == "cassette":
+        return CassetteProviders()
+    raise ValueError(f"Unknown PROVIDER_BACKEND: {backend}")
+
+
+providers = get_providers()
+video_poller = VideoPoller(providers.predis)
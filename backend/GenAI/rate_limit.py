@@ -0,0 +1,175 @@
+"""
+Process-wide limits for the AI providers (Groq, Gemini, Predis).
+
+Each provider has a token bucket for requests per minute, one for tokens per
+minute (0 disables it) and a semaphore for calls in flight, configured by
+<PROVIDER>_RPM, <PROVIDER>_TPM and <PROVIDER>_CONCURRENCY. Callers wait
+asynchronously for a slot instead of running into the provider's quota.
+
+``call_provider`` also retries rate-limited calls (HTTP 429): it pauses the
+provider for the Retry-After time (or an exponential backoff) and lowers its
+request rate, which then recovers step by step with successful calls.
+Call durations and outcomes go to the provider metrics (app.metrics).
+"""
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from app.metrics import provider_calls, provider_seconds
+
+load_dotenv()
+
+DEFAULT_LIMITS = {
+    # requests/min, tokens/min, in flight
+    "groq": (30, 6000, 4),
+    "gemini": (10, 250000, 4),
+    "predis": (30, 0, 2),
+}
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # A request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: float, max_in_flight: int):
+        self.name = name
+        self.configured_rpm = requests_per_minute
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {"calls": 0, "rate_limited": 0, "failures": 0, "wait_seconds": 0.0}
+
+    async def _take(self, tokens: int):
+        # One waiter at a time, so requests are served in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                wait = max(self.paused_until - now, self.requests.wait_time(1))
+                if self.tokens is not None:
+                    self.tokens.refill(now)
+                    wait = max(wait, self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                self.stats["wait_seconds"] += wait
+                await asyncio.sleep(wait)
+            self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= min(tokens, self.tokens.capacity)
+
+    async def run(self, fn, *args, tokens: int = 1, model_name: str = "", **kwargs):
+        """Call ``fn`` within the limits; sync functions run in a thread."""
+        await self._take(tokens)
+        async with self.in_flight:
+            self.stats["calls"] += 1
+            started = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    return await fn(*args, **kwargs)
+                return await asyncio.to_thread(fn, *args, **kwargs)
+            finally:
+                provider_seconds.labels(self.name, model_name).observe(time.perf_counter() - started)
+
+    def throttled(self, retry_after: float):
+        """The provider answered 429: pause it and lower the request rate."""
+        self.stats["rate_limited"] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self._set_rpm(max(self.configured_rpm * 0.1, self.requests.capacity * 0.7))
+
+    def succeeded(self):
+        if self.requests.capacity < self.configured_rpm:
+            self._set_rpm(min(self.configured_rpm, self.requests.capacity + self.configured_rpm * 0.05))
+
+    def _set_rpm(self, per_minute: float):
+        self.requests.refill(time.monotonic())
+        self.requests.capacity = per_minute
+        self.requests.rate = per_minute / 60.0
+        self.requests.level = min(self.requests.level, per_minute)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 3),
+            "requests_per_minute": round(self.requests.capacity, 2),
+            "configured_requests_per_minute": self.configured_rpm,
+            "tokens_per_minute": self.tokens.capacity if self.tokens else None,
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+def _limit(provider: str, key: str, default) -> float:
+    return float(os.getenv(f"{provider.upper()}_{key}", str(default)))
+
+
+limiters = {
+    name: ProviderLimiter(name, _limit(name, "RPM", rpm), _limit(name, "TPM", tpm), int(_limit(name, "CONCURRENCY", flight)))
+    for name, (rpm, tpm, flight) in DEFAULT_LIMITS.items()
+}
+
+
+def estimate_tokens(*texts, completion: int = 0) -> int:
+    """Rough token count (4 characters a token) of the prompt texts plus the expected completion."""
+    return sum(len(t) for t in texts if t) // 4 + completion
+
+
+def retry_after_of(exc: Exception):
+    """Seconds to wait when ``exc`` is a rate-limit answer (0 when no Retry-After), else None."""
+    response = getattr(exc, "response", None)
+    # requests: response.status_code, aiohttp: status, google-genai: code
+    statuses = (getattr(response, "status_code", None), getattr(exc, "status", None), getattr(exc, "code", None))
+    if 429 not in statuses:
+        return None
+    headers = getattr(exc, "headers", None) or getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def call_provider(provider: str, fn, *args, tokens: int = 1, retries: int = RATE_LIMIT_RETRIES,
+                        model_name: str = None, **kwargs):
+    """
+    Run a provider call through its limiter, retrying 429 answers. Other errors
+    propagate. ``model_name`` labels the metrics (default: the ``model`` argument).
+    """
+    limiter = limiters[provider]
+    model_name = model_name or kwargs.get("model", "")
+    for attempt in range(retries + 1):
+        try:
+            result = await limiter.run(fn, *args, tokens=tokens, model_name=model_name, **kwargs)
+        except Exception as e:
+            retry_after = retry_after_of(e)
+            if retry_after is None or attempt == retries:
+                limiter.stats["failures"] += 1
+                provider_calls.labels(provider, model_name, "failure").inc()
+                raise
+            retry_after = retry_after or 2 ** attempt
+            print(f"{provider} rate limited, retrying in {retry_after:.1f}s")
+            provider_calls.labels(provider, model_name, "rate_limited").inc()
+            limiter.throttled(retry_after)
+            continue
+        limiter.succeeded()
+        provider_calls.labels(provider, model_name, "success" if result is not None else "empty").inc()
+        return result
+
+
+def limiter_stats() -> dict:
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
@@ -0,0 +1,154 @@
+"""
+Where the LangGraph agents read product images and write generated outputs.
+
+AGENT_STORAGE=mongo (default) works directly on the backend's Motor client,
+so a workflow started by the API never calls the API back over HTTPS.
+AGENT_STORAGE=http keeps the old behaviour for deployments where the agents
+run apart from the API (GENMARK_API_URL).
+"""
+import asyncio
+import mimetypes
+from abc import ABC, abstractmethod
+import os
+import aiohttp
+from bson import ObjectId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AGENT_STORAGE = os.getenv("AGENT_STORAGE", "mongo")
+GENMARK_API_URL = os.getenv("GENMARK_API_URL", "https://genmark-mzoy.onrender.com").rstrip("/")
+
+
+class AgentStorage(ABC):
+    """Operations the agents need from the backend."""
+
+    @abstractmethod
+    async def fetch_product_image(self, image_id: str):
+        """Return ``(bytes, content_type)`` of a product image, None when missing."""
+        ...
+
+    async def fetch_product_images(self, image_ids: list) -> list:
+        """Fetch all images concurrently, in order, skipping missing ones."""
+        images = await asyncio.gather(*(self.fetch_product_image(i) for i in image_ids))
+        return [image for image in images if image]
+
+    @abstractmethod
+    async def save_text(self, project_id: str, text: str):
+        ...
+
+    @abstractmethod
+    async def save_image(self, project_id: str, filename: str, content: bytes):
+        """Store a generated image; returns its id, None on failure."""
+        ...
+
+    @abstractmethod
+    async def save_video(self, project_id: str, video_url: str):
+        ...
+
+    @abstractmethod
+    async def link_generated_output(self, project_id: str) -> bool:
+        """Point the project at its GeneratedOutput document."""
+        ...
+
+
+class MongoStorage(AgentStorage):
+    def __init__(self):
+        from app.db import db, TimedGridFSBucket
+        self.db = db
+        self.product_images = TimedGridFSBucket(db, bucket_name="ProductImageBucket")
+        self.generated = TimedGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
+
+    async def _upsert_output(self, project_id: str, fields: dict):
+        await self.db["GeneratedOutput"].update_one(
+            {"project_id": ObjectId(project_id)},
+            {"$set": fields},
+            upsert=True
+        )
+
+    async def fetch_product_image(self, image_id: str):
+        try:
+            grid_out = await self.product_images.open_download_stream(ObjectId(image_id))
+            content = await grid_out.read()
+        except Exception as e:
+            print(f"Product image {image_id} not readable: {e}")
+            return None
+        content_type = mimetypes.guess_type(grid_out.filename or "")[0] or "image/jpeg"
+        return content, content_type
+
+    async def save_text(self, project_id: str, text: str):
+        await self._upsert_output(project_id, {"text": text})
+
+    async def save_image(self, project_id: str, filename: str, content: bytes):
+        image_id = await self.generated.upload_from_stream(filename, content)
+        await self._upsert_output(project_id, {"image": str(image_id)})
+        return str(image_id)
+
+    async def save_video(self, project_id: str, video_url: str):
+        await self._upsert_output(project_id, {"video": video_url})
+
+    async def link_generated_output(self, project_id: str) -> bool:
+        generated_output = await self.db["GeneratedOutput"].find_one({"project_id": ObjectId(project_id)})
+        if not generated_output:
+            return False
+        await self.db["Projects"].update_one(
+            {"_id": ObjectId(project_id)},
+            {"$set": {"generated_outputs_id": generated_output["_id"]}}
+        )
+        return True
+
+
+class HttpStorage(AgentStorage):
+    """Goes through the public project routes of the API at ``base_url``."""
+
+    def __init__(self, base_url: str = GENMARK_API_URL):
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=30)
+
+    async def _put(self, path: str, data) -> dict:
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.put(f"{self.base_url}{path}", data=data) as res:
+                if res.status != 200:
+                    raise RuntimeError(f"PUT {path}: {res.status} {await res.text()}")
+                return await res.json()
+
+    async def fetch_product_image(self, image_id: str):
+        try:
+            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+                async with session.get(f"{self.base_url}/api/project/uploaded/image/{image_id}") as res:
+                    if res.status != 200:
+                        return None
+                    return await res.read(), res.headers.get("content-type", "image/jpeg")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Product image {image_id} not readable: {e}")
+            return None
+
+    async def save_text(self, project_id: str, text: str):
+        await self._put(f"/api/project/upload-generated-text/{project_id}", {"text": text})
+
+    async def save_image(self, project_id: str, filename: str, content: bytes):
+        data = aiohttp.FormData()
+        data.add_field(name="image_output", value=content, filename=filename, content_type="image/jpeg")
+        return (await self._put(f"/api/project/upload-generated-image/{project_id}", data)).get("image_id")
+
+    async def save_video(self, project_id: str, video_url: str):
+        await self._put(f"/api/project/upload-generated-video/{project_id}", {"video_output": video_url})
+
+    async def link_generated_output(self, project_id: str) -> bool:
+        try:
+            await self._put(f"/api/project/update/generated-output/{project_id}", {"project_id": project_id})
+            return True
+        except RuntimeError as e:
+            print(e)
+            return False
+
+
+def get_storage(mode: str = AGENT_STORAGE) -> AgentStorage:
+    if mode == "http":
+        return HttpStorage()
+    if mode == "mongo":
+        return MongoStorage()
+    raise ValueError(f"Unknown AGENT_STORAGE: {mode}")
+
+
+storage = get_storage()
@@ -0,0 +1,288 @@
+"""
+Target-audience query language and vectorized audience filtering, shared by
+the dataset and project routes.
+
+A target string is a list of ``Column: values`` clauses separated by ``|``:
+
+    Category: Footwear, Clothing | Season: Winter or Fall | Gender: both |
+    Ages: 11-18, 60+ | Review Rating: >=4 | Purchase Amount (USD): 20-80
+
+Values separated by ``,`` or a spaced `` or `` (and repeated clauses for the
+same column) are OR-ed, clauses are AND-ed. Text columns match
+case-insensitively; Age, Previous Purchases, Review Rating and Purchase
+Amount (USD) take ranges (``10-20``, ``65+``, ``>=4.5``, ``<3``, ``5``). A
+value containing the word ``ALL`` (the frontend sends ``Ages: ALL Ages``) or
+an empty clause lifts the restriction.
+
+``parse_target`` turns the string into the JSON-able dict stored as a
+FilteredDataset ``target``. ``compile_target`` returns the compiled
+``AudienceFilter``, memoized per normalized string, which builds one boolean
+mask over a DataFrame instead of calling Python once per row.
+"""
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Columns compared as numeric ranges instead of values ("Ages" targets the Age column)
+RANGE_COLUMNS = ("Previous Purchases", "Review Rating", "Purchase Amount (USD)")
+
+# Clause names as they may be written -> dataset column
+CLAUSE_COLUMNS = {
+    "age": "Ages",
+    "ages": "Ages",
+    "category": "Category",
+    "location": "Location",
+    "gender": "Gender",
+    "season": "Season",
+    "subscription status": "Subscription Status",
+    "previous purchases": "Previous Purchases",
+    "review rating": "Review Rating",
+    "purchase amount": "Purchase Amount (USD)",
+    "purchase amount (usd)": "Purchase Amount (USD)",
+}
+
+TARGET_CACHE_SIZE = 1024
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+_BETWEEN = re.compile(rf"^({_NUMBER})\s*-\s*({_NUMBER})$")
+_AT_LEAST = re.compile(rf"^({_NUMBER})\s*\+$")
+_COMPARE = re.compile(rf"^(>=|<=|>|<|=)?\s*({_NUMBER})$")
+_OR = re.compile(r",|\s+or\s+", re.IGNORECASE)
+_ALL = re.compile(r"\bALL\b", re.IGNORECASE)
+
+
+class AudienceQueryError(ValueError):
+    pass
+
+
+def parse_range(range_str: str):
+    """``(low, high)`` inclusive bounds of a range string; AudienceQueryError if malformed."""
+    text = str(range_str).strip()
+    match = _BETWEEN.match(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    match = _AT_LEAST.match(text)
+    if match:
+        return float(match.group(1)), np.inf
+    match = _COMPARE.match(text)
+    if not match:
+        raise AudienceQueryError(f"Invalid range: {text!r}")
+    op, value = match.group(1), float(match.group(2))
+    if op == ">=":
+        return value, np.inf
+    if op == ">":
+        return np.nextafter(value, np.inf), np.inf
+    if op == "<=":
+        return -np.inf, value
+    if op == "<":
+        return -np.inf, np.nextafter(value, -np.inf)
+    return value, value
+
+
+def compile_ranges(target_ranges):
+    """
+    Turn range strings like ["11-18", "65+"] into (low, high) intervals.
+    Malformed entries are skipped, as the old per-row age check did.
+    """
+    intervals = []
+    for range_str in target_ranges:
+        try:
+            intervals.append(parse_range(range_str))
+        except AudienceQueryError:
+            continue
+    return intervals
+
+
+def normalize_target(target_str: str) -> str:
+    """Canonical spelling of a target string: single spaces, none around separators."""
+    text = " ".join(str(target_str).split())
+    return re.sub(r"\s*([|:,])\s*", r"\1", text).strip("|")
+
+
+def parse_target(target_str: str) -> dict:
+    """
+    Parse a target string into ``{column: [values]}`` (``"Ages": "ALL"`` when
+    ages are unrestricted). Raises AudienceQueryError for malformed clauses.
+
+    >>> parse_target("Category: Footwear | Location: California | Gender: both | Ages: ALL Ages")
+    {'Category': ['Footwear'], 'Location': ['California'], 'Gender': ['male', 'female'], 'Ages': 'ALL'}
+    >>> parse_target("Location: Oregon | Ages: ")
+    {'Location': ['Oregon']}
+    """
+    parsed = {}
+    unrestricted = set()
+    for clause in str(target_str).split("|"):
+        if not clause.strip():
+            continue
+        key, sep, raw = clause.partition(":")
+        if not sep:
+            raise AudienceQueryError(f"Expected 'Column: values', got {clause.strip()!r}")
+        name = " ".join(key.split())
+        column = CLAUSE_COLUMNS.get(name.lower(), name)
+        if _ALL.search(raw):
+            unrestricted.add(column)
+            continue
+        values = [v.strip() for v in _OR.split(raw) if v.strip()]
+        if not values:
+            # An empty clause does not restrict anything
+            continue
+        if column == "Gender":
+            values = [g for v in values for g in (["male", "female"] if v.lower() == "both" else [v.lower()])]
+        if column == "Ages" or column in RANGE_COLUMNS:
+            for v in values:
+                parse_range(v)
+
+        existing = parsed.setdefault(column, [])
+        existing.extend(v for v in values if v not in existing)
+
+    for column in unrestricted:
+        parsed.pop(column, None)
+    if "Ages" in unrestricted:
+        parsed["Ages"] = "ALL"
+    return parsed
+
+
+def normalize_values(values) -> set:
+    """Target values as the lower-cased set the columns are compared against."""
+    if isinstance(values, str):
+        values = [values]
+    return {str(v).strip().lower() for v in values}
+
+
+def column_matches(series: pd.Series, values) -> np.ndarray:
+    """
+    Case-insensitive membership test of a column against one or more values.
+    Categorical columns are compared on their categories only, then broadcast
+    through the codes, so the cost does not depend on string length per row.
+    """
+    wanted = normalize_values(values)
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_hits = series.cat.categories.astype(str).str.lower().isin(list(wanted))
+        category_hits = np.append(np.asarray(category_hits, dtype=bool), False)
+        # code -1 (missing) indexes the trailing False
+        return category_hits[series.cat.codes.to_numpy()]
+
+    # Lower-case the distinct values only, then do a hashed isin on the raw column
+    hits = [v for v in series.dropna().unique() if str(v).lower() in wanted]
+    return series.isin(hits).to_numpy(dtype=bool)
+
+
+def truncated_ages(series: pd.Series) -> np.ndarray:
+    """Ages as whole years (like ``int(x)``), NaN where missing or not numeric."""
+    return np.trunc(pd.to_numeric(series, errors="coerce").to_numpy(dtype=float))
+
+
+def age_mask(series: pd.Series, intervals) -> np.ndarray:
+    """Boolean mask of rows whose (truncated) age falls in any interval."""
+    return ages_in_intervals(truncated_ages(series), intervals)
+
+
+def range_mask(series: pd.Series, intervals) -> np.ndarray:
+    """Boolean mask of rows whose numeric value falls in any interval."""
+    return ages_in_intervals(pd.to_numeric(series, errors="coerce").to_numpy(dtype=float), intervals)
+
+
+def ages_in_intervals(ages: np.ndarray, intervals) -> np.ndarray:
+    mask = np.zeros(len(ages), dtype=bool)
+    for low, high in intervals:
+        mask |= (ages >= low) & (ages <= high)
+    return mask
+
+
+class AudienceFilter:
+    """
+    Compiled form of a parsed target audience.
+    Example:
+        compile_target(project["target_audience"]).apply(df)
+    """
+
+    def __init__(self, parsed: dict):
+        self.parsed = parsed
+        self.equals = {}
+        self.ranges = {}
+        self.age_intervals = None
+        for column, values in parsed.items():
+            if column == "Ages":
+                self.age_intervals = None if values in (None, "ALL") else compile_ranges(values)
+            elif column in RANGE_COLUMNS:
+                self.ranges[column] = compile_ranges(values)
+            else:
+                self.equals[column] = values
+
+    def columns(self) -> list:
+        """Dataset columns the filter reads."""
+        columns = list(self.equals) + list(self.ranges)
+        return columns + ["Age"] if self.age_intervals is not None else columns
+
+    def check_schema(self, schema):
+        """
+        Raise AudienceQueryError when a dataset with column ``schema``
+        ([{"name", "dtype"}, ...]) lacks a column or cannot range over it.
+        Datasets stored without a schema are not checked.
+        """
+        if not schema:
+            return
+        dtypes = {c["name"]: c["dtype"] for c in schema}
+        for column in self.columns():
+            if column not in dtypes:
+                raise AudienceQueryError(f"Dataset has no {column} column")
+        for column in list(self.ranges) + (["Age"] if self.age_intervals is not None else []):
+            try:
+                numeric = pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtypes[column]))
+            except TypeError:
+                numeric = False
+            if not numeric:
+                raise AudienceQueryError(f"{column} is not numeric, it cannot be filtered by range")
+
+    def predicates(self):
+        for column, values in self.equals.items():
+            yield column, lambda series, values=values: column_matches(series, values)
+        for column, intervals in self.ranges.items():
+            yield column, lambda series, intervals=intervals: range_mask(series, intervals)
+        if self.age_intervals is not None:
+            yield "Age", lambda series: age_mask(series, self.age_intervals)
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        # Each predicate only looks at the rows that survived the previous ones
+        rows = None
+        for column, predicate in self.predicates():
+            series = df[column] if rows is None else df[column].take(rows)
+            hits = predicate(series)
+            rows = np.flatnonzero(hits) if rows is None else rows[hits]
+        if rows is None:
+            return np.ones(len(df), dtype=bool)
+        mask = np.zeros(len(df), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df[self.mask(df)]
+
+
+def as_filter(target) -> AudienceFilter:
+    """A compiled ``AudienceFilter`` for either a compiled one or a parsed dict."""
+    return target if isinstance(target, AudienceFilter) else AudienceFilter(target)
+
+
+@lru_cache(maxsize=TARGET_CACHE_SIZE)
+def _compile_normalized(target: str) -> AudienceFilter:
+    return AudienceFilter(parse_target(target))
+
+
+def compile_target(target_str: str) -> AudienceFilter:
+    """
+    Compiled filter of a target string, shared between calls with the same
+    normalized string. Treat the result (and its ``parsed``) as read-only.
+    """
+    return _compile_normalized(normalize_target(target_str))
+
+
+def target_cache_stats() -> dict:
+    info = _compile_normalized.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
+
+
+def filter_by_audience(df: pd.DataFrame, parsed: dict) -> pd.DataFrame:
+    return as_filter(parsed).apply(df)
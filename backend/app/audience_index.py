@@ -0,0 +1,211 @@
+"""
+Inverted index over audience datasets.
+
+For Category, Location, Gender (lower-cased values) and Age (whole years) the
+index maps every value to the sorted row positions holding it. It is built
+chunk by chunk during ingestion: each chunk's postings are delta-encoded as
+uint32, zstd-compressed and appended to a spool file, so building it costs
+about the compressed index size in memory.
+
+The file stored in ``AudienceIndexBucket`` is the concatenated segments
+followed by a JSON directory and an 8 byte little-endian directory length:
+
+    {"row_total": n, "postings": {"Gender": {"male": {"count": c,
+      "segments": [[offset, length], ...]}}, ...}}
+
+A target audience then resolves to an intersection of posting lists, skipping
+dimensions whose selected values cover every row and starting from the most
+selective one, instead of a scan of the parsed dataset.
+"""
+import json
+import struct
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import zstandard
+from app.db import grid_fs_index
+from app.audience import AudienceFilter, as_filter, normalize_values, truncated_ages, ages_in_intervals
+from app.dataset_io import load_dataset_frame
+from app.workers import dataset_executor
+
+INDEX_DIMENSIONS = ("Category", "Location", "Gender")
+FOOTER = struct.Struct("<Q")
+
+
+class AudienceIndexBuilder:
+    def __init__(self, file=None):
+        self.file = file if file is not None else tempfile.TemporaryFile()
+        self.compressor = zstandard.ZstdCompressor()
+        self.postings = {}
+        self.rows = 0
+        self.offset = 0
+
+    def update(self, chunk: pd.DataFrame):
+        columns = {d: chunk[d].astype("string").str.lower() for d in INDEX_DIMENSIONS if d in chunk.columns}
+        if "Age" in chunk.columns:
+            columns["Age"] = truncated_ages(chunk["Age"])
+
+        for dimension, values in columns.items():
+            # Missing values get code -1 and are not indexed
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            for code, value in enumerate(uniques):
+                key = str(int(value)) if dimension == "Age" else str(value)
+                positions = (order[bounds[code]:bounds[code + 1]] + self.rows).astype(np.uint32)
+                self._append(dimension, key, positions)
+        self.rows += len(chunk)
+
+    def _append(self, dimension: str, value: str, positions: np.ndarray):
+        # First delta is the absolute position, so segments decode independently
+        blob = self.compressor.compress(np.diff(positions, prepend=np.uint32(0)).astype("<u4").tobytes())
+        self.file.write(blob)
+        entry = self.postings.setdefault(dimension, {}).setdefault(value, {"count": 0, "segments": []})
+        entry["count"] += int(len(positions))
+        entry["segments"].append([self.offset, len(blob)])
+        self.offset += len(blob)
+
+    def finish(self) -> bool:
+        """Write the directory and footer; False when there is nothing to index."""
+        if not self.postings:
+            return False
+        directory = json.dumps({"row_total": self.rows, "postings": self.postings}).encode("utf-8")
+        self.file.write(directory)
+        self.file.write(FOOTER.pack(len(directory)))
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+async def upload_audience_index(path: str, filename: str, source_file_id):
+    """Store an index file written by ``AudienceIndexBuilder`` for ``source_file_id``."""
+    with open(path, "rb") as f:
+        return await grid_fs_index.upload_from_stream(
+            f"{filename.rsplit('.', 1)[0]}.index",
+            f,
+            metadata={"source_file_id": source_file_id, "format": "audience-index"}
+        )
+
+
+class AudienceIndex:
+    def __init__(self, data: bytes):
+        (directory_length,) = FOOTER.unpack(data[-FOOTER.size:])
+        directory_start = len(data) - FOOTER.size - directory_length
+        directory = json.loads(data[directory_start:-FOOTER.size])
+        self.data = memoryview(data)[:directory_start]
+        self.row_total = directory["row_total"]
+        self.postings = directory["postings"]
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def posting(self, dimension: str, value: str) -> np.ndarray:
+        entry = self.postings[dimension].get(value)
+        if entry is None:
+            return np.empty(0, dtype=np.int64)
+        parts = [
+            np.cumsum(np.frombuffer(self.decompressor.decompress(self.data[offset:offset + length]), dtype="<u4"), dtype=np.int64)
+            for offset, length in entry["segments"]
+        ]
+        return np.concatenate(parts)
+
+    def _selected_values(self, audience: AudienceFilter):
+        """{dimension: [values]} for every dimension the target restricts."""
+        selected = {}
+        for column, values in audience.equals.items():
+            wanted = normalize_values(values)
+            selected[column] = [v for v in self.postings[column] if v in wanted]
+        if audience.age_intervals is not None:
+            ages = list(self.postings["Age"])
+            hits = ages_in_intervals(np.array([float(a) for a in ages]), audience.age_intervals)
+            selected["Age"] = [a for a, hit in zip(ages, hits) if hit]
+        return selected
+
+    def select(self, parsed: dict) -> np.ndarray:
+        """
+        Sorted row positions matching ``parsed``.
+        Raises KeyError when the index lacks a dimension the target uses.
+        """
+        audience = as_filter(parsed)
+        if audience.ranges:
+            raise KeyError(next(iter(audience.ranges)))
+        selected = self._selected_values(audience)
+
+        counts = {
+            dimension: sum(self.postings[dimension][v]["count"] for v in values)
+            for dimension, values in selected.items()
+        }
+        # A dimension whose selected values cover every row does not restrict anything
+        restricting = sorted(
+            (d for d in selected if counts[d] < self.row_total),
+            key=lambda d: counts[d]
+        )
+        if not restricting:
+            return np.arange(self.row_total, dtype=np.int64)
+
+        rows = None
+        for dimension in restricting:
+            if rows is not None and len(rows) == 0:
+                break
+            values = selected[dimension]
+            if not values:
+                return np.empty(0, dtype=np.int64)
+            # Values of one dimension are disjoint, the union only needs sorting
+            union = np.sort(np.concatenate([self.posting(dimension, v) for v in values]))
+            rows = union if rows is None else np.intersect1d(rows, union, assume_unique=True)
+        return rows
+
+
+class IndexCache:
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()
+
+    async def get(self, file_id) -> AudienceIndex:
+        key = str(file_id)
+        index = self._indexes.get(key)
+        if index is None:
+            grid_out = await grid_fs_index.open_download_stream(file_id)
+            index = AudienceIndex(await grid_out.read())
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(key)
+        return index
+
+    def discard(self, file_id):
+        self._indexes.pop(str(file_id), None)
+
+
+index_cache = IndexCache()
+
+
+async def select_audience_rows(dataset: dict, parsed: dict):
+    """
+    ``(positions, row_total)`` of the rows of ``dataset`` matching ``parsed``.
+    Uses the dataset's inverted index when it has one covering the target,
+    otherwise scans the (cached) parsed dataset.
+    """
+    index_file_id = dataset.get("audience_index_file_id")
+    if index_file_id:
+        try:
+            index = await index_cache.get(index_file_id)
+            return index.select(parsed), index.row_total
+        except KeyError:
+            pass
+        except Exception as e:
+            print("Audience index unusable, scanning dataset:", e)
+
+    df = await load_dataset_frame(dataset)
+    mask = await dataset_executor.run_thread(as_filter(parsed).mask, df)
+    return np.flatnonzero(mask), len(df)
+
+
+async def delete_audience_index(dataset: dict):
+    index_file_id = dataset.get("audience_index_file_id")
+    if index_file_id:
+        index_cache.discard(index_file_id)
+        try:
+            await grid_fs_index.delete(index_file_id)
+        except Exception as e:
+            print("Error deleting audience index:", e)
@@ -0,0 +1,227 @@
+"""
+Audience-size estimates from a count cube built at upload time.
+
+``AudienceCube`` counts rows per (Category, Location, Gender, age) cell while
+the CSV is ingested. Values are lower-cased like the filter compares them and
+ages are bucketed per whole year, so any "Ages: 11-18, 60+" target resolves
+exactly. The cube is stored sparsely as a JSON file in ``AudienceCubeBucket``
+(``audience_cube_file_id`` on the ``Datasets`` document, shared like the
+other files of the upload), read once per process, and answering a target
+string is then a few vectorized sums over its cells.
+
+Documents written before keep the cube inline as ``audience_cube``. Datasets
+without either get one built from their data on first use, kept in memory.
+"""
+import json
+from collections import Counter, OrderedDict
+import numpy as np
+import pandas as pd
+from app.audience import as_filter, normalize_values, truncated_ages, ages_in_intervals
+from app.db import dataset_collection, grid_fs_cube
+from app.dataset_io import load_dataset_frame
+from app.workers import dataset_executor
+
+CUBE_DIMENSIONS = ("Category", "Location", "Gender")
+# Above this many distinct cells the cube is not stored (estimates fall back to a scan)
+MAX_CUBE_CELLS = 200_000
+MISSING_AGE = -1
+
+
+class AudienceCube:
+    def __init__(self):
+        self.dimensions = None
+        self.has_age = False
+        self.counts = Counter()
+        self.rows = 0
+
+    def update(self, chunk: pd.DataFrame):
+        if self.dimensions is None:
+            self.dimensions = [d for d in CUBE_DIMENSIONS if d in chunk.columns]
+            self.has_age = "Age" in chunk.columns
+        if not self.dimensions and not self.has_age:
+            return
+
+        keys = {d: chunk[d].astype("string").str.lower() for d in self.dimensions}
+        if self.has_age:
+            ages = truncated_ages(chunk["Age"])
+            keys["Age"] = np.where(np.isnan(ages), MISSING_AGE, ages).astype(np.int64)
+
+        grouped = pd.DataFrame(keys).groupby(list(keys), dropna=False).size()
+        for key, count in grouped.items():
+            key = key if isinstance(key, tuple) else (key,)
+            self.counts[tuple(None if pd.isna(k) else k for k in key)] += int(count)
+        self.rows += len(chunk)
+
+    def to_document(self):
+        if self.dimensions is None or not self.counts or len(self.counts) > MAX_CUBE_CELLS:
+            return None
+
+        values = {
+            d: sorted({key[i] for key in self.counts if key[i] is not None})
+            for i, d in enumerate(self.dimensions)
+        }
+        codes = {d: {v: code for code, v in enumerate(values[d])} for d in self.dimensions}
+        cells = {d: [] for d in self.dimensions}
+        cells["Age"], cells["count"] = [], []
+        for key, count in self.counts.items():
+            for i, d in enumerate(self.dimensions):
+                cells[d].append(codes[d].get(key[i], -1))
+            cells["Age"].append(int(key[len(self.dimensions)]) if self.has_age else MISSING_AGE)
+            cells["count"].append(count)
+
+        return {
+            "dimensions": self.dimensions,
+            "has_age": self.has_age,
+            "values": values,
+            "cells": cells,
+            "rows": self.rows,
+        }
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        cube = cls()
+        cube.update(df)
+        return cube
+
+    def write(self, path: str) -> bool:
+        """Write the cube document to ``path``; False when there is no cube to keep."""
+        document = self.to_document()
+        if document is None:
+            return False
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, separators=(",", ":"))
+        return True
+
+
+async def upload_audience_cube(path: str, filename: str, source_file_id):
+    """Store a cube file written by ``AudienceCube.write`` for ``source_file_id``."""
+    with open(path, "rb") as f:
+        return await grid_fs_cube.upload_from_stream(
+            f"{filename.rsplit('.', 1)[0]}.cube.json",
+            f,
+            metadata={"source_file_id": source_file_id, "format": "audience-cube"}
+        )
+
+
+async def load_audience_cube(file_id) -> dict:
+    reader = await grid_fs_cube.open_reader(file_id)
+    return await dataset_executor.run_thread(json.load, reader)
+
+
+async def delete_audience_cube(dataset: dict):
+    cube_file_id = dataset.get("audience_cube_file_id")
+    if cube_file_id:
+        try:
+            await grid_fs_cube.delete(cube_file_id)
+        except Exception as e:
+            print("Error deleting audience cube:", e)
+
+
+class CompiledCube:
+    """Numpy form of a stored ``audience_cube`` document."""
+
+    def __init__(self, document: dict):
+        self.values = document["values"]
+        self.has_age = document["has_age"]
+        self.rows = document["rows"]
+        cells = document["cells"]
+        self.codes = {d: np.asarray(cells[d], dtype=np.int64) for d in document["dimensions"]}
+        ages = np.asarray(cells["Age"], dtype=float)
+        self.ages = np.where(ages == MISSING_AGE, np.nan, ages)
+        self.counts = np.asarray(cells["count"], dtype=np.int64)
+
+    def estimate(self, parsed: dict) -> int:
+        """
+        Number of rows ``parsed`` (dict or compiled filter) would select.
+        Raises KeyError for a column the cube does not count.
+        """
+        audience = as_filter(parsed)
+        if audience.ranges:
+            raise KeyError(next(iter(audience.ranges)))
+        mask = np.ones(len(self.counts), dtype=bool)
+        for column, values in audience.equals.items():
+            if column not in self.codes:
+                raise KeyError(column)
+            wanted = normalize_values(values)
+            hits = np.array([v in wanted for v in self.values[column]] + [False])
+            # code -1 (missing) indexes the trailing False
+            mask &= hits[self.codes[column]]
+        if audience.age_intervals is not None:
+            if not self.has_age:
+                raise KeyError("Age")
+            mask &= ages_in_intervals(self.ages, audience.age_intervals)
+        return int(self.counts[mask].sum())
+
+
+class CubeCache:
+    """Compiled cubes by dataset _id; datasets never change after upload."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._cubes = OrderedDict()
+
+    def get(self, dataset_id):
+        cube = self._cubes.get(dataset_id)
+        if cube is not None:
+            self._cubes.move_to_end(dataset_id)
+        return cube
+
+    def put(self, dataset_id, cube: CompiledCube):
+        self._cubes[dataset_id] = cube
+        self._cubes.move_to_end(dataset_id)
+        while len(self._cubes) > self.max_entries:
+            self._cubes.popitem(last=False)
+
+    def discard(self, dataset_id):
+        self._cubes.pop(dataset_id, None)
+
+
+cube_cache = CubeCache()
+
+
+async def estimate_audience(dataset: dict, parsed) -> int:
+    """
+    Audience size of ``parsed`` (dict or compiled filter) in ``dataset`` (a
+    Datasets document, an inline cube may be projected out).
+    """
+    cube = cube_cache.get(dataset["_id"])
+    if cube is None:
+        document = await _cube_document(dataset)
+        if document is None:
+            # Too many cells to keep a cube, count with a scan instead
+            return await _count_by_scan(dataset, parsed)
+        cube = CompiledCube(document)
+        cube_cache.put(dataset["_id"], cube)
+
+    try:
+        return cube.estimate(parsed)
+    except KeyError:
+        # Columns outside the cube (Season, rating ranges, ...) need a scan
+        return await _count_by_scan(dataset, parsed)
+
+
+async def _cube_document(dataset: dict):
+    """The cube document of ``dataset``; None when it has none."""
+    if "audience_cube_file_id" in dataset:
+        cube_file_id = dataset["audience_cube_file_id"]
+        if cube_file_id is None:
+            return None
+        try:
+            return await load_audience_cube(cube_file_id)
+        except Exception as e:
+            print("Audience cube unusable, scanning dataset:", e)
+            return None
+
+    stored = await dataset_collection.find_one({"_id": dataset["_id"]}, {"audience_cube": 1})
+    if stored is not None and "audience_cube" in stored:
+        return stored["audience_cube"]
+    df = await load_dataset_frame(dataset)
+    cube = await dataset_executor.run_thread(AudienceCube.from_frame, df)
+    return cube.to_document()
+
+
+async def _count_by_scan(dataset: dict, parsed) -> int:
+    """Raises KeyError for a column the dataset does not have."""
+    df = await load_dataset_frame(dataset)
+    mask = await dataset_executor.run_thread(as_filter(parsed).mask, df)
+    return int(mask.sum())
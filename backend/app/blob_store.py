@@ -0,0 +1,97 @@
+"""
+Content-addressed, reference-counted GridFS blobs.
+
+Uploads are hashed with xxh3-128 while they stream in. ``BlobRefs`` keeps
+one document per unique content:
+
+    {"_id": "<kind>:<hash>:<length>", "kind": ..., "hash": ..., "length": ...,
+     "file_id": <GridFS id>, <other file ids stored with it>, "refcount": n}
+
+A second upload of the same bytes takes a reference on the stored blob
+instead of writing it again. Deleting a dataset or product releases its
+reference and the files are only removed with the last one. Files written
+before this existed have no ``BlobRefs`` document and are deleted as before.
+"""
+import xxhash
+from pymongo import ReturnDocument
+from app.db import db
+
+blob_collection = db["BlobRefs"]
+
+
+async def ensure_blob_indexes():
+    """Blobs are found by content through ``_id``, and released by ``(kind, file_id)``."""
+    await blob_collection.create_index([("kind", 1), ("file_id", 1)])
+
+
+def blob_key(kind: str, digest: str, length: int) -> str:
+    return f"{kind}:{digest}:{length}"
+
+
+async def acquire_blob(kind: str, digest: str, length: int, store, discard) -> dict:
+    """
+    Take a reference on the blob with this content and return its record.
+    ``store()`` is awaited only for new content and returns the file ids to
+    record ({"file_id": ..., ...}); ``discard(files)`` removes them again
+    when a concurrent upload of the same content won.
+    """
+    key = blob_key(kind, digest, length)
+    record = await blob_collection.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"refcount": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if record is not None:
+        return record
+
+    files = await store()
+    result = await blob_collection.update_one(
+        {"_id": key},
+        {
+            "$setOnInsert": {"kind": kind, "hash": digest, "length": length, **files},
+            "$inc": {"refcount": 1}
+        },
+        upsert=True
+    )
+    if result.upserted_id is None:
+        # Same content stored concurrently, keep that copy
+        await discard(files)
+        return await blob_collection.find_one({"_id": key})
+    return {"_id": key, "refcount": 1, **files}
+
+
+async def release_blob(kind: str, file_id) -> bool:
+    """
+    Drop one reference on the blob stored as ``file_id``. True when the
+    caller should delete the files: last reference gone, or an untracked file.
+    """
+    record = await blob_collection.find_one_and_update(
+        {"kind": kind, "file_id": file_id},
+        {"$inc": {"refcount": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if record is None:
+        return True
+    if record["refcount"] > 0:
+        return False
+    # Only remove the record if nobody took a new reference meanwhile
+    result = await blob_collection.delete_one({"_id": record["_id"], "refcount": {"$lte": 0}})
+    return result.deleted_count == 1
+
+
+async def upload_bytes(bucket, kind: str, filename: str, content: bytes):
+    """Store ``content`` in ``bucket`` once per unique content, returns its file_id."""
+    async def store():
+        return {"file_id": await bucket.upload_from_stream(filename, content)}
+
+    async def discard(files):
+        await bucket.delete(files["file_id"])
+
+    blob = await acquire_blob(kind, xxhash.xxh3_128_hexdigest(content), len(content), store, discard)
+    return blob["file_id"]
+
+
+async def delete_bytes(bucket, kind: str, file_id):
+    """Release a blob stored with ``upload_bytes``, deleting it with its last reference."""
+    if await release_blob(kind, file_id):
+        await bucket.delete(file_id)
@@ -0,0 +1,56 @@
+"""
+Bulk campaigns: one project per row of a products dataset.
+
+``/api/project/bulk-create`` writes the Products, Projects, FilteredDataset
+and GeneratedOutput documents in batched ``insert_many`` calls, then queues
+one generation job per project (``app.generation_jobs``), whose workers bound
+how many run at a time. Progress is kept on a ``CampaignBatches`` document:
+
+    {"total": n, "completed": c, "failed": f, "status": "running" | "completed",
+     "project_ids": [...], "created_at": ..., "finished_at": ...}
+"""
+from datetime import datetime
+from pymongo import ReturnDocument
+from app.db import db
+
+BULK_INSERT_BATCH = 200
+MAX_BULK_PRODUCTS = 1000
+
+batch_collection = db["CampaignBatches"]
+
+
+def product_fields(row: dict) -> dict:
+    """Product fields of a products dataset row (columns as the catalog upload form names them)."""
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    return {
+        "product_name": str(row.get("product_name") or "").strip(),
+        "description": str(row.get("description") or ""),
+        "product_url": str(row.get("product_url") or ""),
+        "price": number(row.get("dollars", row.get("price"))),
+        "discount": number(row.get("discount")),
+    }
+
+
+async def insert_in_batches(collection, documents: list):
+    for start in range(0, len(documents), BULK_INSERT_BATCH):
+        await collection.insert_many(documents[start:start + BULK_INSERT_BATCH], ordered=False)
+
+
+async def record_batch_result(batch_id, failed: bool):
+    """Count one finished project of a batch, completing the batch with its last one."""
+    batch = await batch_collection.find_one_and_update(
+        {"_id": batch_id},
+        {"$inc": {"failed" if failed else "completed": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if batch and batch["completed"] + batch["failed"] >= batch["total"]:
+        await batch_collection.update_one(
+            {"_id": batch_id, "status": "running"},
+            {"$set": {"status": "completed", "finished_at": datetime.utcnow()}}
+        )
+        print(f"Campaign batch {batch_id} finished")
@@ -0,0 +1,78 @@
+"""
+Reading and writing of uploaded dataset files kept in GridFS.
+
+Every upload keeps the original CSV in ``CSVDatasetBucket`` (fallback and
+export format, zstd-compressed by ``app.db.CompressedGridFSBucket``). Next to it a typed, zstd-compressed Parquet copy is written to
+``ColumnarDatasetBucket`` and its id stored as ``columnar_file_id`` on the
+dataset document. Readers load the Parquet copy with column projection and
+only fall back to re-parsing the CSV when it is missing. Parsed frames are
+shared through ``app.frame_cache``.
+"""
+import io
+import pandas as pd
+from fastapi import HTTPException
+from app.db import grid_fs, grid_fs_columnar, grid_fs_filtered
+from app.frame_cache import frame_cache
+from app.workers import dataset_executor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    pa = pq = None
+    HAS_PARQUET = False
+
+# Low-cardinality columns stored as dictionary-encoded categoricals
+CATEGORICAL_COLUMNS = ["Category", "Location", "Gender", "Color", "Season"]
+
+
+async def read_csv_file(bucket, file_id, columns=None) -> pd.DataFrame:
+    """Parse a CSV from a ``CompressedGridFSBucket``, decompressing while parsing."""
+    reader = await bucket.open_reader(file_id)
+    return await dataset_executor.run_thread(pd.read_csv, reader, usecols=columns)
+
+
+async def load_dataset_frame(dataset: dict, columns=None) -> pd.DataFrame:
+    """
+    Load the DataFrame of a ``Datasets`` / ``ProductsDataset`` document,
+    optionally restricted to ``columns``. The result is cached, do not mutate it.
+    Raises ValueError for ``columns`` the dataset does not have.
+    """
+    names = {c["name"] for c in dataset.get("columns") or []}
+    if columns and names and not names.issuperset(columns):
+        raise ValueError(f"Unknown columns: {', '.join(c for c in columns if c not in names)}")
+    return await frame_cache.get(
+        dataset["file_id"], lambda: _read_dataset_frame(dataset, columns), columns
+    )
+
+
+async def load_filtered_frame(file_id, columns=None) -> pd.DataFrame:
+    """Cached read of a CSV from ``FilteredDatasetBucket``. Do not mutate the result."""
+    return await frame_cache.get(
+        file_id, lambda: read_csv_file(grid_fs_filtered, file_id, columns), columns
+    )
+
+
+async def _read_dataset_frame(dataset: dict, columns=None) -> pd.DataFrame:
+    columnar_file_id = dataset.get("columnar_file_id")
+    if columnar_file_id and HAS_PARQUET:
+        try:
+            grid_out = await grid_fs_columnar.open_download_stream(columnar_file_id)
+            content = await grid_out.read()
+            return await dataset_executor.run_thread(pd.read_parquet, io.BytesIO(content), columns=columns)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print("Columnar copy unreadable, falling back to CSV:", e)
+
+    return await read_csv_file(grid_fs, dataset["file_id"], columns)
+
+
+async def delete_columnar_copy(dataset: dict):
+    columnar_file_id = dataset.get("columnar_file_id")
+    if columnar_file_id:
+        try:
+            await grid_fs_columnar.delete(columnar_file_id)
+        except Exception as e:
+            print("Error deleting columnar copy:", e)
@@ -1,9 +1,14 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from dotenv import load_dotenv
+import asyncio
+import io
 import os
+import zstandard
+from app.metrics import timed_gridfs
 
 load_dotenv()
 MONGO_URL = os.getenv("MONGO_URL")
+GRIDFS_ZSTD_LEVEL = int(os.getenv("GRIDFS_ZSTD_LEVEL", "3"))
 
 # Motor client + database
 client = AsyncIOMotorClient(MONGO_URL)
@@ -18,6 +23,218 @@ product_dataset_collection = db["ProductsDataset"]
 project_collection = db["Projects"]
 product_collection = db["Products"]
 
+
+class TimedGridOut:
+    """Download stream whose reads are timed in the GridFS metrics."""
+
+    def __init__(self, grid_out, bucket_name: str):
+        self.grid_out = grid_out
+        self.bucket_name = bucket_name
+
+    def __getattr__(self, name):
+        return getattr(self.grid_out, name)
+
+    async def read(self, size=-1) -> bytes:
+        with timed_gridfs(self.bucket_name, "read"):
+            return await self.grid_out.read(size)
+
+    async def readchunk(self) -> bytes:
+        with timed_gridfs(self.bucket_name, "read"):
+            return await self.grid_out.readchunk()
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self.readchunk()
+            if not chunk:
+                return
+            yield chunk
+
+
+class TimedGridIn:
+    """Upload stream whose writes are timed in the GridFS metrics."""
+
+    def __init__(self, grid_in, bucket_name: str):
+        self.grid_in = grid_in
+        self.bucket_name = bucket_name
+
+    def __getattr__(self, name):
+        return getattr(self.grid_in, name)
+
+    async def write(self, data):
+        with timed_gridfs(self.bucket_name, "write"):
+            return await self.grid_in.write(data)
+
+    async def close(self):
+        with timed_gridfs(self.bucket_name, "write"):
+            return await self.grid_in.close()
+
+
+class TimedGridFSBucket:
+    """
+    Motor GridFS bucket recording how long opens, reads, writes and deletes
+    take (app.metrics). Other methods are delegated as they are.
+    """
+
+    def __init__(self, database, bucket_name: str = "fs"):
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name)
+        self.bucket_name = bucket_name
+
+    def __getattr__(self, name):
+        return getattr(self.bucket, name)
+
+    async def upload_from_stream(self, filename: str, source, metadata=None):
+        with timed_gridfs(self.bucket_name, "write"):
+            return await self.bucket.upload_from_stream(filename, source, metadata=metadata)
+
+    def open_upload_stream(self, filename: str, metadata=None):
+        return TimedGridIn(self.bucket.open_upload_stream(filename, metadata=metadata), self.bucket_name)
+
+    async def open_download_stream(self, file_id):
+        with timed_gridfs(self.bucket_name, "open"):
+            grid_out = await self.bucket.open_download_stream(file_id)
+        return TimedGridOut(grid_out, self.bucket_name)
+
+    async def delete(self, file_id):
+        with timed_gridfs(self.bucket_name, "delete"):
+            return await self.bucket.delete(file_id)
+
+
+class ZstdGridOut:
+    """Download stream of a compressed file, decompressing as it is read."""
+
+    def __init__(self, grid_out):
+        self.grid_out = grid_out
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self.buffer = b""
+
+    def __getattr__(self, name):
+        return getattr(self.grid_out, name)
+
+    async def readchunk(self) -> bytes:
+        while True:
+            chunk = await self.grid_out.readchunk()
+            if not chunk:
+                return b""
+            data = self.decompressor.decompress(chunk)
+            if data:
+                return data
+
+    async def __aiter__(self):
+        # Special methods are not forwarded by __getattr__; StreamingResponse needs this
+        if self.buffer:
+            data, self.buffer = self.buffer, b""
+            yield data
+        while True:
+            data = await self.readchunk()
+            if not data:
+                return
+            yield data
+
+    async def read(self, size=-1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            data = await self.readchunk()
+            if not data:
+                break
+            self.buffer += data
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class GridOutReader(io.RawIOBase):
+    """
+    Blocking file object over a download stream, for parsers running in a
+    worker thread: every read fetches the next chunk through the event loop
+    ``loop``. Reading it on the event loop thread itself would deadlock.
+    """
+
+    def __init__(self, grid_out, loop):
+        self.grid_out = grid_out
+        self.loop = loop
+        self.pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.pending:
+            chunk = asyncio.run_coroutine_threadsafe(self.grid_out.readchunk(), self.loop).result()
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class CompressedGridFSBucket:
+    """
+    GridFS bucket storing files zstd-compressed. Compressed files carry
+    ``metadata.compression = "zstd"``; files written before have no flag and
+    are read as they are. Everything else is delegated to the Motor bucket.
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, database, bucket_name: str, level: int = GRIDFS_ZSTD_LEVEL):
+        self.bucket = TimedGridFSBucket(database, bucket_name)
+        self.level = level
+
+    def __getattr__(self, name):
+        return getattr(self.bucket, name)
+
+    async def upload_from_stream(self, filename: str, source, metadata=None):
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+
+        async def blocks():
+            for block in iter(lambda: source.read(self.BLOCK_SIZE), b""):
+                yield block
+
+        return await self.upload_from_blocks(filename, blocks(), metadata)
+
+    async def upload_from_blocks(self, filename: str, blocks, metadata=None):
+        """Store the bytes yielded by the async iterator ``blocks`` as one file."""
+        grid_in = self.bucket.open_upload_stream(
+            filename,
+            metadata={**(metadata or {}), "compression": "zstd"}
+        )
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        try:
+            async for block in blocks:
+                data = compressor.compress(block)
+                if data:
+                    await grid_in.write(data)
+            await grid_in.write(compressor.flush())
+            await grid_in.close()
+        except Exception:
+            await grid_in.abort()
+            raise
+        return grid_in._id
+
+    async def open_download_stream(self, file_id):
+        grid_out = await self.bucket.open_download_stream(file_id)
+        if (grid_out.metadata or {}).get("compression") == "zstd":
+            return ZstdGridOut(grid_out)
+        return grid_out
+
+    async def open_reader(self, file_id):
+        """
+        Synchronous binary file object over ``file_id`` for parsers in a
+        worker thread (``dataset_executor.run_thread``). GridFS chunks are
+        fetched and decompressed as the parser reads, the file is never
+        held whole.
+        """
+        grid_out = await self.bucket.open_download_stream(file_id)
+        reader = io.BufferedReader(GridOutReader(grid_out, asyncio.get_running_loop()), self.BLOCK_SIZE)
+        if (grid_out.metadata or {}).get("compression") == "zstd":
+            return zstandard.ZstdDecompressor().stream_reader(reader)
+        return reader
+
+
 # GridFS bucket
-grid_fs = AsyncIOMotorGridFSBucket(db, "CSVDatasetBucket")
-grid_fs_filtered = AsyncIOMotorGridFSBucket(db, "CSVDatasetBucket")
+grid_fs = CompressedGridFSBucket(db, "CSVDatasetBucket")
+grid_fs_filtered = CompressedGridFSBucket(db, "FilteredDatasetBucket")
+grid_fs_columnar = TimedGridFSBucket(db, "ColumnarDatasetBucket")
+grid_fs_index = TimedGridFSBucket(db, "AudienceIndexBucket")
+grid_fs_cube = CompressedGridFSBucket(db, "AudienceCubeBucket")
@@ -0,0 +1,262 @@
+"""
+Filtered datasets stored as row selections over their source dataset.
+
+Instead of writing a CSV copy of the matching rows into
+``FilteredDatasetBucket``, a ``FilteredDataset`` document keeps a ``view``:
+
+    {"dataset_id": <source Datasets _id>, "encoding": "delta" | "bitmap",
+     "row_total": <rows in the source>, "rows": <zstd bytes>}
+
+Sparse selections are stored as delta-encoded uint32 row positions, dense ones
+as a packed bitmap, whichever is smaller. Readers resolve the view lazily
+against the (cached) source frame. Documents written before views existed
+still carry a ``file_id`` and are read from GridFS as before. An audience
+taken from several datasets keeps one view per dataset in ``views``, read
+back to back.
+
+Edits to the rows live in the patch overlay of ``app.row_patches`` and are
+merged on read; ``compact_filtered_dataset`` folds them into a new file.
+"""
+import asyncio
+import numpy as np
+import pandas as pd
+import xxhash
+import zstandard
+from app.db import dataset_collection, grid_fs_filtered
+from app.dataset_io import load_dataset_frame, load_filtered_frame
+from app.frame_cache import frame_cache
+from app.pagination import RowSource, MultiRowSource
+from app.audience_index import select_audience_rows
+from app.row_patches import PATCH_COMPACT_THRESHOLD, load_patches, drop_patch_versions
+from app.workers import dataset_executor
+
+MATERIALIZE_BATCH_ROWS = 50000
+
+
+class SourceDatasetMissing(Exception):
+    pass
+
+
+def encode_rows(positions, row_total: int) -> dict:
+    """Encode sorted row ``positions`` out of ``row_total`` source rows."""
+    positions = np.asarray(positions, dtype=np.int64)
+    # 32 bits per selected row vs 1 bit per source row
+    if len(positions) * 32 < row_total:
+        encoding = "delta"
+        payload = np.diff(positions, prepend=0).astype("<u4").tobytes()
+    else:
+        encoding = "bitmap"
+        mask = np.zeros(row_total, dtype=bool)
+        mask[positions] = True
+        payload = np.packbits(mask).tobytes()
+    return {
+        "encoding": encoding,
+        "row_total": int(row_total),
+        "rows": zstandard.ZstdCompressor().compress(payload),
+    }
+
+
+def decode_rows(view: dict) -> np.ndarray:
+    """Sorted source row positions selected by ``view``."""
+    raw = zstandard.ZstdDecompressor().decompress(view["rows"])
+    if view["encoding"] == "delta":
+        return np.cumsum(np.frombuffer(raw, dtype="<u4"), dtype=np.int64)
+    bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8), count=view["row_total"])
+    return np.flatnonzero(bits)
+
+
+def make_view(dataset: dict, positions, row_total: int) -> dict:
+    return {"dataset_id": dataset["_id"], **encode_rows(positions, row_total)}
+
+
+def view_fields(views: list) -> dict:
+    """FilteredDataset fields for ``views``: ``view`` for one dataset, ``views`` for several."""
+    return {"view": views[0]} if len(views) == 1 else {"views": views}
+
+
+async def _load_view_rows(view: dict, columns=None):
+    dataset = await dataset_collection.find_one({"_id": view["dataset_id"]})
+    if not dataset:
+        raise SourceDatasetMissing("Source dataset of this filtered dataset no longer exists")
+
+    source = await load_dataset_frame(dataset, columns)
+    if len(source) != view["row_total"]:
+        raise SourceDatasetMissing("Source dataset changed since it was filtered")
+    return source, decode_rows(view)
+
+
+async def load_filtered_rows(filtered_doc: dict, columns=None) -> list:
+    """
+    ``[(frame, positions), ...]`` for a FilteredDataset document: the cached
+    frames holding its rows, in order, and their positions in them (None
+    meaning every row). Several parts come from a view over several datasets.
+    The frames are shared, do not mutate them.
+    """
+    views = filtered_doc.get("views") or ([filtered_doc["view"]] if filtered_doc.get("view") else None)
+    if not views:
+        return [(await load_filtered_frame(filtered_doc["file_id"], columns), None)]
+    return list(await asyncio.gather(*(_load_view_rows(view, columns) for view in views)))
+
+
+def _row_source(parts: list, columns, patches: dict):
+    if len(parts) == 1:
+        frame, positions = parts[0]
+        return RowSource(frame, positions, columns, patches)
+    return MultiRowSource([RowSource(frame, positions, columns) for frame, positions in parts], patches)
+
+
+def filtered_version(filtered_doc: dict) -> str:
+    """Version of a FilteredDataset's rows for pagination cursors: its file or views and patch count."""
+    views = filtered_doc.get("views") or ([filtered_doc["view"]] if filtered_doc.get("view") else [])
+    stored = filtered_doc.get("file_id") or ",".join(
+        f"{v['dataset_id']}/{xxhash.xxh3_64_hexdigest(v['rows'])}" for v in views
+    )
+    return f"{filtered_doc['_id']}:{stored}:{filtered_doc.get('patch_seq', 0)}"
+
+
+async def filtered_row_source(filtered_doc: dict, columns=None):
+    """
+    Lazy, patched rows of a FilteredDataset document for ``rows_response``,
+    reading only ``columns`` when given. Unknown ``columns`` are rejected with a 400.
+    """
+    try:
+        parts = await load_filtered_rows(filtered_doc, columns)
+    except ValueError:
+        # The readers reject unknown columns; load them all so RowSource can name the missing ones
+        parts = await load_filtered_rows(filtered_doc)
+    return _row_source(parts, columns, await load_patches(filtered_doc))
+
+
+async def resolve_filtered_dataset(filtered_doc: dict, columns=None) -> pd.DataFrame:
+    """
+    Rows of a FilteredDataset document with its patches applied, as a fresh
+    DataFrame (safe to mutate), optionally restricted to ``columns``.
+    """
+    parts = await load_filtered_rows(filtered_doc, columns)
+    source = _row_source(parts, columns, await load_patches(filtered_doc))
+    return await dataset_executor.run_thread(
+        lambda: source.slice(0, len(source)).reset_index(drop=True).copy()
+    )
+
+
+async def select_audience_views(datasets: list, parsed):
+    """
+    Evaluate ``parsed`` (dict or compiled filter) on every dataset in parallel. Returns ``(views,
+    filtered_count)``; with several datasets a row whose Email already
+    appeared (earlier in the list, or earlier in the same dataset) is dropped.
+    """
+    selections = await asyncio.gather(*(select_audience_rows(d, parsed) for d in datasets))
+    if len(datasets) > 1:
+        frames = await asyncio.gather(*(_load_emails(d) for d in datasets))
+        keeps = await dataset_executor.run_thread(
+            _first_email_occurrences,
+            [(frame, positions) for frame, (positions, _) in zip(frames, selections)]
+        )
+        selections = [(positions[keep], row_total) for (positions, row_total), keep in zip(selections, keeps)]
+
+    views = [make_view(d, positions, row_total) for d, (positions, row_total) in zip(datasets, selections)]
+    return views, sum(len(positions) for positions, _ in selections)
+
+
+async def _load_emails(dataset: dict):
+    """Only the Email column of a dataset (None when it has none), for de-duplication."""
+    names = [c["name"] for c in dataset.get("columns") or []]
+    if names and "Email" not in names:
+        return None
+    # Datasets stored without a schema may lack the column, read them whole
+    return await load_dataset_frame(dataset, ["Email"] if names else None)
+
+
+def _first_email_occurrences(parts) -> list:
+    """Per part, a mask of the selected rows holding the first occurrence of their Email."""
+    emails = [
+        frame["Email"].take(positions) if frame is not None and "Email" in frame.columns
+        else pd.Series([None] * len(positions))
+        for frame, positions in parts
+    ]
+    merged = pd.concat(emails, ignore_index=True).astype("string").str.strip().str.lower()
+    # Rows without an Email are never duplicates
+    keep = (~merged.duplicated(keep="first") | merged.isna()).to_numpy()
+    bounds = np.cumsum([0] + [len(e) for e in emails])
+    return [keep[bounds[i]:bounds[i + 1]] for i in range(len(emails))]
+
+
+def _csv_block(source, start: int, stop: int) -> bytes:
+    return source.slice(start, stop).to_csv(index=False, header=start == 0).encode("utf-8")
+
+
+async def materialize_filtered_dataset(db, filtered_doc: dict, metadata=None):
+    """
+    Write the patched rows of ``filtered_doc`` as a CSV into FilteredDatasetBucket
+    and turn the document into a plain file-backed one. Rows are streamed in
+    batches, never held in memory as a whole, and the new file is in place
+    before the old one is deleted. Returns the new file_id.
+    """
+    # Only the patch versions read here are folded in and deleted afterwards;
+    # patches landing meanwhile stay live over the new file
+    versions = []
+    parts = await load_filtered_rows(filtered_doc)
+    source = _row_source(parts, None, await load_patches(filtered_doc, versions))
+
+    async def blocks():
+        total = len(source)
+        yield await dataset_executor.run_thread(_csv_block, source, 0, min(MATERIALIZE_BATCH_ROWS, total))
+        for start in range(MATERIALIZE_BATCH_ROWS, total, MATERIALIZE_BATCH_ROWS):
+            yield await dataset_executor.run_thread(_csv_block, source, start, min(start + MATERIALIZE_BATCH_ROWS, total))
+
+    file_id = await grid_fs_filtered.upload_from_blocks(
+        f"{filtered_doc['original_dataset']}_filtered.csv",
+        blocks(),
+        metadata=metadata or {"materialized": True}
+    )
+    await db["FilteredDataset"].update_one(
+        {"_id": filtered_doc["_id"]},
+        {"$set": {"file_id": file_id}, "$unset": {"view": "", "views": ""}}
+    )
+    await delete_filtered_file(filtered_doc)
+    await drop_patch_versions(filtered_doc["_id"], versions)
+    return file_id
+
+
+# Filtered dataset _ids being compacted, and the tasks doing it
+_compacting = set()
+_compaction_tasks = set()
+
+
+async def compact_filtered_dataset(db, filtered_id):
+    try:
+        filtered_doc = await db["FilteredDataset"].find_one({"_id": filtered_id})
+        if filtered_doc and filtered_doc.get("patch_count", 0) > PATCH_COMPACT_THRESHOLD:
+            await materialize_filtered_dataset(db, filtered_doc, metadata={"compacted": True})
+            print(f"Compacted patches of filtered dataset {filtered_id}")
+    except Exception as e:
+        print("Error compacting filtered dataset:", e)
+    finally:
+        _compacting.discard(filtered_id)
+
+
+def schedule_compaction(db, filtered_id, patch_count: int):
+    """Fold the patches into a new file in the background once there are too many."""
+    if patch_count <= PATCH_COMPACT_THRESHOLD or filtered_id in _compacting:
+        return
+    _compacting.add(filtered_id)
+    task = asyncio.create_task(compact_filtered_dataset(db, filtered_id))
+    _compaction_tasks.add(task)
+    task.add_done_callback(_compaction_tasks.discard)
+
+
+async def materialize_views_of(db, dataset: dict):
+    """Called before a source dataset is deleted so dependent views keep working."""
+    dependent = {"$or": [{"view.dataset_id": dataset["_id"]}, {"views.dataset_id": dataset["_id"]}]}
+    async for filtered_doc in db["FilteredDataset"].find(dependent):
+        try:
+            await materialize_filtered_dataset(db, filtered_doc)
+        except Exception as e:
+            print("Error materializing filtered dataset:", e)
+
+
+async def delete_filtered_file(filtered_doc: dict):
+    file_id = filtered_doc.get("file_id")
+    if file_id:
+        await grid_fs_filtered.delete(file_id)
+        frame_cache.invalidate(file_id)
@@ -0,0 +1,113 @@
+"""
+Process-wide cache of parsed dataset DataFrames, keyed by GridFS file_id.
+
+- LRU eviction under a byte budget (DATAFRAME_CACHE_MB, default 512)
+- single-flight loading: concurrent requests for the same file share one parse
+- ``invalidate(file_id)`` when a file is deleted or replaced
+
+Cached frames are shared between requests, callers must copy before mutating.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATAFRAME_CACHE_MB = int(os.getenv("DATAFRAME_CACHE_MB", "512"))
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()   # key -> (DataFrame, nbytes)
+        self._loading = {}             # key -> asyncio.Task
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(file_id, columns=None):
+        return (str(file_id), tuple(columns) if columns else None)
+
+    async def get(self, file_id, loader, columns=None) -> pd.DataFrame:
+        """
+        Return the cached frame for (file_id, columns) or run ``loader``
+        (an async callable returning a DataFrame) exactly once for all callers.
+        """
+        key = self.make_key(file_id, columns)
+
+        entry = self._frames.get(key)
+        if entry is not None:
+            self._frames.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+        task = self._loading.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._loading[key] = task
+        else:
+            self.stats["coalesced"] += 1
+
+        # shield: one cancelled request must not cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            df = await loader()
+            # Only keep the result if the file was not invalidated meanwhile
+            if self._loading.get(key) is asyncio.current_task():
+                self._store(key, df)
+            return df
+        finally:
+            if self._loading.get(key) is asyncio.current_task():
+                del self._loading[key]
+
+    def _store(self, key, df):
+        nbytes = frame_nbytes(df)
+        if nbytes > self.max_bytes:
+            return
+        self._discard(key)
+        self._frames[key] = (df, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            self._discard(next(iter(self._frames)))
+            self.stats["evictions"] += 1
+
+    def _discard(self, key):
+        entry = self._frames.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, file_id):
+        """Drop every cached projection of ``file_id`` and detach in-flight loads."""
+        file_key = str(file_id)
+        for key in [k for k in self._frames if k[0] == file_key]:
+            self._discard(key)
+            self.stats["invalidations"] += 1
+        for key in [k for k in self._loading if k[0] == file_key]:
+            del self._loading[key]
+
+    def clear(self):
+        self._frames.clear()
+        self._bytes = 0
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "hit_ratio": (self.stats["hits"] + self.stats["coalesced"]) / lookups if lookups else 0.0,
+            "entries": len(self._frames),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "loading": len(self._loading),
+        }
+
+
+frame_cache = FrameCache(DATAFRAME_CACHE_MB * 1024 * 1024)
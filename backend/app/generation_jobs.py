@@ -0,0 +1,228 @@
+"""
+Durable queue of LangGraph generation runs.
+
+Every project generation is a ``GenerationJobs`` document:
+
+    {"project_id", "payload" (the workflow input), "state", "attempts",
+     "max_attempts", "run_after", "lease_until", "worker", "last_error",
+     "batch_id", "created_at", "updated_at"}
+
+``state`` moves queued -> running -> succeeded, or back to queued with an
+exponential ``run_after`` backoff after a failed attempt, and to failed after
+GENERATION_MAX_ATTEMPTS. A run that returns an ``error`` or no output at all
+(the agents log provider errors and return None) counts as a failed
+attempt. The project ``status`` follows it (queued,
+in_progress, retrying, completed, failed).
+
+GENERATION_WORKERS coroutines claim jobs with a lease (GENERATION_LEASE
+seconds, renewed while the run lasts). A job whose lease ran out, because its
+process died, is claimed again, so unfinished jobs resume after a restart.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from app.db import db
+from app.campaigns import record_batch_result
+from app.progress import progress_hub
+
+load_dotenv()
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+GENERATION_LEASE = float(os.getenv("GENERATION_LEASE", "60"))
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3"))
+GENERATION_RETRY_BASE = float(os.getenv("GENERATION_RETRY_BASE", "30"))
+GENERATION_RETRY_MAX = 900
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", "5"))
+
+job_collection = db["GenerationJobs"]
+
+# Workflow outputs of which at least one must be set for a run to succeed
+OUTPUT_KEYS = ("text_output", "image_output", "video_output")
+
+PROJECT_STATUS = {"queued": "queued", "running": "in_progress", "retrying": "retrying",
+                  "succeeded": "completed", "failed": "failed"}
+
+
+def new_job(project_data: dict, batch_id=None, now=None) -> dict:
+    now = now or datetime.utcnow()
+    return {
+        "project_id": ObjectId(project_data["project_id"]),
+        "payload": project_data,
+        "state": "queued",
+        "attempts": 0,
+        "max_attempts": GENERATION_MAX_ATTEMPTS,
+        "run_after": now,
+        "lease_until": None,
+        "worker": None,
+        "last_error": None,
+        "batch_id": batch_id,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def run_error(result):
+    """Why a workflow result counts as failed, None when it succeeded."""
+    if result is None:
+        return "Workflow returned nothing"
+    if isinstance(result, dict) and "error" in result:
+        return str(result["error"])
+    if isinstance(result, dict) and not any(result.get(key) for key in OUTPUT_KEYS):
+        return "Workflow produced no output"
+    return None
+
+
+def retry_delay(attempts: int) -> float:
+    return min(GENERATION_RETRY_BASE * 2 ** (attempts - 1), GENERATION_RETRY_MAX)
+
+
+async def set_project_status(project_id, state: str, error: str = None):
+    await db["Projects"].update_one({"_id": project_id}, {"$set": {"status": PROJECT_STATUS[state]}})
+    await progress_hub.publish(project_id, PROJECT_STATUS[state], {"error": error} if error else None)
+
+
+class GenerationQueue:
+    def __init__(self, workers: int = GENERATION_WORKERS, lease: float = GENERATION_LEASE):
+        self.workers = workers
+        self.lease = lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.workflow = None
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self.stats = {"claimed": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+    async def enqueue(self, project_data: dict, batch_id=None):
+        await self.enqueue_many([project_data], batch_id)
+
+    async def enqueue_many(self, inputs: list, batch_id=None):
+        """Queue one job per workflow input; the projects must already exist."""
+        if not inputs:
+            return
+        now = datetime.utcnow()
+        jobs = [new_job(data, batch_id, now) for data in inputs]
+        for start in range(0, len(jobs), 500):
+            await job_collection.insert_many(jobs[start:start + 500], ordered=False)
+        await db["Projects"].update_many(
+            {"_id": {"$in": [job["project_id"] for job in jobs]}},
+            {"$set": {"status": PROJECT_STATUS["queued"]}}
+        )
+        for job in jobs:
+            await progress_hub.publish(job["project_id"], PROJECT_STATUS["queued"])
+        self._wakeup.set()
+
+    async def cancel(self, project_id):
+        """Drop the project's jobs that have not started."""
+        await job_collection.delete_many({"project_id": ObjectId(project_id), "state": "queued"})
+
+    async def claim(self):
+        now = datetime.utcnow()
+        job = await job_collection.find_one_and_update(
+            {"$or": [
+                {"state": "queued", "run_after": {"$lte": now}},
+                {"state": "running", "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {"state": "running", "worker": self.worker_id, "updated_at": now,
+                         "lease_until": now + timedelta(seconds=self.lease)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            self.stats["claimed"] += 1
+        return job
+
+    async def _renew(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await job_collection.update_one(
+                    {"_id": job_id, "worker": self.worker_id},
+                    {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease)}}
+                )
+            except Exception as e:
+                # Keep trying: a lapsed lease lets another worker take the running job
+                print(f"Lease renewal of job {job_id} failed: {e}")
+
+    async def _finish(self, job: dict, error):
+        now = datetime.utcnow()
+        mine = {"_id": job["_id"], "worker": self.worker_id}
+        if error is None:
+            state, update = "succeeded", {"state": "succeeded"}
+        elif job["attempts"] < job["max_attempts"]:
+            state = "retrying"
+            delay = retry_delay(job["attempts"])
+            update = {"state": "queued", "run_after": now + timedelta(seconds=delay)}
+            print(f"Generation of {job['project_id']} failed ({error}), retry in {delay:.0f}s")
+        else:
+            state, update = "failed", {"state": "failed"}
+            print(f"Generation of {job['project_id']} failed for good: {error}")
+        result = await job_collection.update_one(
+            mine, {"$set": {**update, "lease_until": None, "last_error": error, "updated_at": now}}
+        )
+        if not result.modified_count:
+            # The lease was lost and another worker owns the job now
+            return
+        self.stats[{"succeeded": "succeeded", "retrying": "retried", "failed": "failed"}[state]] += 1
+        await set_project_status(job["project_id"], state, error)
+        if state != "retrying" and job.get("batch_id"):
+            await record_batch_result(job["batch_id"], failed=state == "failed")
+        if state == "retrying":
+            self._wakeup.set()
+
+    async def run_job(self, job: dict):
+        await set_project_status(job["project_id"], "running")
+        renew = asyncio.create_task(self._renew(job["_id"]))
+        try:
+            error = run_error(await self.workflow(job["payload"]))
+        except Exception as e:
+            error = str(e)
+        finally:
+            renew.cancel()
+        await self._finish(job, error)
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self.claim()
+            except Exception as e:
+                print("Generation queue claim failed:", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), GENERATION_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run_job(job)
+
+    async def start(self, workflow):
+        """Start the workers; ``workflow`` is ``run_langgraph_for_project``."""
+        if self._tasks:
+            return
+        self.workflow = workflow
+        await job_collection.create_index([("state", 1), ("run_after", 1)])
+        await job_collection.create_index("project_id")
+        pending = await job_collection.count_documents({"state": {"$in": ["queued", "running"]}})
+        if pending:
+            print(f"Resuming {pending} unfinished generation jobs")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> dict:
+        return {"workers": len(self._tasks), "worker_id": self.worker_id, **self.stats}
+
+
+generation_queue = GenerationQueue()
@@ -0,0 +1,245 @@
+"""
+Constant-memory ingestion of uploaded CSV datasets.
+
+The upload is copied block by block into a temp file and hashed on the way;
+content that is already stored is not written again (see ``app.blob_store``).
+The CPU part runs in the dataset process pool (``app.workers``), which only
+receives the temp file path: ``prepare_csv_file`` parses it in row chunks and
+each chunk feeds the dataset profile (row count, column schema, categories,
+locations, audience count cube), the Parquet shadow copy and the audience
+inverted index. The cube, copy and index are written to files next to the
+CSV and uploaded with it.
+"""
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import xxhash
+from fastapi import UploadFile
+from dotenv import load_dotenv
+from app.db import grid_fs, grid_fs_columnar
+from app.dataset_io import CATEGORICAL_COLUMNS, HAS_PARQUET, pa, pq, delete_columnar_copy
+from app.audience_stats import AudienceCube, upload_audience_cube, delete_audience_cube
+from app.audience_index import AudienceIndexBuilder, upload_audience_index, delete_audience_index
+from app.blob_store import acquire_blob, release_blob
+from app.frame_cache import frame_cache
+from app.workers import dataset_executor
+
+load_dotenv()
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+class CsvProfile:
+    """Dataset metadata accumulated chunk by chunk."""
+
+    def __init__(self, audience: bool = True):
+        self.row_count = 0
+        self.dtypes = {}
+        self.categories = set()
+        self.locations = set()
+        self.audience_cube = AudienceCube() if audience else None
+
+    def update(self, chunk: pd.DataFrame):
+        self.row_count += len(chunk)
+        for column, dtype in chunk.dtypes.items():
+            self.dtypes[column] = _merge_dtype(self.dtypes.get(column), dtype)
+        if "Category" in chunk.columns:
+            self.categories.update(chunk["Category"].dropna().unique().tolist())
+        if "Location" in chunk.columns:
+            self.locations.update(chunk["Location"].dropna().unique().tolist())
+        if self.audience_cube is not None:
+            self.audience_cube.update(chunk)
+
+    def as_fields(self) -> dict:
+        return {
+            "row_count": self.row_count,
+            "columns": [{"name": str(c), "dtype": str(d)} for c, d in self.dtypes.items()],
+            "categories": sorted(self.categories),
+            "locations": sorted(self.locations),
+        }
+
+
+def _merge_dtype(current, new):
+    if current is None or current == new:
+        return new
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(new):
+        return np.dtype("float64")
+    return np.dtype("object")
+
+
+class ColumnarSpool:
+    """
+    Incremental Parquet writer spooling to ``file``. Every chunk is cast to
+    the schema of the first one; if that is impossible the copy is dropped and
+    readers keep using the CSV.
+    """
+
+    def __init__(self, file):
+        self.enabled = HAS_PARQUET
+        self.file = file
+        self.writer = None
+
+    def write(self, chunk: pd.DataFrame):
+        if not self.enabled:
+            return
+        try:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            for column in CATEGORICAL_COLUMNS:
+                if column in table.column_names:
+                    index = table.column_names.index(column)
+                    encoded = table.column(index).cast(pa.string()).dictionary_encode()
+                    table = table.set_column(index, column, encoded)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.file, table.schema, compression="zstd")
+            else:
+                table = table.cast(self.writer.schema)
+            self.writer.write_table(table)
+        except Exception as e:
+            print("Columnar copy skipped:", e)
+            self.enabled = False
+
+    def finish(self) -> bool:
+        """Close the Parquet file; False when there is no usable copy."""
+        if self.writer is not None and self.writer.is_open:
+            self.writer.close()
+        return self.enabled and self.writer is not None
+
+    def close(self):
+        self.finish()
+        self.file.close()
+
+
+def prepare_csv_file(path: str, audience: bool = True, chunk_rows: int = INGEST_CHUNK_ROWS) -> dict:
+    """
+    Process pool side of the ingestion: parse the CSV at ``path`` and write its
+    Parquet copy to ``path + ".parquet"``, audience index to ``path + ".index"``
+    and audience cube to ``path + ".cube"``. Returns the profile fields and
+    which files exist.
+    Raises ValueError when the CSV cannot be parsed.
+    """
+    profile = CsvProfile(audience)
+    spool = ColumnarSpool(open(path + ".parquet", "wb"))
+    index = AudienceIndexBuilder(open(path + ".index", "wb")) if audience else None
+    try:
+        try:
+            # Map the file instead of reading it through Python buffers (mmap rejects empty files)
+            memory_map = os.path.getsize(path) > 0
+            for chunk in pd.read_csv(path, chunksize=chunk_rows, memory_map=memory_map):
+                profile.update(chunk)
+                spool.write(chunk)
+                if index is not None:
+                    index.update(chunk)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            raise ValueError(str(e)) from e
+        return {
+            "fields": profile.as_fields(),
+            "columnar": spool.finish(),
+            "index": index.finish() if index is not None else False,
+            "cube": profile.audience_cube.write(path + ".cube") if profile.audience_cube is not None else False,
+        }
+    finally:
+        spool.close()
+        if index is not None:
+            index.close()
+
+
+async def ingest_csv_upload(file: UploadFile, audience: bool = True) -> dict:
+    """
+    Stream ``file`` into ``CSVDatasetBucket`` (plus its Parquet copy) and return
+    the dataset document fields: file_id, columnar_file_id, row_count,
+    columns, categories, locations, audience_index_file_id and
+    audience_cube_file_id.
+    ``audience=False`` skips the cube and index (product catalogs).
+    Identical content shares the stored files; release them with
+    ``release_dataset_files``.
+    Raises ValueError when the CSV cannot be parsed; nothing is stored then.
+    """
+    await file.seek(0)
+    hasher = xxhash.xxh3_128()
+    length = 0
+    workdir = tempfile.TemporaryDirectory(prefix="ingest-")
+    path = os.path.join(workdir.name, "upload.csv")
+
+    try:
+        with open(path, "wb") as body:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                hasher.update(block)
+                length += len(block)
+                body.write(block)
+
+        prepared = await dataset_executor.run(prepare_csv_file, path, audience)
+
+        async def store():
+            with open(path, "rb") as body:
+                file_id = await grid_fs.upload_from_stream(
+                    file.filename,
+                    body,
+                    metadata={"content_type": file.content_type}
+                )
+            columnar_file_id = index_file_id = cube_file_id = None
+            if prepared["columnar"]:
+                with open(path + ".parquet", "rb") as columnar:
+                    columnar_file_id = await grid_fs_columnar.upload_from_stream(
+                        f"{file.filename.rsplit('.', 1)[0]}.parquet",
+                        columnar,
+                        metadata={"source_file_id": file_id, "format": "parquet"}
+                    )
+            if prepared["index"]:
+                index_file_id = await upload_audience_index(path + ".index", file.filename, file_id)
+            if prepared["cube"]:
+                cube_file_id = await upload_audience_cube(path + ".cube", file.filename, file_id)
+            return {
+                "file_id": file_id,
+                "columnar_file_id": columnar_file_id,
+                "audience_index_file_id": index_file_id,
+                "audience_cube_file_id": cube_file_id,
+            }
+
+        blob = await acquire_blob(
+            _blob_kind(audience), hasher.hexdigest(), length,
+            store, _delete_dataset_files
+        )
+    finally:
+        workdir.cleanup()
+
+    return {
+        "file_id": blob["file_id"],
+        "columnar_file_id": blob.get("columnar_file_id"),
+        "audience_index_file_id": blob.get("audience_index_file_id"),
+        # Blobs stored before cube files have none: the cube is then built on first use
+        **({"audience_cube_file_id": blob["audience_cube_file_id"]} if audience and "audience_cube_file_id" in blob else {}),
+        **prepared["fields"],
+    }
+
+
+def _blob_kind(audience: bool) -> str:
+    # Catalogs are stored without an audience index, so they do not share blobs with datasets
+    return "dataset" if audience else "product-dataset"
+
+
+async def _delete_dataset_files(dataset: dict):
+    file_id = dataset.get("file_id")
+    if file_id:
+        try:
+            await grid_fs.delete(file_id)
+        except Exception as e:
+            print("Error deleting dataset file:", e)
+        frame_cache.invalidate(file_id)
+    await delete_columnar_copy(dataset)
+    await delete_audience_index(dataset)
+    await delete_audience_cube(dataset)
+
+
+async def release_dataset_files(dataset: dict, audience: bool = True) -> bool:
+    """Drop a dataset's reference on its stored files, deleting them with the last one."""
+    if not dataset.get("file_id"):
+        return False
+    if not await release_blob(_blob_kind(audience), dataset["file_id"]):
+        return False
+    await _delete_dataset_files(dataset)
+    return True
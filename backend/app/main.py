@@ -1,6 +1,12 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from app.routes import project, dataset, user, generatedoutput, send_email, edit_output, product_dataset
 from fastapi.middleware.cors import CORSMiddleware
+from app.workers import dataset_executor
+from app.generation_jobs import generation_queue
+from app.progress import progress_hub
+from app.blob_store import ensure_blob_indexes
+from app import metrics
+from GenAI.Langgraph import run_langgraph_for_project
 
 app = FastAPI(
     docs_url=None,       # disables /docs (Swagger UI)
@@ -30,6 +36,24 @@ app.include_router(generatedoutput.router)
 app.include_router(edit_output.router)
 app.include_router(product_dataset.router)
 
+@app.on_event("startup")
+async def start_generation_workers():
+    # Also resumes the jobs left unfinished by the previous process
+    await generation_queue.start(run_langgraph_for_project)
+    progress_hub.start()
+    await ensure_blob_indexes()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await generation_queue.stop()
+    await progress_hub.stop()
+    dataset_executor.shutdown()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the API"}
@@ -0,0 +1,70 @@
+"""
+Prometheus metrics of the generation pipeline, served by GET /metrics.
+
+    genmark_node_seconds{node, provider, model}
+    genmark_node_outcomes_total{node, provider, model, outcome}
+        every LangGraph node; outcome is success, failure (raised), empty
+        (returned no output although it had a prompt) or skipped (no prompt)
+    genmark_provider_seconds{provider, model}
+    genmark_provider_calls_total{provider, model, outcome}
+        outbound Groq/Gemini/Predis calls, without the rate-limit wait;
+        outcome is success, empty (None), failure or rate_limited
+    genmark_gridfs_seconds{bucket, operation}
+    genmark_gridfs_operations_total{bucket, operation, outcome}
+        GridFS open, read, write and delete; outcome is success or failure
+
+Metrics are per process: scrape every API worker.
+"""
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+GRIDFS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+node_seconds = Histogram(
+    "genmark_node_seconds", "Duration of LangGraph nodes",
+    ["node", "provider", "model"], buckets=LATENCY_BUCKETS
+)
+node_outcomes = Counter(
+    "genmark_node_outcomes_total", "LangGraph node runs by outcome",
+    ["node", "provider", "model", "outcome"]
+)
+provider_seconds = Histogram(
+    "genmark_provider_seconds", "Duration of AI provider calls",
+    ["provider", "model"], buckets=LATENCY_BUCKETS
+)
+provider_calls = Counter(
+    "genmark_provider_calls_total", "AI provider calls by outcome",
+    ["provider", "model", "outcome"]
+)
+gridfs_seconds = Histogram(
+    "genmark_gridfs_seconds", "Duration of GridFS operations",
+    ["bucket", "operation"], buckets=GRIDFS_BUCKETS
+)
+gridfs_operations = Counter(
+    "genmark_gridfs_operations_total", "GridFS operations by outcome",
+    ["bucket", "operation", "outcome"]
+)
+
+
+def observe_node(node: str, provider: str, model: str, seconds: float, outcome: str):
+    node_seconds.labels(node, provider, model).observe(seconds)
+    node_outcomes.labels(node, provider, model, outcome).inc()
+
+
+@contextmanager
+def timed_gridfs(bucket: str, operation: str):
+    started = time.perf_counter()
+    outcome = "failure"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        gridfs_seconds.labels(bucket, operation).observe(time.perf_counter() - started)
+        gridfs_operations.labels(bucket, operation, outcome).inc()
+
+
+def render() -> tuple:
+    """Body and content type of the metrics page."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,178 @@
+"""
+Cursor pagination, column projection and NDJSON streaming for the endpoints
+returning dataset rows (/api/datasets/filtered-data and
+/api/products_datasets/{dataset_id}/content).
+
+Query parameters understood by ``rows_response``:
+    columns=Name,Email    only return these columns
+    limit=500&cursor=...  one page: {"rows": [...], "next_cursor": ..., "total": n}
+    format=ndjson         one JSON object per row and line, written batch by
+                          batch, closed by a {"next_cursor": ...} line
+Without any of them the full row list is returned, as before.
+
+Cursors are opaque tokens binding the row offset to the version of the data
+they were issued for; a cursor from an older version answers 400.
+"""
+import base64
+import binascii
+import json
+from typing import Optional
+import pandas as pd
+import xxhash
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.row_patches import apply_patches
+from app.workers import dataset_executor
+
+MAX_PAGE_SIZE = 10000
+NDJSON_BATCH_ROWS = 1000
+
+
+def parse_columns(columns: Optional[str]):
+    if not columns:
+        return None
+    return [c.strip() for c in columns.split(",") if c.strip()]
+
+
+class RowSource:
+    """
+    Rows of a (possibly shared, cached) frame, optionally restricted to the
+    row ``positions`` of a filtered view. Slices are taken lazily and get the
+    row ``patches`` of the filtered dataset laid over them.
+    """
+
+    def __init__(self, frame: pd.DataFrame, positions=None, columns=None, patches=None):
+        if columns:
+            missing = [c for c in columns if c not in frame.columns]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(missing)}")
+            frame = frame[columns]
+        self.frame = frame
+        self.positions = positions
+        self.patches = patches
+
+    def __len__(self):
+        return len(self.frame) if self.positions is None else len(self.positions)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        if self.positions is None:
+            rows = self.frame.iloc[start:stop]
+        else:
+            rows = self.frame.take(self.positions[start:stop])
+        if self.patches:
+            rows = apply_patches(rows, self.patches, start)
+        return rows
+
+
+class MultiRowSource:
+    """Several ``RowSource`` parts read back to back as one, with ``patches`` over the result."""
+
+    def __init__(self, parts, patches=None):
+        self.parts = parts
+        self.patches = patches
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        pieces = []
+        offset = 0
+        for part in self.parts:
+            size = len(part)
+            if offset >= stop:
+                break
+            lo, hi = max(start - offset, 0), min(stop - offset, size)
+            if lo < hi:
+                pieces.append(part.slice(lo, hi))
+            offset += size
+        if not pieces:
+            return self.parts[0].slice(0, 0)
+        rows = pd.concat(pieces, ignore_index=True)
+        if self.patches:
+            rows = apply_patches(rows, self.patches, start)
+        return rows
+
+
+def records(df: pd.DataFrame) -> list:
+    # Replace NaN with None for proper JSON conversion (null)
+    df = df.astype(object)
+    return df.where(pd.notna(df), None).to_dict(orient="records")
+
+
+def _version_tag(version: str, total: int) -> str:
+    return xxhash.xxh3_64_hexdigest(f"{version}:{total}".encode())
+
+
+def _encode_cursor(start: int, version: str, total: int) -> str:
+    token = f"{start}:{_version_tag(version, total)}".encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: Optional[str], version: str, total: int) -> int:
+    if cursor is None:
+        return 0
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        offset, tag = token.split(":")
+        start = int(offset)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if start < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if tag != _version_tag(version, total):
+        raise HTTPException(status_code=400, detail="Cursor is for an older version of this dataset, start again")
+    return start
+
+
+def _ndjson_batch(source: RowSource, start: int, stop: int) -> str:
+    lines = source.slice(start, stop).to_json(orient="records", lines=True)
+    if not lines.strip():
+        return ""
+    return lines if lines.endswith("\n") else lines + "\n"
+
+
+def ndjson_response(source: RowSource, start: int, stop: int, next_cursor: Optional[str] = None) -> StreamingResponse:
+    async def body():
+        for batch_start in range(start, stop, NDJSON_BATCH_ROWS):
+            # Slicing and serialising a batch run off the event loop
+            batch = await dataset_executor.run_thread(
+                _ndjson_batch, source, batch_start, min(batch_start + NDJSON_BATCH_ROWS, stop)
+            )
+            if batch:
+                yield batch
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+async def rows_response(source: RowSource, cursor: Optional[str] = None,
+                        limit: Optional[int] = None, format: str = "json", version: str = ""):
+    """
+    Rows of ``source`` as described in the module docstring. ``version``
+    identifies the stored data (file and patch state), so cursors issued for
+    other data are rejected.
+    """
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    total = len(source)
+    start = _decode_cursor(cursor, version, total)
+    stop = total if limit is None else min(total, start + limit)
+    next_cursor = _encode_cursor(stop, version, total) if stop < total else None
+
+    if format == "ndjson":
+        return ndjson_response(source, start, stop, next_cursor)
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+
+    def render():
+        rows = records(source.slice(start, stop))
+        if cursor is None and limit is None:
+            return JSONResponse(content=rows)
+        return JSONResponse(content={
+            "rows": rows,
+            "next_cursor": next_cursor,
+            "total": total
+        })
+
+    # Slicing, conversion and JSON encoding of large pages stay off the event loop
+    return await dataset_executor.run_thread(render)
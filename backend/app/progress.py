@@ -0,0 +1,129 @@
+"""
+Generation progress events, pushed to the browser over Server-Sent Events.
+
+The LangGraph nodes and the generation queue ``publish`` events per project
+(prompt_generator, text_ready, image_uploaded, video_ready, router, plus the
+job states queued/running/retrying/completed/failed). Subscribers get the
+recent events of the project replayed, then live ones.
+
+Delivery is in-process. With several API workers set
+PROGRESS_CHANGE_STREAMS=1: events are also written to ``ProgressEvents`` and
+every process tails that collection with a change stream (needs a replica
+set), so a browser connected to one worker sees runs executed by another.
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROGRESS_CHANGE_STREAMS = os.getenv("PROGRESS_CHANGE_STREAMS", "0") == "1"
+PROGRESS_HISTORY = 50
+PROGRESS_PROJECTS = 1000
+PROGRESS_EVENT_TTL = 3600
+
+TERMINAL_EVENTS = ("completed", "failed")
+
+
+def sse_message(message: dict) -> str:
+    return f"event: {message['event']}\ndata: {json.dumps(message, default=str)}\n\n"
+
+
+class ProgressHub:
+    def __init__(self, change_streams: bool = PROGRESS_CHANGE_STREAMS):
+        self.change_streams = change_streams
+        self.origin = uuid.uuid4().hex
+        self._subscribers = {}          # project_id -> set of queues
+        self._history = OrderedDict()   # project_id -> deque of recent messages
+        self._watcher = None
+
+    async def publish(self, project_id, event: str, data: dict = None):
+        message = {
+            "project_id": str(project_id),
+            "event": event,
+            "data": data or {},
+            "at": datetime.utcnow().isoformat(),
+        }
+        self._deliver(message)
+        if self.change_streams:
+            try:
+                from app.db import db
+                await db["ProgressEvents"].insert_one(
+                    {**message, "origin": self.origin, "created_at": datetime.utcnow()}
+                )
+            except Exception as e:
+                print("Progress event not shared:", e)
+
+    def _deliver(self, message: dict):
+        project_id = message["project_id"]
+        history = self._history.get(project_id)
+        if history is None:
+            history = self._history[project_id] = deque(maxlen=PROGRESS_HISTORY)
+            while len(self._history) > PROGRESS_PROJECTS:
+                self._history.popitem(last=False)
+        self._history.move_to_end(project_id)
+        history.append(message)
+        for queue in self._subscribers.get(project_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A client that does not read is not waited for
+                pass
+
+    def subscribe(self, project_id) -> asyncio.Queue:
+        """Queue of the project's events, starting with the recent ones."""
+        project_id = str(project_id)
+        queue = asyncio.Queue(maxsize=PROGRESS_HISTORY * 2)
+        for message in self._history.get(project_id, ()):
+            queue.put_nowait(message)
+        self._subscribers.setdefault(project_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, project_id, queue: asyncio.Queue):
+        project_id = str(project_id)
+        subscribers = self._subscribers.get(project_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[project_id]
+
+    async def _watch(self):
+        from app.db import db
+        collection = db["ProgressEvents"]
+        await collection.create_index("created_at", expireAfterSeconds=PROGRESS_EVENT_TTL)
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.origin}}}]
+        while True:
+            try:
+                async with collection.watch(pipeline) as stream:
+                    async for change in stream:
+                        doc = change["fullDocument"]
+                        self._deliver({k: doc[k] for k in ("project_id", "event", "data", "at")})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Progress change stream failed, retrying:", e)
+                await asyncio.sleep(5)
+
+    def start(self):
+        if self.change_streams and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    def snapshot(self) -> dict:
+        return {
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "projects": len(self._history),
+            "change_streams": self.change_streams,
+        }
+
+
+progress_hub = ProgressHub()
@@ -1,15 +1,16 @@
-from fastapi.responses import JSONResponse
 from fastapi import Body
-import pandas as pd
-import io
-import pandas as pd
-import re
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from pydantic import BaseModel
-from typing import List
-from app.db import dataset_collection, grid_fs, get_database
+from typing import List, Optional
+from app.db import dataset_collection, get_database
+from app.filtered_views import select_audience_views, view_fields, filtered_row_source, filtered_version, materialize_views_of, schedule_compaction, SourceDatasetMissing
+from app.pagination import parse_columns, rows_response
+from app.row_patches import save_patches
+from app.audience import AudienceFilter, AudienceQueryError, compile_target, target_cache_stats
+from app.audience_stats import estimate_audience, cube_cache
+from app.ingest import ingest_csv_upload, release_dataset_files
+from app.frame_cache import frame_cache
 from bson import ObjectId
 
 router = APIRouter(prefix="/api/datasets", tags=["Datasets"])
@@ -39,64 +40,73 @@ def to_object_id(id_str: str, field: str):
 
 
 
-def parse_target_audience(target_str: str):
+async def find_user_datasets(user_obj_id, dataset_names: List[str]) -> List[dict]:
+    """Datasets of a user by name, in the given order; 404 if one is missing or has no file."""
+    datasets = []
+    for dataset_name in dataset_names:
+        dataset = await dataset_collection.find_one(
+            {"user_id": user_obj_id, "dataset_name": dataset_name},
+            {"audience_cube": 0}
+        )
+        if not dataset:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_name}")
+        if not dataset.get("file_id"):
+            raise HTTPException(status_code=404, detail=f"File not found: {dataset_name}")
+        datasets.append(dataset)
+    return datasets
+
+
+def compile_audience(target_str: str, datasets: List[dict] = ()) -> AudienceFilter:
     """
-    Parse the target audience string into a dictionary.
-    Example input:
-    "Category: Footwear | Location: California | Gender: both | Ages: 11-18, 19-25"
+    Compiled (and cached) target audience, checked against the column schema
+    of ``datasets``. Malformed targets and unknown columns answer 400.
     """
-    parsed = {}
-
-    match_category = re.search(r"Category:\s*([^|]+)", target_str)
-    match_location = re.search(r"Location:\s*([^|]+)", target_str)
-    match_gender = re.search(r"Gender:\s*([^|]+)", target_str)
-    match_ages = re.search(r"Ages:\s*(.*)$", target_str)
-
-    if match_category:
-        parsed["Category"] = match_category.group(1).strip()
-    if match_location:
-        parsed["Location"] = match_location.group(1).strip()
-    if match_gender:
-        gender = match_gender.group(1).strip().lower()
-        if gender == "both":
-            parsed["Gender"] = ["male", "female"]
-        else:
-            parsed["Gender"] = [gender]
-    if match_ages:
-        age_str = match_ages.group(1).strip()
-        if "ALL" in age_str:
-            parsed["Ages"] = "ALL"
-        else:
-            parsed["Ages"] = [x.strip() for x in age_str.split(",")]
-
-    return parsed
-
-
-def age_in_range(age: int, target_ranges: list):
-    for range_str in target_ranges:
-        if "+" in range_str:
-            min_age = int(range_str.replace("+", "").strip())
-            if age >= min_age:
-                return True
-        else:
-            try:
-                start, end = map(int, range_str.split("-"))
-                if start <= age <= end:
-                    return True
-            except:
-                continue
-    return False
-
+    try:
+        audience = compile_target(target_str)
+        for dataset in datasets:
+            audience.check_schema(dataset.get("columns"))
+    except AudienceQueryError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid target audience: {e}")
+    return audience
 
 
 @router.get("/", response_model=List[DatasetOut])
 async def get_datasets():
     datasets = []
-    async for dataset in dataset_collection.find():
+    async for dataset in dataset_collection.find({}, {"audience_cube": 0}):
         datasets.append(dataset_helper(dataset))
     return datasets
 
 
+@router.get("/cache-stats")
+async def get_cache_stats():
+    return {**frame_cache.snapshot(), "targets": target_cache_stats()}
+
+
+@router.get("/audience-size")
+async def estimate_audience_size(user_id: str, dataset_name: str, target: str):
+    """
+    Size of the audience a target string like
+    "Category: Footwear | Location: California | Gender: both | Ages: 11-18"
+    selects in a dataset, answered from its upload-time count cube.
+    """
+    user_obj_id = to_object_id(user_id, "user_id")
+    dataset = await dataset_collection.find_one(
+        {"user_id": user_obj_id, "dataset_name": dataset_name},
+        {"audience_cube": 0}
+    )
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    audience = compile_audience(target, [dataset])
+    try:
+        audience_size = await estimate_audience(dataset, audience)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Dataset has no {e.args[0]} column")
+
+    return {"audience_size": audience_size, "target": audience.parsed}
+
+
 @router.get("/check-filtered-exists")
 async def check_filtered_exists(user_id: str, project_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     user_obj_id = ObjectId(user_id)
@@ -137,69 +147,42 @@ async def filter_dataset_by_target_audience(
         raise HTTPException(status_code=404, detail="Project or dataset not found")
 
     target_string = project["target_audience"]
-    dataset_name = project["selected_dataset"]
-    dataset = await dataset_collection.find_one({
-        "user_id": user_obj_id,
-        "dataset_name": dataset_name
-    })
-    if not dataset:
-        raise HTTPException(status_code=404, detail="Dataset not found")
+    dataset_names = project.get("selected_datasets") or [project["selected_dataset"]]
+    datasets = await find_user_datasets(user_obj_id, dataset_names)
 
-    file_id = dataset.get("file_id")
-    if not file_id:
-        raise HTTPException(status_code=404, detail="File not found")
+    # Compile the target string, checked against the datasets' columns
+    audience = compile_audience(target_string, datasets)
+    print("Parsed filter:", audience.parsed)
 
-    # Load the original CSV
-    grid_in = await grid_fs.open_download_stream(file_id)
-    content = await grid_in.read()
-    df = pd.read_csv(io.StringIO(content.decode("utf-8")))
-
-    # Parse the target string
-    parsed = parse_target_audience(target_string)
-    print("Parsed filter:", parsed)
-
-    # Apply filters
-    if "Category" in parsed:
-        df = df[df["Category"].str.lower() == parsed["Category"].lower()]
-
-    if "Location" in parsed:
-        df = df[df["Location"].str.lower() == parsed["Location"].lower()]
-
-    if "Gender" in parsed:
-        df = df[df["Gender"].str.lower().isin(parsed["Gender"])]
-
-    if "Ages" in parsed and parsed["Ages"] != "ALL":
-        df = df[df["Age"].apply(lambda x: age_in_range(int(x), parsed["Ages"]))]
-
-    # Save filtered CSV to memory
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-
-    # Upload to GridFS in a separate bucket
-    filtered_fs = AsyncIOMotorGridFSBucket(db, bucket_name="FilteredDatasetBucket")
-    filtered_file_id = await filtered_fs.upload_from_stream(
-        f"{dataset_name}_filtered.csv",
-        io.BytesIO(buffer.getvalue().encode("utf-8")),
-        metadata={"filtered_for": target_string}
-    )
+    # Apply filters through each dataset's inverted index (scan as fallback), in parallel;
+    # the result is kept as row views over the source datasets
+    views, filtered_count = await select_audience_views(datasets, audience)
 
     # Store metadata in a new collection
     await db["FilteredDataset"].insert_one({
         "user_id": user_obj_id,
         "project_id": project_obj_id,
-        "file_id": filtered_file_id,
-        "target": parsed,
-        "original_dataset": dataset_name,
-        "filtered_count": len(df),
+        "file_id": None,
+        **view_fields(views),
+        "target": audience.parsed,
+        "original_dataset": ", ".join(dataset_names),
+        "filtered_count": filtered_count,
         "shared": []
     })
 
-    return {"detail": "Stored in GridFS", "filtered_count": len(df)}
+    return {"detail": "Stored as row view", "filtered_count": filtered_count}
 
 
 @router.get("/filtered-data")
-async def get_filtered_dataset(user_id: str, project_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+async def get_filtered_dataset(
+    user_id: str,
+    project_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    columns: Optional[str] = None,
+    format: str = "json",
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
     user_obj_id = to_object_id(user_id, "user_id")
     project_obj_id = to_object_id(project_id, "project_id")
 
@@ -213,16 +196,15 @@ async def get_filtered_dataset(user_id: str, project_id: str, db: AsyncIOMotorDa
     if not filtered_doc:
         raise HTTPException(status_code=404, detail="Filtered dataset not found")
 
-    file_id = filtered_doc.get("file_id")
-    if not file_id:
+    if not any(filtered_doc.get(k) for k in ("file_id", "view", "views")):
         raise HTTPException(status_code=404, detail="File ID missing")
 
-    filtered_fs = AsyncIOMotorGridFSBucket(db, bucket_name="FilteredDatasetBucket")
-    grid_in = await filtered_fs.open_download_stream(file_id)
-    content = await grid_in.read()
+    try:
+        source = await filtered_row_source(filtered_doc, parse_columns(columns))
+    except SourceDatasetMissing as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-    df = pd.read_csv(io.StringIO(content.decode("utf-8")))
-    return JSONResponse(content=df.to_dict(orient="records"))
+    return await rows_response(source, cursor, limit, format, filtered_version(filtered_doc))
 
 
 
@@ -247,43 +229,26 @@ async def save_filtered_dataset_head(
     if not filtered_doc:
         raise HTTPException(status_code=404, detail="Filtered dataset not found")
 
-    file_id = filtered_doc.get("file_id")
-    if not file_id:
+    if not any(filtered_doc.get(k) for k in ("file_id", "view", "views")):
         raise HTTPException(status_code=400, detail="File ID missing")
 
-    # Load the filtered dataset from GridFS
-    filtered_fs = AsyncIOMotorGridFSBucket(db, bucket_name="FilteredDatasetBucket")
-    grid_in = await filtered_fs.open_download_stream(file_id)
-    content = await grid_in.read()
-
-    df = pd.read_csv(io.StringIO(content.decode("utf-8")))
-
-    # Update Email values in the DataFrame
-    for i, row in enumerate(rows):
-        if i < len(df) and "Email" in row:
-            df.at[i, "Email"] = row["Email"]
-
-    # Delete the old file
-    await filtered_fs.delete(file_id)
-
-    # Upload the modified CSV back to GridFS
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-
-    new_file_id = await filtered_fs.upload_from_stream(
-        f"{filtered_doc['original_dataset']}_filtered.csv",
-        io.BytesIO(buffer.getvalue().encode("utf-8")),
-        metadata={"updated": True}
-    )
+    # Current Email values of the edited rows, with earlier patches applied
+    try:
+        source = await filtered_row_source(filtered_doc, ["Email"])
+    except SourceDatasetMissing as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    current = source.slice(0, min(len(rows), len(source)))["Email"].tolist()
 
-    # Update the document with the new file_id
-    await db["FilteredDataset"].update_one(
-        {"_id": filtered_doc["_id"]},
-        {"$set": {"file_id": new_file_id}}
-    )
+    # Only the cells that actually changed are stored, as patches over the rows
+    changes = [
+        (i, "Email", row["Email"])
+        for i, row in enumerate(rows[:len(current)])
+        if "Email" in row and row["Email"] != current[i]
+    ]
+    patch_count = await save_patches(filtered_doc, changes)
+    schedule_compaction(db, filtered_doc["_id"], patch_count)
 
-    return {"detail": "Filtered dataset updated successfully."}
+    return {"detail": "Filtered dataset updated successfully.", "patched_rows": len(changes)}
 
 
 @router.post("/upload")
@@ -305,36 +270,26 @@ async def upload_dataset(
             detail="A dataset with this name already exists for this user."
         )
 
-    content = await file.read()
-    df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-
-    categories = df["Category"].dropna().unique().tolist() if "Category" in df.columns else []
-    locations = df["Location"].dropna().unique().tolist() if "Category" in df.columns else []
-    
-    categories = sorted(categories)
-    locations = sorted(locations)
-    
-    # Store file in GridFS (async)
-    await file.seek(0)
-    grid_out = await grid_fs.upload_from_stream(
-        file.filename,
-        file.file,
-        metadata={
-            "content_type": file.content_type
-        }
-    )
-    file_id = grid_out
+    # Stream the CSV into GridFS (plus its columnar copy) while profiling it
+    try:
+        stored = await ingest_csv_upload(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse CSV file: {e}")
+    file_id = stored["file_id"]
 
     # Create metadata document
     dataset_doc = {
         "user_id": user_obj_id,
         "dataset_name": dataset_name,
-        "file_id": file_id,
-        "categories": categories,
-        "locations": locations
+        **stored
     }
 
-    result = await dataset_collection.insert_one(dataset_doc)
+    try:
+        result = await dataset_collection.insert_one(dataset_doc)
+    except Exception:
+        # Nothing references the stored files then
+        await release_dataset_files(stored)
+        raise
 
     return {
         "dataset_id": str(result.inserted_id),
@@ -350,7 +305,7 @@ async def upload_dataset(
 @router.get("/{user_id}", response_model = List[DatasetOut])
 async def get_user_datasets(user_id: str):
     datasets = []
-    async for dataset in dataset_collection.find({"user_id": ObjectId(user_id)}):
+    async for dataset in dataset_collection.find({"user_id": ObjectId(user_id)}, {"audience_cube": 0}):
         datasets.append(dataset_helper(dataset))
     return datasets
 
@@ -358,26 +313,28 @@ async def get_user_datasets(user_id: str):
 @router.get("/{dataset_id}", response_model=DatasetOut)
 async def get_dataset(dataset_id: str):
     obj_id = to_object_id(dataset_id, "dataset_id")
-    dataset = await dataset_collection.find_one({"_id": obj_id})
+    dataset = await dataset_collection.find_one({"_id": obj_id}, {"audience_cube": 0})
     if dataset:
         return dataset_helper(dataset)
     raise HTTPException(status_code=404, detail="Dataset not found")
 
 
 @router.delete("/{dataset_id}")
-async def delete_dataset(dataset_id: str):
+async def delete_dataset(dataset_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     obj_id = to_object_id(dataset_id, "dataset_id")
 
     dataset = await dataset_collection.find_one({"_id": obj_id})
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    file_id = dataset.get("file_id")
+    # Filtered views still point at this dataset's rows, copy them out first
+    await materialize_views_of(db, dataset)
 
     result = await dataset_collection.delete_one({"_id": obj_id})
 
     if result.deleted_count == 1:
-        if file_id:
-            await grid_fs.delete(file_id)
+        # Files are shared between datasets with identical content
+        await release_dataset_files(dataset)
+        cube_cache.discard(obj_id)
         return {"detail": "Dataset deleted"}
     raise HTTPException(status_code=404, detail="Dataset not found")
@@ -14,6 +14,7 @@ import os
 from io import BytesIO
 from PIL import Image
 from app.db import get_database
+from GenAI.rate_limit import call_provider, estimate_tokens
 
 load_dotenv()
 
@@ -101,7 +102,10 @@ async def edit_text_output(
         )
 
         # Call Gemini API
-        response = client.models.generate_content(
+        response = await call_provider(
+            "gemini",
+            client.models.generate_content,
+            tokens=estimate_tokens(system_prompt, full_prompt, completion=400),
             model="models/gemini-2.5-flash",
             config = types.GenerateContentConfig(
                 system_instruction = system_prompt,
@@ -165,7 +169,10 @@ async def edit_image_output(
             f"{instruction}"
         )
 
-        response = client.models.generate_content(  # make sure this is not conflicting with httpx client
+        response = await call_provider(  # make sure this is not conflicting with httpx client
+            "gemini",
+            client.models.generate_content,
+            tokens=estimate_tokens(text_input, completion=1290),
             model="gemini-2.0-flash-preview-image-generation",
             contents=[text_input, image],
             config=types.GenerateContentConfig(
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
-from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from app.db import get_database
+from app.db import get_database, TimedGridFSBucket
 
 
 router = APIRouter(prefix="/api/generated_output", tags = ["GeneratedOutput"])
@@ -31,7 +31,7 @@ async def get_generated_output(generated_output_id: str, db: AsyncIOMotorDatabas
 @router.get("/image/{image_id}")
 async def get_image(image_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     try:
-        bucket = AsyncIOMotorGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
+        bucket = TimedGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
         file = await bucket.open_download_stream(ObjectId(image_id))
         return StreamingResponse(file, media_type="image/jpeg")
     except Exception as e:
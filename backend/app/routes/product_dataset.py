@@ -1,14 +1,14 @@
-from fastapi.responses import JSONResponse
 from fastapi import Body
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from pydantic import BaseModel
-from typing import List
-from app.db import product_dataset_collection, grid_fs, get_database
+from typing import List, Optional
+from app.db import product_dataset_collection, get_database
+from app.dataset_io import load_dataset_frame
+from app.ingest import ingest_csv_upload, release_dataset_files
+from app.pagination import RowSource, parse_columns, rows_response
 from bson import ObjectId
-import io
-import pandas as pd
 
 router = APIRouter(prefix="/api/products_datasets", tags=["Products Datasets"])
 
@@ -59,30 +59,27 @@ async def upload_dataset(
             detail="A dataset with this name already exists for this user."
         )
     
-    content = await file.read()
     try:
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-    except Exception as e:
+        stored = await ingest_csv_upload(file, audience=False)
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Failed to parse CSV file: {e}")
-
-    row_count = len(df)
-    
-    await file.seek(0)
-    grid_out = await grid_fs.upload_from_stream(
-        file.filename,
-        file.file,
-        metadata={"content_type": file.content_type}
-    )
-    file_id = grid_out
+    file_id = stored["file_id"]
 
     dataset_doc = {
         "user_id": user_obj_id,
         "dataset_name": dataset_name,
         "file_id": file_id,
-        "row_count": row_count,
+        "columnar_file_id": stored["columnar_file_id"],
+        "row_count": stored["row_count"],
+        "columns": stored["columns"],
     }
 
-    result = await product_dataset_collection.insert_one(dataset_doc)
+    try:
+        result = await product_dataset_collection.insert_one(dataset_doc)
+    except Exception:
+        # Nothing references the stored files then
+        await release_dataset_files(stored, audience=False)
+        raise
 
     return {
         "dataset_id": str(result.inserted_id),
@@ -100,9 +97,16 @@ async def get_user_datasets(user_id: str):
 
 # NEW: Endpoint to get the actual content of the dataset
 @router.get("/{dataset_id}/content")
-async def get_dataset_content(dataset_id: str):
+async def get_dataset_content(
+    dataset_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    columns: Optional[str] = None,
+    format: str = "json"
+):
     """
     Retrieves and returns the content of a dataset file from GridFS, parsed as JSON.
+    Supports column projection, cursor pagination and NDJSON streaming (see app.pagination).
     """
     obj_id = to_object_id(dataset_id, "dataset_id")
     
@@ -115,21 +119,20 @@ async def get_dataset_content(dataset_id: str):
     if not file_id:
         raise HTTPException(status_code=404, detail="File ID not found for this dataset")
 
-    # Retrieve the file from GridFS
+    # Retrieve the file from GridFS (columnar copy when available), only the requested columns
+    columns = parse_columns(columns)
     try:
-        grid_in = await grid_fs.open_download_stream(file_id)
-        content_bytes = await grid_in.read()
+        try:
+            df = await load_dataset_frame(dataset_meta, columns)
+        except ValueError:
+            # The readers reject unknown columns; load them all so RowSource can name the missing ones
+            df = await load_dataset_frame(dataset_meta)
     except Exception:
         raise HTTPException(status_code=404, detail="Could not retrieve file from storage.")
 
-    # Parse the CSV content and return as JSON
-    try:
-        df = pd.read_csv(io.BytesIO(content_bytes))
-        # Replace NaN with None for proper JSON conversion (null)
-        df = df.where(pd.notna(df), None)
-        return JSONResponse(content=df.to_dict(orient="records"))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to parse file content: {e}")
+    # Return the content as JSON (or one page / an NDJSON stream of it)
+    source = RowSource(df, columns=columns)
+    return await rows_response(source, cursor, limit, format, str(file_id))
 
 @router.get("/{dataset_id}", response_model=DatasetOut)
 async def get_dataset(dataset_id: str):
@@ -147,17 +150,11 @@ async def delete_dataset(dataset_id: str):
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    file_id = dataset.get("file_id")
-
     result = await product_dataset_collection.delete_one({"_id": obj_id})
 
     if result.deleted_count == 1:
-        if file_id:
-            try:
-                await grid_fs.delete(file_id)
-            except Exception:
-                # Log this error but don't fail the request,
-                # as the primary metadata has been deleted.
-                pass
+        # Removes the files once no other catalog shares the content;
+        # errors are logged but don't fail the request
+        await release_dataset_files(dataset, audience=False)
         return {"detail": "Dataset deleted"}
     raise HTTPException(status_code=404, detail="Dataset not found")
\ No newline at end of file
@@ -1,18 +1,30 @@
-from app.routes.dataset import parse_target_audience, age_in_range 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from app.routes.dataset import compile_audience, find_user_datasets
+from app.filtered_views import select_audience_views, view_fields
+from app.frame_cache import frame_cache
+from app.row_patches import drop_patches
+from app.blob_store import upload_bytes, delete_bytes
+from app.campaigns import (
+    batch_collection, insert_in_batches, product_fields, MAX_BULK_PRODUCTS
+)
+from app.generation_jobs import generation_queue, job_collection
+from GenAI.checkpoint import checkpointer
+from app.progress import progress_hub, sse_message, TERMINAL_EVENTS
+from app.dataset_io import load_dataset_frame
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Body
 from fastapi.responses import StreamingResponse
-from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from datetime import datetime
 import asyncio
-from typing import List
-from app.db import get_database, grid_fs
-import pandas as pd
-from GenAI.Langgraph import run_langgraph_for_project
-import io
+from typing import List, Optional
+from app.db import get_database, product_dataset_collection, TimedGridFSBucket
+from GenAI.prompt_cache import prompt_cache
+from GenAI.rate_limit import limiter_stats
 
 router = APIRouter(prefix="/api/project", tags = ["Projects"])
 
+PROGRESS_HEARTBEAT = 15
+
 async def upsert_generated_output(db, project_id, update_fields):
     collection = db["GeneratedOutput"]
     existing = await collection.find_one({"project_id": ObjectId(project_id)})
@@ -72,6 +84,8 @@ async def create_project_and_product(
     name: str = Form(...),
     target_audience: str = Form(...),
     selected_dataset: str = Form(...),
+    # Further datasets to take the audience from (deduplicated by Email)
+    selected_datasets: Optional[List[str]] = Form(None),
     output_format: str = Form(...),
     product_name: str = Form(...),
     description: str = Form(...),
@@ -91,14 +105,20 @@ async def create_project_and_product(
     if exists or exists2:
         raise HTTPException(status_code=404, detail="Product or Project already exists")
     print("Test1")
+    dataset_names = list(dict.fromkeys([selected_dataset] + (selected_datasets or [])))
+    datasets = await find_user_datasets(ObjectId(user_id), dataset_names)
+    print("Datasets found ", [d["dataset_name"] for d in datasets])
+    # Reject unknown columns / malformed targets before anything is stored
+    audience = compile_audience(target_audience, datasets)
     
     # Upload images
-    product_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="ProductImageBucket")
+    product_bucket = TimedGridFSBucket(db, bucket_name="ProductImageBucket")
     image_ids = []
     print("Test2")
     for img in product_images:
         content = await img.read()
-        file_id = await product_bucket.upload_from_stream(img.filename, content)
+        # Identical images are stored once and shared between products
+        file_id = await upload_bytes(product_bucket, "product-image", img.filename, content)
         image_ids.append(str(file_id))
 
     print("Test3")
@@ -122,6 +142,7 @@ async def create_project_and_product(
         "name": name,
         "target_audience": target_audience,
         "selected_dataset": selected_dataset,
+        "selected_datasets": dataset_names,
         "output_format": output_format,
         "product_id": ObjectId(product_result.inserted_id),
         "generated_outputs_id": None,
@@ -136,56 +157,18 @@ async def create_project_and_product(
     print("\n\nProject ID After inserting : ", project_id)
 
 
-    dataset = await db["Datasets"].find_one({
-        "user_id": ObjectId(user_id),
-        "dataset_name": selected_dataset
-    })
-    if not dataset:
-        raise HTTPException(status_code=404, detail="Dataset not found")
-    
-    print("Dataset found ", dataset)
-
-    file_id = dataset.get("file_id")
-    if not file_id:
-        raise HTTPException(status_code=400, detail="File not found")
-
-    # Load dataset
-    grid_in = await grid_fs.open_download_stream(file_id)
-    content = await grid_in.read()
-    df = pd.read_csv(io.StringIO(content.decode("utf-8")))
-
-    # Apply filtering
-    parsed = parse_target_audience(target_audience)
-
-    if "Category" in parsed:
-        df = df[df["Category"].str.lower() == parsed["Category"].lower()]
-    if "Location" in parsed:
-        df = df[df["Location"].str.lower() == parsed["Location"].lower()]
-    if "Gender" in parsed:
-        df = df[df["Gender"].str.lower().isin(parsed["Gender"])]
-    if "Ages" in parsed and parsed["Ages"] != "ALL":
-        df = df[df["Age"].apply(lambda x: age_in_range(int(x), parsed["Ages"]))]
-
-    # Save filtered file
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-
-    filtered_fs = AsyncIOMotorGridFSBucket(db, bucket_name="FilteredDatasetBucket")
-    filtered_file_id = await filtered_fs.upload_from_stream(
-        f"{selected_dataset}_filtered.csv",
-        io.BytesIO(buffer.getvalue().encode("utf-8")),
-        metadata={"filtered_for": target_audience}
-    )
+    # Apply filtering on every dataset in parallel (inverted index lookup, scan as fallback)
+    views, filtered_count = await select_audience_views(datasets, audience)
 
-    # Insert into FilteredDataset collection
+    # Insert into FilteredDataset collection, stored as row views over the datasets
     filtered_insert = await db["FilteredDataset"].insert_one({
         "user_id": ObjectId(user_id),
         "project_id": project_id,
-        "file_id": filtered_file_id,
-        "target": parsed,
-        "original_dataset": selected_dataset,
-        "filtered_count": len(df)
+        "file_id": None,
+        **view_fields(views),
+        "target": audience.parsed,
+        "original_dataset": ", ".join(dataset_names),
+        "filtered_count": filtered_count
     })
     filtered_dataset_id = filtered_insert.inserted_id
 
@@ -233,14 +216,245 @@ async def create_project_and_product(
         "video_output": None
     }
 
-    # Call langgraph
-    asyncio.create_task(run_langgraph_for_project(project_input_data))
+    # Queue the langgraph run, the generation workers pick it up
+    await generation_queue.enqueue(project_input_data)
 
     return {"message": "Project and Product created", "project_id": str(project_result.inserted_id)}
 
 
+# Bulk creation: one project per row of a products dataset
+@router.post("/bulk-create")
+async def bulk_create_projects(
+    user_id: str = Body(...),
+    products_dataset_id: str = Body(...),
+    target_audience: str = Body(...),
+    selected_dataset: str = Body(...),
+    output_format: str = Body(...),
+    # Further datasets to take the audience from (deduplicated by Email)
+    selected_datasets: Optional[List[str]] = Body(None),
+    # Projects are named "<name_prefix> - <product_name>", or just the product name
+    name_prefix: Optional[str] = Body(None),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    try:
+        user_obj_id = ObjectId(user_id)
+        products_obj_id = ObjectId(products_dataset_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid user or products dataset ID")
+    # Products dataset rows carry no pictures and image generation needs one to edit
+    if "image" in output_format.lower():
+        raise HTTPException(status_code=400, detail="Bulk campaigns cannot generate images: products have no reference images")
+
+    products_dataset = await product_dataset_collection.find_one({"_id": products_obj_id, "user_id": user_obj_id})
+    if not products_dataset:
+        raise HTTPException(status_code=404, detail="Products dataset not found")
+
+    dataset_names = list(dict.fromkeys([selected_dataset] + (selected_datasets or [])))
+    datasets = await find_user_datasets(user_obj_id, dataset_names)
+    audience = compile_audience(target_audience, datasets)
+
+    catalog = await load_dataset_frame(products_dataset)
+    if "product_name" not in catalog.columns:
+        raise HTTPException(status_code=400, detail="Products dataset has no product_name column")
+    rows = {}
+    for row in catalog.to_dict(orient="records"):
+        fields = product_fields(row)
+        if fields["product_name"] and fields["product_name"] not in rows:
+            rows[fields["product_name"]] = fields
+    if not rows:
+        raise HTTPException(status_code=400, detail="Products dataset has no products")
+    if len(rows) > MAX_BULK_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_PRODUCTS} products per bulk campaign")
+
+    project_names = {
+        product_name: f"{name_prefix} - {product_name}" if name_prefix else product_name
+        for product_name in rows
+    }
+    exists = await db["Projects"].find_one({"name": {"$in": list(project_names.values())}})
+    exists2 = await db["Products"].find_one({"name": {"$in": list(rows)}})
+    if exists or exists2:
+        raise HTTPException(status_code=400, detail="Product or Project already exists")
+
+    # The audience is the same for every project: select it once
+    views, filtered_count = await select_audience_views(datasets, audience)
+
+    batch_id = ObjectId()
+    now = datetime.utcnow()
+    products, projects, filtered, outputs, inputs = [], [], [], [], []
+    for product_name, fields in rows.items():
+        product_id, project_id, filtered_id = ObjectId(), ObjectId(), ObjectId()
+        products.append({
+            "_id": product_id,
+            "name": product_name,
+            "description": fields["description"],
+            "price": fields["price"],
+            "product_url": fields["product_url"],
+            "discount": fields["discount"],
+            "images": [],
+            "project_id": project_id
+        })
+        projects.append({
+            "_id": project_id,
+            "user_id": user_obj_id,
+            "name": project_names[product_name],
+            "target_audience": target_audience,
+            "selected_dataset": selected_dataset,
+            "selected_datasets": dataset_names,
+            "output_format": output_format,
+            "product_id": product_id,
+            "filtered_dataset_id": filtered_id,
+            "campaign_batch_id": batch_id,
+            "generated_outputs_id": None,
+            "status": "in_progress",
+            "created_at": now,
+            "shared": []
+        })
+        filtered.append({
+            "_id": filtered_id,
+            "user_id": user_obj_id,
+            "project_id": project_id,
+            "file_id": None,
+            **view_fields(views),
+            "target": audience.parsed,
+            "original_dataset": ", ".join(dataset_names),
+            "filtered_count": filtered_count
+        })
+        outputs.append({"project_id": project_id})
+        inputs.append({
+            "user_id": user_id,
+            "project_id": str(project_id),
+            "product_id": str(product_id),
+            "name": project_names[product_name],
+            "product_name": product_name,
+            "description": fields["description"],
+            "product_url": fields["product_url"],
+            "price": fields["price"],
+            "discount": fields["discount"],
+            "image_ids": [],
+            "target_audience": target_audience,
+            "output_format": output_format,
+            "status": "initiated",
+            "generationDone": "NotStarted",
+            "generated_outputs_id": None,
+            "automate_campaign": None,
+            "text_prompt": "",
+            "image_prompt": "",
+            "video_prompt": "",
+            "text_output": None,
+            "image_output": None,
+            "video_output": None
+        })
+
+    await batch_collection.insert_one({
+        "_id": batch_id,
+        "user_id": user_obj_id,
+        "products_dataset_id": products_obj_id,
+        "target_audience": target_audience,
+        "output_format": output_format,
+        "total": len(inputs),
+        "completed": 0,
+        "failed": 0,
+        "status": "running",
+        "project_ids": [p["_id"] for p in projects],
+        "created_at": now,
+        "finished_at": None
+    })
+    await insert_in_batches(db["Products"], products)
+    await insert_in_batches(db["Projects"], projects)
+    await insert_in_batches(db["FilteredDataset"], filtered)
+    await insert_in_batches(db["GeneratedOutput"], outputs)
+    print(f"Campaign batch {batch_id}: {len(inputs)} projects created")
+
+    await generation_queue.enqueue_many(inputs, batch_id)
+
+    return {
+        "message": "Bulk campaign started",
+        "batch_id": str(batch_id),
+        "project_ids": [str(p["_id"]) for p in projects]
+    }
+
+
+@router.get("/bulk/{batch_id}")
+async def get_bulk_progress(batch_id: str):
+    try:
+        batch_obj_id = ObjectId(batch_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid batch ID")
+    batch = await batch_collection.find_one({"_id": batch_obj_id})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Campaign batch not found")
+    batch["project_ids"] = [str(p) for p in batch.get("project_ids", [])]
+    return clean_mongo_doc(batch)
+
+
+
+
 
 
+# Live generation progress (Server-Sent Events)
+@router.get("/events/{project_id}")
+async def stream_project_events(project_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        project = await db["Projects"].find_one({"_id": ObjectId(project_id)}, {"status": 1})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid project ID")
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    queue = progress_hub.subscribe(project_id)
+
+    async def events():
+        try:
+            # Already finished: say so instead of waiting for events that will not come
+            if project.get("status") in TERMINAL_EVENTS and queue.empty():
+                yield sse_message({"project_id": project_id, "event": project["status"], "data": {}})
+                return
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), PROGRESS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(message)
+                if message["event"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            progress_hub.unsubscribe(project_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Resume an interrupted or failed generation from its last checkpoint
+@router.post("/resume/{project_id}")
+async def resume_project_generation(project_id: str):
+    try:
+        project_obj_id = ObjectId(project_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid project ID")
+    job = await job_collection.find_one({"project_id": project_obj_id}, sort=[("created_at", -1)])
+    if not job:
+        raise HTTPException(status_code=404, detail="No generation found for this project")
+    if job["state"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="Generation is already queued or running")
+    if job["state"] == "succeeded":
+        raise HTTPException(status_code=409, detail="Generation already finished")
+    # The workflow continues from the project's checkpoint, finished branches are kept
+    await generation_queue.enqueue(job["payload"])
+    return {"message": "Generation resumed", "project_id": project_id}
+
+
+@router.get("/prompt-cache-stats")
+async def get_prompt_cache_stats():
+    return prompt_cache.snapshot()
+
+
+@router.get("/provider-limits")
+async def get_provider_limits():
+    return limiter_stats()
 
 
 @router.get("/all")
@@ -335,7 +549,7 @@ async def upload_generated_image(
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     print("Reached Upload")
-    bucket = AsyncIOMotorGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
+    bucket = TimedGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
     print("Inside upload generated image")
     content = await image_output.read()
     print("Read Uploaded Inside upload generated image")
@@ -375,7 +589,7 @@ async def upload_generated_video(
 @router.get("/uploaded/image/{file_id}")
 async def stream_image(file_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     try:
-        bucket = AsyncIOMotorGridFSBucket(db, bucket_name="ProductImageBucket")
+        bucket = TimedGridFSBucket(db, bucket_name="ProductImageBucket")
         stream = await bucket.open_download_stream(ObjectId(file_id))
         return StreamingResponse(stream, media_type="image/jpeg")
     except:
@@ -402,6 +616,10 @@ async def delete_project(project_id: str, db: AsyncIOMotorDatabase = Depends(get
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    # Generation that has not started yet is dropped with the project, as are its checkpoints
+    await generation_queue.cancel(project_id)
+    await checkpointer.adelete_thread(project_id)
+
     # === Delete Filtered Dataset & File from GridFS ===
     filtered_dataset_id = project.get("filtered_dataset_id")
     if filtered_dataset_id:
@@ -409,14 +627,16 @@ async def delete_project(project_id: str, db: AsyncIOMotorDatabase = Depends(get
             dataset = await db["FilteredDataset"].find_one({"_id": ObjectId(filtered_dataset_id)})
             if dataset:
                 file_id = dataset.get("file_id")
-                filtered_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="FilteredDatasetBucket")
+                filtered_bucket = TimedGridFSBucket(db, bucket_name="FilteredDatasetBucket")
                 if file_id:
                     try:
                         await filtered_bucket.delete(ObjectId(file_id))
+                        frame_cache.invalidate(file_id)
                         print("Deleted filtered dataset file from GridFS.")
                     except Exception as e:
                         print("Error deleting filtered dataset file:", e)
 
+                await drop_patches(dataset["_id"])
                 await db["FilteredDataset"].delete_one({"_id": ObjectId(filtered_dataset_id)})
                 print("Filtered dataset metadata deleted.")
             else:
@@ -432,7 +652,7 @@ async def delete_project(project_id: str, db: AsyncIOMotorDatabase = Depends(get
             generated_output = await db["GeneratedOutput"].find_one({"_id": output_oid})
             if generated_output:
                 image_id = generated_output.get("image")
-                bucket = AsyncIOMotorGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
+                bucket = TimedGridFSBucket(db, bucket_name="GeneratedOutputsBucket")
                 if image_id:
                     try:
                         await bucket.delete(ObjectId(image_id))
@@ -452,10 +672,10 @@ async def delete_project(project_id: str, db: AsyncIOMotorDatabase = Depends(get
         try:
             product = await db["Products"].find_one({"_id": ObjectId(product_id)})
             if product:
-                product_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="ProductImageBucket")
+                product_bucket = TimedGridFSBucket(db, bucket_name="ProductImageBucket")
                 for img_id in product.get("images", []):
                     try:
-                        await product_bucket.delete(ObjectId(img_id))
+                        await delete_bytes(product_bucket, "product-image", ObjectId(img_id))
                         print(f"Deleted product image: {img_id}")
                     except Exception as e:
                         print(f"Error deleting product image {img_id}: {e}")
@@ -2,10 +2,14 @@
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
+from typing import Optional
+from bson import ObjectId
 import smtplib
 from email.message import EmailMessage
 import os
 from dotenv import load_dotenv
+from app.db import db
+from app.filtered_views import resolve_filtered_dataset, SourceDatasetMissing
 
 load_dotenv()
 
@@ -19,10 +23,43 @@ APP_PASSWORD = os.getenv("APP_PASSWORD")
 class EmailPayload(BaseModel):
     subject: str
     html_body: str
-    recipients: list[EmailStr]
+    recipients: list[EmailStr] = []
+    # Without explicit recipients, mail the project's filtered audience
+    project_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+
+async def resolve_recipients(project_id: str, user_id: str) -> list[str]:
+    try:
+        project_obj_id, user_obj_id = ObjectId(project_id), ObjectId(user_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid project_id or user_id format")
+
+    filtered_doc = await db["FilteredDataset"].find_one({
+        "project_id": project_obj_id,
+        "$or": [
+            {"user_id": user_obj_id},
+            {"shared": {"$in": [user_obj_id]}}
+        ]
+    })
+    if not filtered_doc:
+        raise HTTPException(status_code=404, detail="Filtered dataset not found")
+
+    try:
+        df = await resolve_filtered_dataset(filtered_doc, columns=["Email"])
+    except SourceDatasetMissing as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return df["Email"].dropna().astype(str).tolist()
 
 @router.post("/send-email")
 async def send_email(payload: EmailPayload):
+    if not payload.recipients:
+        if not (payload.project_id and payload.user_id):
+            raise HTTPException(status_code=400, detail="No recipients given.")
+        payload.recipients = await resolve_recipients(payload.project_id, payload.user_id)
+        if not payload.recipients:
+            raise HTTPException(status_code=404, detail="Filtered dataset has no emails.")
+
     try:
         print("Sending email to:", payload.recipients)
         print("Subject:", payload.subject)
@@ -0,0 +1,123 @@
+"""
+Edit overlay for filtered datasets.
+
+Cell edits (save-filtered-head) are not written back into the filtered data.
+They are upserted into ``FilteredDatasetPatches``, one document per
+(filtered dataset, row, column) carrying the value and the ``seq`` of the
+save that wrote it. Readers merge the patches with ``seq`` above the
+document's ``compacted_seq`` (set by compactions of earlier versions) on
+top of the rows they return. Once more than PATCH_COMPACT_THRESHOLD patches
+pile up, ``app.filtered_views`` folds them into a new materialized file in the
+background and deletes exactly the patch versions it folded in: a patch
+written or overwritten meanwhile stays live. Laying a folded patch over the
+new file again is harmless, it sets the value the file already holds.
+"""
+import os
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import UpdateOne, ReturnDocument
+from app.db import db
+
+load_dotenv()
+
+PATCH_COMPACT_THRESHOLD = int(os.getenv("PATCH_COMPACT_THRESHOLD", "1000"))
+PATCH_DELETE_BATCH = 1000
+
+patch_collection = db["FilteredDatasetPatches"]
+
+
+async def load_patches(filtered_doc: dict, versions: list = None) -> dict:
+    """
+    Live patches of a FilteredDataset document as {column: {row: value}}.
+    ``versions`` receives the (_id, seq) of every patch read.
+    """
+    patches = {}
+    cursor = patch_collection.find({
+        "filtered_id": filtered_doc["_id"],
+        "seq": {"$gt": filtered_doc.get("compacted_seq", 0)}
+    }).sort("seq", 1)
+    async for patch in cursor:
+        patches.setdefault(patch["column"], {})[patch["row"]] = patch["value"]
+        if versions is not None:
+            versions.append((patch["_id"], patch["seq"]))
+    return patches
+
+
+def apply_patches(df: pd.DataFrame, patches: dict, start: int = 0) -> pd.DataFrame:
+    """
+    Overlay ``patches`` on ``df``, whose first row is row ``start`` of the
+    filtered dataset. Returns ``df`` untouched when nothing applies, else a copy.
+    """
+    stop = start + len(df)
+    copied = False
+    for column, cells in patches.items():
+        if column not in df.columns:
+            continue
+        hits = [(row - start, value) for row, value in cells.items() if start <= row < stop]
+        if not hits:
+            continue
+        if not copied:
+            df, copied = df.copy(), True
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+        index = df.columns.get_loc(column)
+        for position, value in hits:
+            df.iat[position, index] = value
+    return df
+
+
+async def save_patches(filtered_doc: dict, changes) -> int:
+    """
+    Store ``changes`` ([(row, column, value), ...]) as one save and return the
+    number of live patches afterwards.
+    """
+    if not changes:
+        return filtered_doc.get("patch_count", 0)
+
+    updated = await db["FilteredDataset"].find_one_and_update(
+        {"_id": filtered_doc["_id"]},
+        {"$inc": {"patch_seq": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    seq = updated["patch_seq"]
+
+    result = await patch_collection.bulk_write([
+        UpdateOne(
+            {"filtered_id": filtered_doc["_id"], "row": row, "column": column},
+            {"$set": {"value": value, "seq": seq}},
+            upsert=True
+        )
+        for row, column, value in changes
+    ], ordered=False)
+
+    updated = await db["FilteredDataset"].find_one_and_update(
+        {"_id": filtered_doc["_id"]},
+        {"$inc": {"patch_count": result.upserted_count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return updated.get("patch_count", 0)
+
+
+async def drop_patches(filtered_id):
+    await patch_collection.delete_many({"filtered_id": filtered_id})
+
+
+async def drop_patch_versions(filtered_id, versions: list) -> int:
+    """
+    Delete the patches of ``versions`` [(_id, seq)] that still hold that seq
+    (a later save overwrote the others), keeping ``patch_count`` in step.
+    Returns how many were deleted.
+    """
+    deleted = 0
+    for start in range(0, len(versions), PATCH_DELETE_BATCH):
+        batch = versions[start:start + PATCH_DELETE_BATCH]
+        result = await patch_collection.delete_many(
+            {"$or": [{"_id": patch_id, "seq": seq} for patch_id, seq in batch]}
+        )
+        deleted += result.deleted_count
+    if deleted:
+        await db["FilteredDataset"].update_one(
+            {"_id": filtered_id},
+            {"$inc": {"patch_count": -deleted}}
+        )
+    return deleted
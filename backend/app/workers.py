@@ -0,0 +1,122 @@
+"""
+Executors for dataset CPU work, so pandas never blocks the event loop.
+
+``dataset_executor.run(fn, ...)`` runs ``fn`` in a process pool. Use it for
+work whose input and output are small or live in files (CSV ingestion is
+handed a temp file path, see ``app.ingest``). ``dataset_executor.run_thread``
+runs work on frames already held by this process (the frame cache), where
+copying them to another process would cost more than the work itself; numpy,
+pandas and pyarrow release the GIL for most of it.
+
+Deliberately on threads, all after ingest:
+    - audience masks of the scan fallback (app.audience_index,
+      app.audience_stats) and the audience cube of datasets stored without one
+    - the Email deduplication across datasets and the CSV blocks of
+      compaction (app.filtered_views)
+    - page rendering and NDJSON batches (app.pagination)
+    - parsing downloaded CSV / Parquet bytes (app.dataset_io)
+Their input is the cached frame, and a process would first have to receive
+it, pickled or re-read from a file. benchmarks/bench_dataset_executor.py
+measured per call (1 CPU; "file" reads a local Parquet copy, before any
+GridFS download):
+
+    1M rows      thread   process   process, file
+    mask         17 ms    293 ms    73 ms
+    NDJSON 1000   5 ms      7 ms   130 ms
+
+Both share a bound on queued plus running tasks (DATASET_QUEUE_DEPTH) and a
+per-task timeout (DATASET_TASK_TIMEOUT seconds). A full queue answers 503, a
+timeout 504; a timed-out task keeps its slot until it actually finishes.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+
+DATASET_WORKERS = int(os.getenv("DATASET_WORKERS", str(max(1, min(4, (os.cpu_count() or 1))))))
+DATASET_THREADS = int(os.getenv("DATASET_THREADS", "4"))
+DATASET_QUEUE_DEPTH = int(os.getenv("DATASET_QUEUE_DEPTH", "32"))
+DATASET_TASK_TIMEOUT = float(os.getenv("DATASET_TASK_TIMEOUT", "300"))
+
+
+class DatasetExecutor:
+    def __init__(self, workers: int, threads: int, queue_depth: int, timeout: float):
+        self.workers = workers
+        self.threads = threads
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.pending = 0
+        self._processes = None
+        self._threads = None
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # spawn: the parent holds Motor threads, forking them is unsafe
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="dataset")
+        return self._threads
+
+    async def _submit(self, executor, fn, args, kwargs, timeout):
+        if self.pending >= self.queue_depth:
+            raise HTTPException(status_code=503, detail="Dataset workers are busy, try again shortly")
+        loop = asyncio.get_running_loop()
+        task = executor.submit(partial(fn, *args, **kwargs))
+        self.pending += 1
+        # The slot is held until the task really ends, also after a timeout
+        task.add_done_callback(lambda _: self._release_from_worker(loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(task), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # The worker finishes in the background, its result is dropped
+            raise HTTPException(status_code=504, detail="Dataset processing timed out")
+
+    def _release(self):
+        self.pending -= 1
+
+    def _release_from_worker(self, loop):
+        # A worker outliving its event loop (shutdown, tests) has no slot to return
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """Run ``fn`` (a picklable module-level function) in the process pool."""
+        return await self._submit(self.processes, fn, args, kwargs, timeout)
+
+    async def run_thread(self, fn, *args, timeout=None, **kwargs):
+        """Run ``fn`` on in-process data in the thread pool."""
+        return await self._submit(self.thread_pool, fn, args, kwargs, timeout)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "threads": self.threads,
+            "queue_depth": self.queue_depth,
+            "pending": self.pending,
+        }
+
+    def shutdown(self):
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+
+
+dataset_executor = DatasetExecutor(DATASET_WORKERS, DATASET_THREADS, DATASET_QUEUE_DEPTH, DATASET_TASK_TIMEOUT)
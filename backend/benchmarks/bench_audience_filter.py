@@ -0,0 +1,97 @@
+"""
+Compare the vectorized AudienceFilter against the old per-row age_in_range path.
+
+Run from the backend folder:
+    python -m benchmarks.bench_audience_filter --rows 10000 1000000 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.audience import filter_by_audience, parse_target
+
+TARGET = "Category: Footwear | Location: California | Gender: both | Ages: 11-18, 19-25, 60+"
+
+CATEGORIES = ["Clothing", "Footwear", "Accessories", "Outerwear"]
+LOCATIONS = ["California", "Texas", "Maine", "Kentucky", "New York", "Florida", "Ohio", "Nevada"]
+GENDERS = ["Male", "Female"]
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Email": [f"user{i}@example.com" for i in range(rows)],
+        "Age": rng.integers(10, 80, rows),
+        "Gender": rng.choice(GENDERS, rows),
+        "Category": rng.choice(CATEGORIES, rows),
+        "Location": rng.choice(LOCATIONS, rows),
+    })
+
+
+def age_in_range(age: int, target_ranges: list):
+    # The old per-row check of the dataset routes
+    for range_str in target_ranges:
+        if "+" in range_str:
+            min_age = int(range_str.replace("+", "").strip())
+            if age >= min_age:
+                return True
+        else:
+            try:
+                start, end = map(int, range_str.split("-"))
+                if start <= age <= end:
+                    return True
+            except:
+                continue
+    return False
+
+
+def legacy_filter(df: pd.DataFrame, parsed: dict) -> pd.DataFrame:
+    # The old parser kept Category / Location as one string
+    if "Category" in parsed:
+        df = df[df["Category"].str.lower() == parsed["Category"][0].lower()]
+    if "Location" in parsed:
+        df = df[df["Location"].str.lower() == parsed["Location"][0].lower()]
+    if "Gender" in parsed:
+        df = df[df["Gender"].str.lower().isin(parsed["Gender"])]
+    if "Ages" in parsed and parsed["Ages"] != "ALL":
+        df = df[df["Age"].apply(lambda x: age_in_range(int(x), parsed["Ages"]))]
+    return df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--skip-legacy-above", type=int, default=None,
+                        help="Skip the per-row path for datasets larger than this")
+    args = parser.parse_args()
+
+    parsed = parse_target(TARGET)
+    print(f"Target: {TARGET}")
+    print(f"{'rows':>12} {'dtype':>12} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+
+    for rows in args.rows:
+        base = make_frame(rows)
+        categorical = base.astype({c: "category" for c in ("Gender", "Category", "Location")})
+
+        for label, df in (("object", base), ("category", categorical)):
+            fast, fast_s = timed(filter_by_audience, df, parsed)
+
+            if args.skip_legacy_above is not None and rows > args.skip_legacy_above:
+                print(f"{rows:>12} {label:>12} {'skipped':>12} {fast_s:>15.4f} {'-':>9}")
+                continue
+
+            slow, slow_s = timed(legacy_filter, df, parsed)
+            assert slow.index.equals(fast.index), "vectorized result differs from legacy path"
+            print(f"{rows:>12} {label:>12} {slow_s:>12.4f} {fast_s:>15.4f} {slow_s / fast_s:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Thread pool vs process pool for the dataset work done on cached frames
+(audience masks and NDJSON batches, see app.workers).
+
+Run from the backend folder:
+    python -m benchmarks.bench_dataset_executor --rows 100000 1000000
+
+For every size it times, per call:
+  thread        the work on the frame held by this process
+  process       the frame pickled to a worker, the result pickled back
+  process-file  a worker reading the frame from a local Parquet file (the
+                cheapest "pass a path" variant: no GridFS download, no spill)
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.audience import compile_target
+from app.dataset_io import CATEGORICAL_COLUMNS
+from app.pagination import RowSource, _ndjson_batch, NDJSON_BATCH_ROWS
+from app.workers import dataset_executor
+
+TARGET = "Category: Footwear | Location: California | Gender: both | Ages: 11-18, 19-25, 60+"
+
+CATEGORIES = ["Clothing", "Footwear", "Accessories", "Outerwear"]
+LOCATIONS = ["California", "Texas", "Maine", "Kentucky", "New York", "Florida", "Ohio", "Nevada"]
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Email": [f"user{i}@example.com" for i in range(rows)],
+        "Age": rng.integers(10, 80, rows),
+        "Gender": rng.choice(["Male", "Female"], rows),
+        "Category": rng.choice(CATEGORIES, rows),
+        "Location": rng.choice(LOCATIONS, rows),
+        "Purchase Amount (USD)": rng.integers(10, 100, rows),
+    })
+    # As stored at ingest
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def mask_frame(df: pd.DataFrame, target: str) -> np.ndarray:
+    return compile_target(target).mask(df)
+
+
+def mask_file(path: str, target: str) -> np.ndarray:
+    filter_ = compile_target(target)
+    return filter_.mask(pd.read_parquet(path, columns=filter_.columns()))
+
+
+def ndjson_frame(rows: pd.DataFrame) -> str:
+    return _ndjson_batch(RowSource(rows), 0, len(rows))
+
+
+def ndjson_file(path: str, start: int, stop: int) -> str:
+    return _ndjson_batch(RowSource(pd.read_parquet(path).iloc[start:stop]), 0, stop - start)
+
+
+async def timed(label: str, repeat: int, call):
+    await call()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await call()
+    print(f"    {label:>13}: {(time.perf_counter() - started) / repeat * 1000:9.2f} ms")
+
+
+async def main(sizes, repeat):
+    # Start the workers before timing
+    await dataset_executor.run(len, "warm")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in sizes:
+            df = make_frame(rows)
+            path = os.path.join(folder, f"{rows}.parquet")
+            df.to_parquet(path)
+            print(f"\n{rows} rows")
+            print("  audience mask")
+            await timed("thread", repeat, lambda: dataset_executor.run_thread(mask_frame, df, TARGET))
+            await timed("process", repeat, lambda: dataset_executor.run(mask_frame, df, TARGET))
+            await timed("process-file", repeat, lambda: dataset_executor.run(mask_file, path, TARGET))
+
+            batch = df.iloc[:NDJSON_BATCH_ROWS]
+            print(f"  NDJSON batch of {NDJSON_BATCH_ROWS} rows")
+            await timed("thread", repeat, lambda: dataset_executor.run_thread(ndjson_frame, batch))
+            await timed("process", repeat, lambda: dataset_executor.run(ndjson_frame, batch))
+            await timed("process-file", repeat, lambda: dataset_executor.run(ndjson_file, path, 0, NDJSON_BATCH_ROWS))
+    dataset_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
@@ -0,0 +1,86 @@
+"""
+Latency of an unrelated endpoint while a large dataset is uploaded.
+
+Start the API first (uvicorn app.main:app), then from the backend folder:
+    python -m benchmarks.bench_upload_latency --url http://localhost:8000 --rows 2000000
+
+Probes GET / at a fixed rate, first alone and then while the generated CSV is
+uploaded to /api/datasets/upload, and prints p50/p99 of both phases. With the
+dataset work in the worker pool the two should be close.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from bson import ObjectId
+
+from benchmarks.bench_audience_filter import make_frame
+
+
+def write_csv(rows: int) -> str:
+    df = make_frame(rows)
+    df.insert(0, "Name", [f"User {i}" for i in range(rows)])
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    df.to_csv(path, index=False)
+    return path
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def summary(name: str, latencies: list):
+    ms = np.array(latencies) * 1000
+    print(f"{name:>14}: n={len(ms):5d}  p50={np.percentile(ms, 50):8.2f} ms  p99={np.percentile(ms, 99):8.2f} ms  max={ms.max():8.2f} ms")
+
+
+async def main(url: str, rows: int, baseline: float, interval: float):
+    path = write_csv(rows)
+    print(f"CSV with {rows} rows: {os.path.getsize(path) / 1e6:.1f} MB")
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            stop = asyncio.Event()
+            task = asyncio.create_task(probe(client, stop, interval))
+            await asyncio.sleep(baseline)
+            stop.set()
+            summary("idle", await task)
+
+            stop = asyncio.Event()
+            task = asyncio.create_task(probe(client, stop, interval))
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                response = await client.post(
+                    "/api/datasets/upload",
+                    data={"user_id": str(ObjectId()), "dataset_name": f"bench-{int(time.time())}"},
+                    files={"file": ("bench.csv", f, "text/csv")},
+                )
+            stop.set()
+            print(f"upload: HTTP {response.status_code} in {time.perf_counter() - start:.1f} s")
+            summary("during upload", await task)
+
+            dataset_id = response.json().get("dataset_id") if response.status_code == 200 else None
+            if dataset_id:
+                await client.delete(f"/api/datasets/{dataset_id}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--baseline", type=float, default=5.0, help="seconds of idle probing")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between probes")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.rows, args.baseline, args.interval))
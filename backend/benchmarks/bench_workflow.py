@@ -0,0 +1,158 @@
+"""
+End-to-end benchmark of the generation workflow, without paid API calls.
+
+Run from the backend folder:
+    python -m benchmarks.bench_workflow --workflows 50 --latency "chat=0.3,text=0.8,image=2,video=3"
+    python -m benchmarks.bench_workflow --workflows 20 --backend cassette --cassette recorded.jsonl
+
+Starts N concurrent run_langgraph_for_project against an in-memory Mongo
+(mongomock-motor) or --mongo-url, with the fake providers (or a recorded
+cassette), and prints p50/p95/p99 per graph node, workflows per second and
+event-loop lag. Provider rate limits are lifted so the pipeline itself is
+measured; --keep-limits applies the configured ones.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def configure(args):
+    """Environment for the backend modules; must run before they are imported."""
+    os.environ["PROVIDER_BACKEND"] = args.backend
+    os.environ["PROVIDER_FAKE_LATENCY"] = args.latency
+    os.environ["PROVIDER_CASSETTE"] = args.cassette
+    os.environ["PROVIDER_CASSETTE_MODE"] = "replay"
+    os.environ["PROVIDER_CASSETTE_LATENCY"] = "1"
+    os.environ["PREDIS_POLL_INTERVAL"] = str(args.poll_interval)
+    os.environ["PREDIS_POLL_MAX_INTERVAL"] = str(args.poll_interval * 4)
+    os.environ["AGENT_STORAGE"] = "mongo"
+    if not args.keep_limits:
+        for provider in ("GROQ", "GEMINI", "PREDIS"):
+            os.environ[f"{provider}_RPM"] = "1000000"
+            os.environ[f"{provider}_TPM"] = "0"
+            os.environ[f"{provider}_CONCURRENCY"] = str(args.workflows)
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+        return
+    try:
+        from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+    except ImportError:
+        sys.exit("mongomock-motor is needed without --mongo-url: pip install mongomock-motor")
+    import motor.motor_asyncio
+    # Kept open for the whole run (closed when garbage collected)
+    global gridfs_patch
+    gridfs_patch = enabled_gridfs_integration()
+    gridfs_patch.__enter__()
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+def product_image() -> bytes:
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (512, 512), (200, 80, 60)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+async def seed(workflows: int, output_format: str) -> list:
+    """Projects and a product image for every workflow; returns the workflow inputs."""
+    from bson import ObjectId
+    from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+    from app.db import db
+
+    bucket = AsyncIOMotorGridFSBucket(db, bucket_name="ProductImageBucket")
+    image_id = await bucket.upload_from_stream("bench.jpg", product_image())
+    user_id = ObjectId()
+    inputs = []
+    for i in range(workflows):
+        project_id, product_id = ObjectId(), ObjectId()
+        await db["Projects"].insert_one({"_id": project_id, "user_id": user_id, "name": f"bench-{i}", "status": "queued"})
+        # Distinct products so the prompt cache does not serve every workflow
+        inputs.append({
+            "user_id": str(user_id),
+            "project_id": str(project_id),
+            "product_id": str(product_id),
+            "name": f"bench-{i}",
+            "product_name": f"Bench product {i} {project_id}",
+            "description": "Lightweight running shoe with a breathable mesh upper.",
+            "product_url": "https://example.com/product",
+            "price": 99.0,
+            "discount": 10.0,
+            "image_ids": [str(image_id)],
+            "target_audience": "Location: California | Ages: 19-25",
+            "output_format": output_format,
+            "generationDone": "NotStarted",
+        })
+    return inputs
+
+
+async def loop_lag(stop: asyncio.Event, interval: float) -> list:
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+def summary(name: str, latencies: list):
+    ms = np.array(latencies) * 1000
+    print(f"{name:>18}: n={len(ms):5d}  p50={np.percentile(ms, 50):9.2f} ms  p95={np.percentile(ms, 95):9.2f} ms"
+          f"  p99={np.percentile(ms, 99):9.2f} ms  max={ms.max():9.2f} ms")
+
+
+async def main(args):
+    from GenAI.Langgraph import node_observers, run_langgraph_for_project
+
+    inputs = await seed(args.workflows, args.output_format)
+    nodes = {}
+    node_observers.append(lambda node, seconds, state, result, error: nodes.setdefault(node, []).append(seconds))
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop, args.lag_interval))
+    workflow_times = []
+
+    async def timed(project_data):
+        start = time.perf_counter()
+        result = await run_langgraph_for_project(project_data)
+        workflow_times.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    # The agents log every step; keep the report readable unless --verbose
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        results = await asyncio.gather(*(timed(data) for data in inputs))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = await lag
+
+    failed = sum(1 for r in results if r is None or (isinstance(r, dict) and "error" in r))
+    print(f"\n{args.workflows} workflows ({args.backend} providers) in {elapsed:.2f} s: "
+          f"{args.workflows / elapsed:.2f} workflows/s, {failed} failed")
+    for node in ("manager", "prompt_generator", "text_model", "image_model", "image_upload_agent", "video_model", "router"):
+        if node in nodes:
+            summary(node, nodes[node])
+    summary("workflow", workflow_times)
+    summary("event-loop lag", lags)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workflows", type=int, default=20, help="concurrent workflows")
+    parser.add_argument("--backend", choices=("fake", "cassette"), default="fake")
+    parser.add_argument("--latency", default="chat=0.3,text=0.8,image=2,video=3", help="fake provider seconds per call")
+    parser.add_argument("--cassette", default="provider_cassette.jsonl", help="recorded responses for --backend cassette")
+    parser.add_argument("--output-format", default="text, image, video")
+    parser.add_argument("--mongo-url", help="real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Predis poll interval in seconds")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="seconds between event-loop lag probes")
+    parser.add_argument("--keep-limits", action="store_true", help="apply the configured provider rate limits")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' log lines")
+    args = parser.parse_args()
+    configure(args)
+    asyncio.run(main(args))
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+from app.audience import AudienceQueryError, compile_target, normalize_target, parse_target
+
+
+def test_parse_target_clauses():
+    parsed = parse_target("Category: Footwear, Clothing | Location: California or Oregon | Gender: Female | Ages: 19-25, 40+")
+    assert parsed == {
+        "Category": ["Footwear", "Clothing"],
+        "Location": ["California", "Oregon"],
+        "Gender": ["female"],
+        "Ages": ["19-25", "40+"],
+    }
+
+
+def test_parse_target_both_genders_and_all_ages():
+    assert parse_target("Gender: both | Ages: ALL Ages") == {"Gender": ["male", "female"], "Ages": "ALL"}
+
+
+def test_parse_target_skips_empty_clauses():
+    assert parse_target("Location: Oregon | Ages: | ") == {"Location": ["Oregon"]}
+
+
+def test_parse_target_all_overrides_values_of_the_column():
+    assert parse_target("Location: Oregon | Location: ALL") == {}
+
+
+def test_parse_target_rejects_malformed_clauses():
+    with pytest.raises(AudienceQueryError):
+        parse_target("Footwear")
+    with pytest.raises(AudienceQueryError):
+        parse_target("Ages: young")
+
+
+def test_normalize_target():
+    assert normalize_target("  Gender :  Male |Ages:19 - 25 ") == "Gender:Male|Ages:19 - 25"
+
+
+def test_compile_target_is_shared_between_spellings():
+    first = compile_target("Gender: Male | Ages: 19-25")
+    assert compile_target("Gender:Male|Ages:19-25") is first
+    assert first.columns() == ["Gender", "Age"]
+
+
+@pytest.fixture
+def customers():
+    return pd.DataFrame({
+        "Gender": pd.Categorical(["Male", "Female", "male", None, "Female"]),
+        "Location": ["California", "Oregon", "california", "Oregon", "Texas"],
+        "Age": [19.7, 30, 25, 22, 60],
+        "Review Rating": [4.5, 3.0, 4.9, 2.0, 5.0],
+    })
+
+
+def test_compiled_filter_mask(customers):
+    mask = compile_target("Gender: male | Location: CALIFORNIA | Ages: 19-25").mask(customers)
+    assert mask.tolist() == [True, False, True, False, False]
+
+
+def test_compiled_filter_ranges(customers):
+    mask = compile_target("Review Rating: >=4.5 | Ages: 40+").mask(customers)
+    assert mask.tolist() == [False, False, False, False, True]
+
+
+def test_compiled_filter_without_restrictions_keeps_every_row(customers):
+    assert compile_target("Ages: ALL").mask(customers).all()
+
+
+def test_check_schema():
+    schema = [{"name": "Gender", "dtype": "category"}, {"name": "Age", "dtype": "object"}]
+    with pytest.raises(AudienceQueryError, match="no Location column"):
+        compile_target("Location: Oregon").check_schema(schema)
+    with pytest.raises(AudienceQueryError, match="not numeric"):
+        compile_target("Ages: 19-25").check_schema(schema)
+    compile_target("Gender: Male").check_schema(schema)
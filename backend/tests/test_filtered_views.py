@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from app.filtered_views import decode_rows, encode_rows
+
+
+def test_sparse_selection_is_delta_encoded():
+    positions = [3, 17, 40000, 99999]
+    view = encode_rows(positions, 100000)
+    assert view["encoding"] == "delta"
+    assert view["row_total"] == 100000
+    assert decode_rows(view).tolist() == positions
+
+
+def test_dense_selection_is_a_bitmap():
+    positions = np.arange(0, 1000, 2)
+    view = encode_rows(positions, 1001)
+    assert view["encoding"] == "bitmap"
+    assert np.array_equal(decode_rows(view), positions)
+
+
+@pytest.mark.parametrize("positions, row_total", [
+    ([], 0),
+    ([], 50),
+    ([0], 1),
+    ([49], 50),
+    (list(range(50)), 50),
+])
+def test_round_trip_edges(positions, row_total):
+    decoded = decode_rows(encode_rows(positions, row_total))
+    assert decoded.dtype == np.int64
+    assert decoded.tolist() == positions
+
+
+def test_large_random_selection_round_trips():
+    rng = np.random.default_rng(7)
+    for density in (0.001, 0.03, 0.5):
+        positions = np.flatnonzero(rng.random(200000) < density)
+        assert np.array_equal(decode_rows(encode_rows(positions, 200000)), positions)
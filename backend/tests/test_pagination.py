@@ -0,0 +1,58 @@
+import asyncio
+import json
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from app.pagination import RowSource, _decode_cursor, _encode_cursor, rows_response
+
+
+def test_cursor_round_trip():
+    cursor = _encode_cursor(500, "dataset-v1", 3900)
+    assert ":" not in cursor and "=" not in cursor
+    assert _decode_cursor(cursor, "dataset-v1", 3900) == 500
+
+
+def test_no_cursor_starts_at_the_beginning():
+    assert _decode_cursor(None, "dataset-v1", 3900) == 0
+
+
+@pytest.mark.parametrize("cursor", ["500", "not a cursor!", "", "LTE6YWJj"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        _decode_cursor(cursor, "dataset-v1", 3900)
+    assert error.value.status_code == 400
+    assert error.value.detail == "Invalid cursor"
+
+
+@pytest.mark.parametrize("version, total", [("dataset-v2", 3900), ("dataset-v1", 3899)])
+def test_cursor_of_an_older_version_is_rejected(version, total):
+    cursor = _encode_cursor(500, "dataset-v1", 3900)
+    with pytest.raises(HTTPException) as error:
+        _decode_cursor(cursor, version, total)
+    assert error.value.status_code == 400
+    assert "older version" in error.value.detail
+
+
+def ndjson_lines(source, **kwargs) -> list:
+    async def stream():
+        response = await rows_response(source, format="ndjson", version="v1", **kwargs)
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    return [json.loads(line) for line in asyncio.run(stream()).splitlines()]
+
+
+def test_ndjson_page_ends_with_the_next_cursor():
+    source = RowSource(pd.DataFrame({"Email": [f"user{i}@example.com" for i in range(5)], "Age": range(5)}), columns=["Email"])
+    lines = ndjson_lines(source, limit=2)
+    assert lines[:2] == [{"Email": "user0@example.com"}, {"Email": "user1@example.com"}]
+    assert _decode_cursor(lines[2]["next_cursor"], "v1", 5) == 2
+    assert len(lines) == 3
+
+
+def test_ndjson_last_page_has_no_next_cursor():
+    lines = ndjson_lines(RowSource(pd.DataFrame({"Age": range(3)})))
+    assert lines == [{"Age": 0}, {"Age": 1}, {"Age": 2}, {"next_cursor": None}]
+
+
+def test_ndjson_of_no_rows_is_only_the_trailer():
+    assert ndjson_lines(RowSource(pd.DataFrame({"Age": []}))) == [{"next_cursor": None}]
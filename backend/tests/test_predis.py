@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from GenAI import predis, rate_limit
+from GenAI.predis import LocalPredis, VideoPoller
+from GenAI.rate_limit import ProviderLimiter
+
+
+@pytest.fixture(autouse=True)
+def unlimited_predis(monkeypatch):
+    # The configured 30 requests/min would make the polls wait
+    monkeypatch.setitem(rate_limit.limiters, "predis", ProviderLimiter("predis", 1000000, 0, 10))
+
+
+def test_one_poll_resolves_every_outstanding_post():
+    async def scenario():
+        api = LocalPredis(delay=0)
+        poller = VideoPoller(api, interval=0.01)
+        post_ids = [await api.create_video(f"video {i}") for i in range(3)]
+        urls = await asyncio.gather(*(poller.wait_for(post_id, timeout=2) for post_id in post_ids))
+        return api, poller, post_ids, urls
+
+    api, poller, post_ids, urls = asyncio.run(scenario())
+    assert urls == [f"https://videos.local/{post_id}.mp4" for post_id in post_ids]
+    assert api.calls["get_posts"] == 1
+    assert poller.pending == {}
+
+
+def test_post_older_than_the_first_page_is_found():
+    async def scenario():
+        api = LocalPredis(delay=0)
+        poller = VideoPoller(api, interval=0.01, page_size=2, max_pages=5)
+        old = await api.create_video("old")
+        for i in range(5):
+            await api.create_video(f"newer {i}")
+        return api, old, await poller.wait_for(old, timeout=2)
+
+    api, old, url = asyncio.run(scenario())
+    assert url == f"https://videos.local/{old}.mp4"
+    # Newest first, two per page: the old post is on page 3
+    assert api.calls["get_posts"] == 3
+
+
+def test_backoff_grows_while_idle_and_resets_on_progress(monkeypatch):
+    poller = VideoPoller(LocalPredis(), interval=1, max_interval=3)
+    poller.pending = {"post": None}
+    results = [0, 0, 0, 1]
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    async def scripted_poll():
+        if not results:
+            poller.pending.clear()
+            return 0
+        return results.pop(0)
+
+    monkeypatch.setattr(predis.asyncio, "sleep", fake_sleep)
+    poller.poll_once = scripted_poll
+    asyncio.run(poller._run())
+    assert sleeps == [1, 1.5, 2.25, 3, 1]
+
+
+def test_poll_failure_backs_off_and_keeps_polling(monkeypatch):
+    poller = VideoPoller(LocalPredis(), interval=1, max_interval=10)
+    poller.pending = {"post": None}
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    async def failing_poll():
+        if len(sleeps) == 3:
+            poller.pending.clear()
+            return 0
+        raise RuntimeError("Predis is down")
+
+    monkeypatch.setattr(predis.asyncio, "sleep", fake_sleep)
+    poller.poll_once = failing_poll
+    asyncio.run(poller._run())
+    assert sleeps == [1, 1.5, 2.25]
+
+
+def test_wait_for_timeout_does_not_cancel_the_shared_poll():
+    async def scenario():
+        api = LocalPredis(delay=0.2)
+        poller = VideoPoller(api, interval=0.01, max_interval=0.02)
+        slow, other = await api.create_video("slow"), await api.create_video("other")
+        waiting = asyncio.create_task(poller.wait_for(other, timeout=2))
+        timed_out = await poller.wait_for(slow, timeout=0.05)
+        task = poller._task
+        still_polling = not task.done()
+        url = await waiting
+        await task
+        return other, timed_out, still_polling, url, task, poller
+
+    other, timed_out, still_polling, url, task, poller = asyncio.run(scenario())
+    assert timed_out is None
+    assert still_polling
+    assert url == f"https://videos.local/{other}.mp4"
+    assert not task.cancelled()
+    # Nothing left to watch: the poller stopped
+    assert poller.snapshot() == {"pending": 0, "running": False}
+
+
+def test_failed_post_resolves_to_none():
+    class FailingPredis(LocalPredis):
+        async def get_posts(self, page, items):
+            return [{"post_id": post["post_id"], "status": "error", "generated_media": []} for post in self.posts]
+
+    async def scenario():
+        api = FailingPredis()
+        poller = VideoPoller(api, interval=0.01)
+        return await poller.wait_for(await api.create_video("broken"), timeout=2)
+
+    assert asyncio.run(scenario()) is None
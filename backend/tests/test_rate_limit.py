@@ -0,0 +1,130 @@
+import asyncio
+import time
+import pytest
+from GenAI import rate_limit
+from GenAI.rate_limit import ProviderLimiter, TokenBucket, call_provider, retry_after_of
+
+
+class RateLimited(Exception):
+    status = 429
+
+    def __init__(self, retry_after: str):
+        super().__init__("429 Too Many Requests")
+        self.headers = {"Retry-After": retry_after}
+
+
+def test_token_bucket_starts_full():
+    bucket = TokenBucket(60)
+    assert bucket.level == 60
+    assert bucket.wait_time(1) == 0.0
+
+
+def test_token_bucket_wait_and_refill():
+    bucket = TokenBucket(60)
+    bucket.level = 0
+    # 60 per minute is one per second
+    assert bucket.wait_time(2) == pytest.approx(2.0)
+    bucket.refill(bucket.updated + 1.5)
+    assert bucket.level == pytest.approx(1.5)
+    bucket.refill(bucket.updated + 3600)
+    assert bucket.level == 60
+
+
+def test_token_bucket_oversized_request_waits_for_a_full_bucket():
+    bucket = TokenBucket(60)
+    bucket.level = 30
+    assert bucket.wait_time(1000) == pytest.approx(30.0)
+
+
+def test_limiter_waits_for_the_request_bucket():
+    limiter = ProviderLimiter("test", 600, 0, 2)
+    limiter.requests.level = 0
+
+    async def call():
+        return await limiter.run(lambda: "done")
+
+    started = time.monotonic()
+    assert asyncio.run(call()) == "done"
+    # 600 per minute refills one request in 0.1 s
+    assert time.monotonic() - started >= 0.09
+    assert limiter.stats["calls"] == 1
+    assert limiter.stats["wait_seconds"] > 0
+
+
+def test_limiter_charges_tokens():
+    limiter = ProviderLimiter("test", 600, 1000, 2)
+
+    async def call():
+        return await limiter.run(lambda: "done", tokens=400)
+
+    asyncio.run(call())
+    assert limiter.tokens.level == pytest.approx(600, abs=1)
+
+
+def test_limiter_caps_calls_in_flight():
+    limiter = ProviderLimiter("test", 1000000, 0, 2)
+    running = []
+    peak = []
+
+    async def work():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def scenario():
+        await asyncio.gather(*(limiter.run(work) for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert max(peak) == 2
+
+
+def test_throttle_lowers_rate_and_success_restores_it():
+    limiter = ProviderLimiter("test", 100, 0, 1)
+    limiter.throttled(5)
+    assert limiter.requests.capacity == pytest.approx(70)
+    assert limiter.paused_until > time.monotonic() + 4
+    for _ in range(3):
+        limiter.throttled(0)
+    # Never below a tenth of the configured rate
+    limiter._set_rpm(5)
+    limiter.throttled(0)
+    assert limiter.requests.capacity == pytest.approx(10)
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.requests.capacity == 100
+
+
+def test_retry_after_of():
+    assert retry_after_of(RateLimited("7")) == 7.0
+    assert retry_after_of(RateLimited("soon")) == 0.0
+    assert retry_after_of(ValueError("boom")) is None
+
+
+def test_call_provider_retries_rate_limited_calls(monkeypatch):
+    limiter = ProviderLimiter("test", 1000000, 0, 2)
+    monkeypatch.setitem(rate_limit.limiters, "test", limiter)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited("0.05")
+        return "ok"
+
+    assert asyncio.run(call_provider("test", flaky)) == "ok"
+    assert len(attempts) == 2
+    assert limiter.stats["rate_limited"] == 1
+
+
+def test_call_provider_raises_other_errors_at_once(monkeypatch):
+    limiter = ProviderLimiter("test", 1000000, 0, 2)
+    monkeypatch.setitem(rate_limit.limiters, "test", limiter)
+
+    async def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_provider("test", broken))
+    assert limiter.stats["failures"] == 1
+    assert limiter.stats["rate_limited"] == 0